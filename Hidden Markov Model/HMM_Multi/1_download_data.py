@@ -1,21 +1,18 @@
 import yfinance as yf
 import pandas as pd
 import os
+from price_store import store_path_for, write_price_store
 from config import (
     TICKER,
     DATA_START_DATE,
     DATA_END_DATE,
-    DATA_DIR,
     DATA_FILE
 )
 
-def download_spy_data():
-    ticker_symbol = TICKER
-    start_date = DATA_START_DATE
-    end_date = DATA_END_DATE
-    output_folder = DATA_DIR
-    output_file = f"{TICKER}.csv"
-    output_path = DATA_FILE
+def download_ticker_data(ticker_symbol: str, start_date: str = DATA_START_DATE,
+                         end_date: str = DATA_END_DATE, output_path: str = DATA_FILE) -> pd.DataFrame:
+    """Download one ticker, add returns and save as CSV plus columnar store."""
+    output_folder = os.path.dirname(output_path) or "."
 
     print(f"--- Starting Download for {ticker_symbol} ---")
     print(f"Period: {start_date} to {end_date}")
@@ -33,13 +30,28 @@ def download_spy_data():
     df['return'] = df['Adj Close'].pct_change()
 
     if df.empty:
-        print("Error: No data downloaded.")
-        return
+        raise ValueError(f"No data downloaded for {ticker_symbol}")
 
     df.to_csv(output_path)
     
+    # Columnar copy for fast, memory-mapped loading by later stages
+    store_dir = store_path_for(output_path)
+    write_price_store(df, store_dir)
+    
     print(f"\nSuccess! Data saved to: {output_path}")
+    print(f"Columnar store saved to: {store_dir}")
     print(f"Rows downloaded: {len(df)}")
+    
+    return df
+
+
+def download_spy_data():
+    try:
+        df = download_ticker_data(TICKER, DATA_START_DATE, DATA_END_DATE, DATA_FILE)
+    except ValueError:
+        print("Error: No data downloaded.")
+        return
+
     print(df.head())
 
 if __name__ == "__main__":
@@ -2,42 +2,61 @@
 Multivariate Gaussian HMM Training
 - Observations: [adjusted_return, wavelet_energy]
 - Train on data up to end of 2024
+- Optional EM restarts with different seeds, run in parallel
+- Optional shared model over many tickers (batched multi-sequence Baum-Welch)
 """
 
+import os
+import time
+
 import numpy as np
 import pandas as pd
 from hmmlearn.hmm import GaussianHMM
-import pickle
-import os
-from wavelet_features import extract_wavelet_features
+from feature_cache import load_feature_bank
+from hmm_inference import predict_prefix_states
+from price_store import load_price_data
+from model_store import save_model
+from batch_hmm import fit_batch_hmm
+from instrumentation import count, timer
+from worker_pool import worker_pool
 from config import (
     DATA_FILE,
     MODEL_FILE,
-    MODEL_DIR,
     TRAIN_END_DATE,
     N_STATES,
     WINDOW,
     SCALE,
+    SCALES,
     N_ITER,
-    RANDOM_STATE
+    RANDOM_STATE,
+    N_INIT,
+    MAX_WORKERS,
+    SHARED_MODEL_FILE,
+    USE_FEATURE_CACHE
 )
 
-# Rename the import to avoid confusion
-from wavelet_features import extract_wavelet_features as compute_wavelet_features
 
-
-def prepare_observations(df: pd.DataFrame, window: int = 60, scale: float = 10.0) -> tuple:
+def prepare_observations(df: pd.DataFrame, window: int = 60, scale: float = 10.0,
+                         scales: list = None, use_cache: bool = USE_FEATURE_CACHE) -> tuple:
     """
-    Prepare observation matrix [return, wavelet_energy] for HMM.
+    Prepare observation matrix [return, wavelet_energy, ...] for HMM.
+    
+    Args:
+        scales: Optional list of wavelet scales; when given, one energy
+                column per scale is computed in a single feature-bank pass
+                and `scale` is ignored
+        use_cache: Serve energies from the on-disk feature cache
     
     Returns:
-        observations: (N, 2) array
+        observations: (N, 1 + n_scales) array
         valid_index: DatetimeIndex of valid observations
     """
     returns = df['return'].values
     
-    # Extract wavelet energies
-    energies = compute_wavelet_features(returns, window=window, scale=scale)
+    # Extract wavelet energies (reused from the feature cache when possible)
+    if scales is None:
+        scales = [scale]
+    energies = load_feature_bank(returns, window=window, scales=scales, use_cache=use_cache)
     
     # Combine into observation matrix
     obs = np.column_stack([returns, energies])
@@ -51,30 +70,118 @@ def prepare_observations(df: pd.DataFrame, window: int = 60, scale: float = 10.0
     return valid_obs, valid_index
 
 
-def train_hmm(observations: np.ndarray, n_states: int = N_STATES, n_iter: int = N_ITER,
-              random_state: int = RANDOM_STATE) -> GaussianHMM:
+def fit_restart(observations: np.ndarray, n_states: int = N_STATES, n_iter: int = N_ITER,
+                random_state: int = RANDOM_STATE, verbose: bool = False) -> dict:
     """
-    Train a Gaussian HMM on the observations.
-    
-    Args:
-        observations: (N, 2) array of [return, energy]
-        n_states: Number of hidden states
-        n_iter: Max EM iterations
-        random_state: For reproducibility
+    Run EM once from the initialization given by `random_state`.
     
     Returns:
-        Trained GaussianHMM model
+        dict with model, seed, log_likelihood, em_iterations, converged, fit_sec
     """
+    start_time = time.time()
+    
     model = GaussianHMM(
         n_components=n_states,
         covariance_type="full",  # Full covariance to capture return-energy correlation
         n_iter=n_iter,
         random_state=random_state,
-        verbose=True
+        verbose=verbose
     )
     
     model.fit(observations)
     
+    return {
+        'model': model,
+        'seed': random_state,
+        'log_likelihood': model.score(observations),
+        'em_iterations': model.monitor_.iter,
+        'converged': model.monitor_.converged,
+        'fit_sec': time.time() - start_time
+    }
+
+
+def train_hmm(observations: np.ndarray, n_states: int = N_STATES, n_iter: int = N_ITER,
+              random_state: int = RANDOM_STATE, verbose: bool = True,
+              n_init: int = N_INIT, max_workers: int = MAX_WORKERS) -> GaussianHMM:
+    """
+    Train a Gaussian HMM on the observations.
+    
+    With n_init > 1, EM is restarted from seeds random_state,
+    random_state + 1, ... in parallel and the fit with the highest
+    log-likelihood is kept (ties go to the lowest seed).
+    
+    Args:
+        observations: (N, n_features) array of [return, energy, ...]
+        n_states: Number of hidden states
+        n_iter: Max EM iterations
+        random_state: For reproducibility (seed of the first restart)
+        verbose: Print EM convergence progress (single fit only; with
+                 n_init > 1 every restart's score is always printed)
+        n_init: Number of EM restarts
+        max_workers: Process pool size for the restarts (1 = sequential,
+                     e.g. when already running inside a worker)
+    
+    Returns:
+        Trained GaussianHMM model
+    """
+    if n_init <= 1:
+        with timer("em_fit"):
+            result = fit_restart(observations, n_states, n_iter, random_state, verbose)
+        count("em_fits")
+        count("em_iterations", result['em_iterations'])
+        return result['model']
+    
+    seeds = [random_state + i for i in range(n_init)]
+    
+    with timer("em_fit"):
+        if max_workers == 1:
+            restarts = [fit_restart(observations, n_states, n_iter, seed) for seed in seeds]
+        else:
+            with worker_pool(max_workers=max_workers) as pool:
+                futures = [pool.submit(fit_restart, observations, n_states, n_iter, seed)
+                           for seed in seeds]
+                restarts = [future.result() for future in futures]
+    
+    # Counted here: restarts run in worker processes have their own counters
+    count("em_fits", len(restarts))
+    count("em_iterations", sum(r['em_iterations'] for r in restarts))
+    
+    best = max(restarts, key=lambda r: r['log_likelihood'])  # First maximum wins
+    
+    print(f"EM restarts: {n_init}")
+    print(f"  {'Seed':>6} {'Log-likelihood':>16} {'Iterations':>11} {'Converged':>10} {'Time':>8}")
+    for r in restarts:
+        marker = "  <- best" if r is best else ""
+        print(f"  {r['seed']:>6} {r['log_likelihood']:>16.4f} {r['em_iterations']:>11} "
+              f"{str(r['converged']):>10} {r['fit_sec']:>7.2f}s{marker}")
+    
+    return best['model']
+
+
+def train_hmm_batch(sequences: list, n_states: int = N_STATES, n_iter: int = N_ITER,
+                    random_state: int = RANDOM_STATE, verbose: bool = True,
+                    max_workers: int = MAX_WORKERS):
+    """
+    Train one Gaussian HMM on many observation sequences (e.g. one per ticker).
+    
+    Alternative to train_hmm for multi-sequence data: batched Baum-Welch
+    (batch_hmm.py) with the E-step split across worker processes.
+    
+    Args:
+        sequences: List of (T_i, n_features) normalized observation arrays
+        max_workers: Process pool size for the E-step (1 = in-process)
+    
+    Returns:
+        Trained GaussianHMMParams model
+    """
+    model, info = fit_batch_hmm(sequences, n_states=n_states, n_iter=n_iter,
+                                random_state=random_state, max_workers=max_workers,
+                                verbose=verbose)
+    
+    print(f"Batched EM: {len(sequences)} sequences, {sum(len(s) for s in sequences)} rows, "
+          f"{info['em_iterations']} iterations, converged={info['converged']}, "
+          f"log-likelihood={info['history'][-1]:.4f}, {info['fit_sec']:.1f}s")
+    
     return model
 
 
@@ -85,10 +192,11 @@ def analyze_states(model: GaussianHMM, n_states: int):
     print("="*60)
     
     for i in range(n_states):
-        mean_ret, mean_energy = model.means_[i]
+        mean_ret, mean_energies = model.means_[i][0], model.means_[i][1:]
         print(f"\nState {i}:")
         print(f"  Mean Return:  {mean_ret*100:+.4f}% daily")
-        print(f"  Mean Energy:  {mean_energy:.6f}")
+        for mean_energy in mean_energies:
+            print(f"  Mean Energy:  {mean_energy:.6f}")
         print(f"  Covariance:\n{model.covars_[i]}")
     
     print("\nTransition Matrix:")
@@ -114,27 +222,39 @@ def analyze_states(model: GaussianHMM, n_states: int):
     return state_labels
 
 
-def main():
-    # Configuration from config.py
-    DATA_PATH = DATA_FILE
-    MODEL_PATH = MODEL_FILE
-    TRAIN_END = TRAIN_END_DATE
-
+def train_and_save(data_path: str = DATA_FILE, model_path: str = MODEL_FILE,
+                   train_end: str = TRAIN_END_DATE, n_states: int = N_STATES,
+                   window: int = WINDOW, scale: float = SCALE, scales: list = SCALES,
+                   verbose: bool = True, df: pd.DataFrame = None,
+                   n_init: int = N_INIT, max_workers: int = MAX_WORKERS) -> tuple:
+    """
+    Load training data, fit the HMM and save the model file.
+    
+    Args:
+        df: Already loaded price data (skips reading data_path)
+        n_init: Number of EM restarts (best log-likelihood kept)
+        max_workers: Process pool size for the restarts
+    
+    Returns:
+        model_data: Saved dict (model, normalization params, labels, config)
+        train_obs_normalized: (N, n_features) normalized training observations
+    """
     # Create models directory
-    os.makedirs(MODEL_DIR, exist_ok=True)
+    os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
     
-    # Load data
+    # Load data (training range of the return column only)
     print("Loading data...")
-    df = pd.read_csv(DATA_PATH, index_col="Date", parse_dates=True)
-    
-    # Split train/test
-    train_df = df[df.index <= TRAIN_END]
+    if df is None:
+        train_df = load_price_data(data_path, columns=['return'], end=train_end)
+    else:
+        train_df = df.loc[df.index <= train_end, ['return']]
     print(f"Training period: {train_df.index[0].date()} to {train_df.index[-1].date()}")
     print(f"Training samples: {len(train_df)}")
     
     # Prepare observations
     print("\nPreparing observations...")
-    train_obs, train_index = prepare_observations(train_df, window=WINDOW, scale=SCALE)
+    train_obs, train_index = prepare_observations(train_df, window=window, scale=scale,
+                                                  scales=scales)
     print(f"Valid observations: {len(train_obs)}")
     
     # Normalize observations for better HMM convergence
@@ -144,10 +264,11 @@ def main():
     
     # Train HMM
     print("\nTraining HMM...")
-    model = train_hmm(train_obs_normalized, n_states=N_STATES)
+    model = train_hmm(train_obs_normalized, n_states=n_states, verbose=verbose,
+                      n_init=n_init, max_workers=max_workers)
     
     # Analyze states
-    state_labels = analyze_states(model, N_STATES)
+    state_labels = analyze_states(model, n_states)
     
     # Save model and normalization params
     model_data = {
@@ -156,25 +277,98 @@ def main():
         'obs_std': obs_std,
         'state_labels': state_labels,
         'config': {
-            'n_states': N_STATES,
-            'window': WINDOW,
-            'scale': SCALE,
-            'train_end': TRAIN_END
+            'n_states': n_states,
+            'window': window,
+            'scale': scale,
+            'scales': list(scales),
+            'train_end': train_end,
+            'n_init': n_init
         }
     }
     
-    with open(MODEL_PATH, 'wb') as f:
-        pickle.dump(model_data, f)
+    save_model(model_data, model_path)
+    
+    print(f"\nModel saved to: {model_path}")
     
-    print(f"\nModel saved to: {MODEL_PATH}")
+    return model_data, train_obs_normalized
+
+
+def train_shared_and_save(data_paths: list, model_path: str = SHARED_MODEL_FILE,
+                          train_end: str = TRAIN_END_DATE, n_states: int = N_STATES,
+                          window: int = WINDOW, scale: float = SCALE, scales: list = SCALES,
+                          verbose: bool = True, max_workers: int = MAX_WORKERS) -> dict:
+    """
+    Fit one shared regime model to several tickers' training data and save it.
+    
+    Every ticker contributes its own observation sequence; all sequences
+    are normalized with the pooled mean and std.
+    
+    Args:
+        data_paths: Price data file (or store) of each ticker
+    
+    Returns:
+        model_data: Saved dict (model, normalization params, labels, config)
+    """
+    print(f"Loading {len(data_paths)} training sequences...")
+    sequences = []
+    for path in data_paths:
+        train_df = load_price_data(path, columns=['return'], end=train_end)
+        obs, _ = prepare_observations(train_df, window=window, scale=scale, scales=scales)
+        sequences.append(obs)
+    
+    pooled = np.concatenate(sequences)
+    obs_mean = pooled.mean(axis=0)
+    obs_std = pooled.std(axis=0)
+    
+    print("\nTraining shared HMM...")
+    model = train_hmm_batch([(obs - obs_mean) / obs_std for obs in sequences],
+                            n_states=n_states, verbose=verbose, max_workers=max_workers)
+    
+    state_labels = analyze_states(model, n_states)
+    
+    model_data = {
+        'model': model,
+        'obs_mean': obs_mean,
+        'obs_std': obs_std,
+        'state_labels': state_labels,
+        'config': {
+            'n_states': n_states,
+            'window': window,
+            'scale': scale,
+            'scales': list(scales),
+            'train_end': train_end,
+            'n_sequences': len(sequences)
+        }
+    }
+    
+    save_model(model_data, model_path)
+    print(f"\nShared model saved to: {model_path}")
+    
+    return model_data
+
+
+def main():
+    # Configuration from config.py
+    model_data, train_obs_normalized = train_and_save()  # Uses config defaults
+    model = model_data['model']
     
     # Quick validation: decode training states
     train_states = model.predict(train_obs_normalized)
     print(f"\nTraining state distribution:")
     for i in range(N_STATES):
-        count = np.sum(train_states == i)
-        pct = count / len(train_states) * 100
-        print(f"  State {i}: {count} days ({pct:.1f}%)")
+        n_days = np.sum(train_states == i)
+        pct = n_days / len(train_states) * 100
+        print(f"  State {i}: {n_days} days ({pct:.1f}%)")
+    
+    # Causal decode: the state the backtest would have seen on each day
+    causal_states = predict_prefix_states(model, train_obs_normalized)
+    agreement = np.mean(causal_states == train_states) * 100
+    print(f"\nCausal (prefix Viterbi) state distribution:")
+    for i in range(N_STATES):
+        n_days = np.sum(causal_states == i)
+        pct = n_days / len(causal_states) * 100
+        print(f"  State {i}: {n_days} days ({pct:.1f}%)")
+    print(f"  Agreement with full-sequence Viterbi: {agreement:.1f}%")
 
 
 if __name__ == "__main__":
@@ -7,9 +7,16 @@ Backtest HMM Strategy on 2025 Data
 
 import numpy as np
 import pandas as pd
-import pickle
 import os
-from wavelet_features import extract_wavelet_features
+from feature_cache import load_feature_bank
+from hmm_inference import predict_prefix_states, filter_smooth
+from price_store import load_price_data
+from backtest_engine import run_array_engine
+from model_store import load_model
+from instrumentation import timer
+from bootstrap import bootstrap_metrics
+from posterior_archive import archive_path_for, build_archive, save_posteriors, \
+    load_posteriors, posterior_summary
 from config import (
     DATA_FILE,
     MODEL_FILE,
@@ -18,7 +25,8 @@ from config import (
     TEST_START_DATE,
     INITIAL_CAPITAL,
     MAX_POSITION_PCT,
-    STOP_LOSS_PCT
+    STOP_LOSS_PCT,
+    BOOTSTRAP_PATHS
 )
 
 
@@ -144,10 +152,10 @@ class RegimeHMMRiskManager:
 class HMMStrategy:
     """HMM-based trading strategy."""
     
-    def __init__(self, model_path: str):
-        """Load trained model."""
-        with open(model_path, 'rb') as f:
-            model_data = pickle.load(f)
+    def __init__(self, model_path: str = None, model_data: dict = None):
+        """Load trained model (from file, or an already loaded model dict)."""
+        if model_data is None:
+            model_data = load_model(model_path)
         
         self.model = model_data['model']
         self.obs_mean = model_data['obs_mean']
@@ -179,6 +187,32 @@ class HMMStrategy:
         states = self.model.predict(obs_norm)
         return states[-1]
     
+    def predict_states(self, observations: np.ndarray) -> np.ndarray:
+        """
+        Predict the current state for every day in one forward pass.
+        
+        Equivalent to calling predict_state(observations[:t+1]) for each t,
+        but O(N) instead of O(N^2).
+        
+        Returns:
+            Array of predicted states, one per observation row
+        """
+        obs_norm = (observations - self.obs_mean) / self.obs_std
+        return predict_prefix_states(self.model, obs_norm)
+    
+    def state_probabilities(self, observations: np.ndarray) -> tuple:
+        """
+        Filtered and smoothed state probabilities for every observation row.
+        
+        Returns:
+            filtered: (N, K) causal probabilities (observations up to each row)
+            smoothed: (N, K) probabilities given the whole sequence
+            loglik: (N,) log-likelihood contribution of each row
+        """
+        obs_norm = (observations - self.obs_mean) / self.obs_std
+        return filter_smooth(self.model.startprob_, self.model.transmat_,
+                             self.model._compute_log_likelihood(obs_norm))
+    
     def get_regime(self, current_state: int) -> int:
         """
         Convert HMM state to regime.
@@ -206,23 +240,51 @@ class HMMStrategy:
 
 def run_backtest(data_path: str = DATA_FILE,
                  model_path: str = MODEL_FILE,
-                 test_start: str = TEST_START_DATE):
+                 test_start: str = TEST_START_DATE,
+                 decode: str = 'prefix',
+                 model_data: dict = None,
+                 features: np.ndarray = None,
+                 stop_loss_pct: float = STOP_LOSS_PCT,
+                 engine: str = 'array',
+                 df: pd.DataFrame = None,
+                 with_metrics: bool = True,
+                 archive_path: str = None):
     """
     Run backtest with regime-aware risk manager.
+    
+    Args:
+        decode: 'prefix' decodes every day's state in a single forward pass,
+                'per_day' re-runs Viterbi on the full history each day (slow,
+                kept as the reference implementation)
+        model_data: Already loaded model dict (skips reading model_path)
+        features: Precomputed wavelet feature bank, one row per row of the
+                  price data (skips feature extraction)
+        stop_loss_pct: Stop loss threshold for the risk manager
+        engine: 'array' runs the trading state machine over NumPy arrays
+                (backtest_engine.py), 'loop' steps RegimeHMMRiskManager
+                one day at a time (reference implementation)
+        df: Already loaded price data (skips reading data_path)
+        with_metrics: False skips calculate_metrics and returns None for the
+                      metrics (e.g. to evaluate many results at once with
+                      metrics_engine.py)
+        archive_path: Also write the per-day state posterior archive
+                      (posterior_archive.py) to this file
     """
-    # Load data
-    df = pd.read_csv(data_path, index_col="Date", parse_dates=True)
+    # Load data (only the columns the backtest uses)
+    if df is None:
+        df = load_price_data(data_path, columns=['Adj Close', 'return'])
 
     # Get config from model
-    with open(model_path, 'rb') as f:
-        model_data = pickle.load(f)
+    if model_data is None:
+        model_data = load_model(model_path)
     config = model_data['config']
     window = config['window']
     scale = config['scale']
+    scales = config.get('scales', [scale])  # Older models: single scale
 
     # Initialize
-    strategy = HMMStrategy(model_path)
-    risk_mgr = RegimeHMMRiskManager()  # Uses config defaults
+    strategy = HMMStrategy(model_data=model_data)
+    risk_mgr = RegimeHMMRiskManager(stop_loss_pct=stop_loss_pct)
     
     # Get test period data (need lookback for wavelet)
     test_df = df[df.index >= test_start].copy()
@@ -234,11 +296,92 @@ def run_backtest(data_path: str = DATA_FILE,
     print(f"\nBacktest period: {test_df.index[0].date()} to {test_df.index[-1].date()}")
     print(f"Test days: {len(test_df)}")
     
-    # Compute wavelet features for full period
+    # Compute wavelet features for full period (one column per scale)
     returns = full_df['return'].values
-    energies = extract_wavelet_features(returns, window=window, scale=scale)
-    full_df['energy'] = energies
+    if features is None:
+        energies = load_feature_bank(returns, window=window, scales=scales)
+    else:
+        # Same as extracting on full_df alone: its first window-1 rows have no full window
+        energies = np.array(features[lookback_start:], dtype=float).reshape(len(full_df), -1)
+        energies[:window - 1] = np.nan
+    full_df['energy'] = energies[:, 0]
+    
+    # Valid observation rows (no NaN) and how many are available up to each day
+    obs_all = np.column_stack([returns, energies])
+    valid_mask = ~np.isnan(obs_all).any(axis=1)
+    valid_obs_all = obs_all[valid_mask]
+    n_valid_through = np.cumsum(valid_mask)
+    test_positions = full_df.index.get_indexer(test_df.index)
+    
+    # Days with enough valid history to trade, and the last valid row of each
+    day_n_valid = n_valid_through[test_positions]
+    tradable = day_n_valid >= window
+    day_n_valid = day_n_valid[tradable]
+    
+    # Decode the state of every tradable day
+    with timer(f"decode_states.{decode}"):
+        if decode == 'prefix':
+            # All days at once (last Viterbi state of every prefix)
+            prefix_states = strategy.predict_states(valid_obs_all)
+            states = prefix_states[day_n_valid - 1]
+        elif decode == 'per_day':
+            states = np.array([strategy.predict_state(valid_obs_all[:n]) for n in day_n_valid])
+        else:
+            raise ValueError(f"Unknown decode mode: {decode}")
+    
+    regimes = np.array([strategy.get_regime(state) for state in states])
+    day_energies = valid_obs_all[day_n_valid - 1, 1]
+    
+    # Run the risk manager through the test period
+    with timer(f"trade_engine.{engine}"):
+        if engine == 'array':
+            results_df, order_stats = run_array_engine(test_df[tradable], states, regimes,
+                                                       day_energies, risk_mgr)
+        elif engine == 'loop':
+            results_df, order_stats = simulate_trades(test_df[tradable], states, regimes,
+                                                      day_energies, strategy, risk_mgr)
+        else:
+            raise ValueError(f"Unknown engine: {engine}")
+    
+    if archive_path is not None:
+        # Same history as the decoder; days without a new observation add no likelihood
+        with timer("state_posteriors"):
+            filtered, smoothed, loglik = strategy.state_probabilities(valid_obs_all)
+            rows = day_n_valid - 1
+            day_loglik = np.where(valid_mask[test_positions][tradable], loglik[rows], np.nan)
+            regime_map = [strategy.get_regime(state) for state in range(strategy.model.n_components)]
+            save_posteriors(build_archive(results_df.index, filtered[rows], smoothed[rows],
+                                          day_loglik, states, regime_map, model_data),
+                            archive_path)
+    
+    print(f"\nOrder Statistics:")
+    print(f"  Orders executed: {order_stats['orders_executed']}")
+    print(f"  Orders blocked:  {order_stats['orders_blocked']}")
     
+    # Calculate metrics
+    metrics = calculate_metrics(results_df, risk_mgr.initial_capital) if with_metrics else None
+    
+    return results_df, metrics
+
+
+def simulate_trades(days_df: pd.DataFrame, states: np.ndarray, regimes: np.ndarray,
+                    energies: np.ndarray, strategy: HMMStrategy,
+                    risk_mgr: RegimeHMMRiskManager) -> tuple:
+    """
+    Run the regime-aware risk manager day by day over decoded states.
+    
+    Args:
+        days_df: Trading days with 'Adj Close' and 'return' columns
+        states: Decoded HMM state for each day
+        regimes: Regime for each day (0 = BULL, 1 = BEAR)
+        energies: Wavelet energy observed on each day
+        strategy: Provides the raw signal for a regime
+        risk_mgr: Risk manager holding the portfolio state (updated in place)
+    
+    Returns:
+        results_df: One row per day, indexed by date
+        order_stats: dict with 'orders_executed' and 'orders_blocked'
+    """
     # Results storage
     results = []
     
@@ -246,22 +389,9 @@ def run_backtest(data_path: str = DATA_FILE,
     orders_blocked = 0
     orders_executed = 0
     
-    # Run day by day through test period
-    for i, (date, row) in enumerate(test_df.iterrows()):
-        # Get observations up to today
-        obs_end_idx = full_df.index.get_loc(date) + 1
-        obs_df = full_df.iloc[:obs_end_idx]
-        
-        # Skip if not enough data
-        valid_obs = obs_df[['return', 'energy']].dropna()
-        if len(valid_obs) < window:
-            continue
-        
-        observations = valid_obs[['return', 'energy']].values
-        
-        # Predict current state and regime
-        current_state = strategy.predict_state(observations)
-        regime = strategy.get_regime(current_state)
+    for i, (date, row) in enumerate(days_df.iterrows()):
+        current_state = states[i]
+        regime = regimes[i]
         
         # Get current price
         price = row['Adj Close']
@@ -297,7 +427,7 @@ def run_backtest(data_path: str = DATA_FILE,
             'date': date,
             'price': price,
             'return': daily_return,
-            'energy': observations[-1, 1] if len(observations) > 0 else np.nan,
+            'energy': energies[i],
             'state': current_state,
             'regime': regime,
             'raw_signal': raw_signal,
@@ -313,14 +443,9 @@ def run_backtest(data_path: str = DATA_FILE,
     results_df = pd.DataFrame(results)
     results_df.set_index('date', inplace=True)
     
-    print(f"\nOrder Statistics:")
-    print(f"  Orders executed: {orders_executed}")
-    print(f"  Orders blocked:  {orders_blocked}")
+    order_stats = {'orders_executed': orders_executed, 'orders_blocked': orders_blocked}
     
-    # Calculate metrics
-    metrics = calculate_metrics(results_df, risk_mgr.initial_capital)
-    
-    return results_df, metrics
+    return results_df, order_stats
 
 
 def calculate_metrics(results_df: pd.DataFrame, initial_capital: float) -> dict:
@@ -389,8 +514,18 @@ def calculate_metrics(results_df: pd.DataFrame, initial_capital: float) -> dict:
     return metrics
 
 
-def print_report(results_df: pd.DataFrame, metrics: dict):
-    """Print backtest report."""
+def confidence_intervals(results_df: pd.DataFrame, metrics: dict,
+                         n_paths: int = BOOTSTRAP_PATHS) -> dict:
+    """Bootstrap intervals for print_report (None when BOOTSTRAP_PATHS is 0)."""
+    if n_paths <= 0:
+        return None
+    return bootstrap_metrics(results_df, metrics['initial_capital'], n_paths=n_paths)
+
+
+def print_report(results_df: pd.DataFrame, metrics: dict, intervals: dict = None,
+                 posteriors: dict = None):
+    """Print backtest report (with bootstrap confidence intervals and the
+    state posterior archive's regime confidence if given)."""
     
     print("\n" + "="*70)
     print("BACKTEST REPORT (Regime-Aware Risk Manager)")
@@ -411,6 +546,17 @@ def print_report(results_df: pd.DataFrame, metrics: dict):
     print(f"Max Drawdown:        {metrics['max_drawdown_pct']:.2f}%")
     print(f"Win Rate:            {metrics['win_rate_pct']:.1f}%")
     
+    if intervals is not None:
+        ci = intervals['intervals']
+        print(f"\n--- {intervals['confidence']*100:.0f}% CONFIDENCE INTERVALS "
+              f"({intervals['method']} bootstrap, {intervals['n_paths']:,} paths, "
+              f"block {intervals['block']}d) ---")
+        print(f"Strategy Return:     [{ci['total_return']['low']*100:+.2f}%, {ci['total_return']['high']*100:+.2f}%]")
+        print(f"Excess Return:       [{ci['excess_return']['low']*100:+.2f}%, {ci['excess_return']['high']*100:+.2f}%]")
+        print(f"Sharpe Ratio:        [{ci['sharpe_ratio']['low']:.3f}, {ci['sharpe_ratio']['high']:.3f}]")
+        print(f"Max Drawdown:        [{ci['max_drawdown']['low']*100:.2f}%, {ci['max_drawdown']['high']*100:.2f}%]")
+        print(f"Win Rate:            [{ci['win_rate']['low']*100:.1f}%, {ci['win_rate']['high']*100:.1f}%]")
+    
     print("\n--- TRADING ACTIVITY ---")
     print(f"Buy Orders:          {metrics['num_buys']}")
     print(f"Sell Orders:         {metrics['num_sells']}")
@@ -422,6 +568,15 @@ def print_report(results_df: pd.DataFrame, metrics: dict):
         label = 'BULL (desirable)' if regime == 0 else 'BEAR (undesirable)'
         print(f"  Regime {regime} ({label}): {pct*100:.1f}%")
     
+    if posteriors is not None:
+        summary = posterior_summary(posteriors)
+        print("\n--- REGIME CONFIDENCE (filtered posteriors) ---")
+        print(f"Mean P(BULL):        {summary['mean_bull_probability']*100:.1f}%")
+        print(f"Mean Confidence:     {summary['mean_confidence']*100:.1f}%")
+        print(f"Uncertain Days:      {summary['uncertain_pct']:.1f}% "
+              f"(confidence < {summary['uncertain_below']*100:.0f}%)")
+        print(f"Log-Likelihood/Day:  {summary['mean_loglik']:.3f}")
+    
     print("\n--- SAMPLE TRADES (first 15 BUY/SELL) ---")
     trades = results_df[results_df['action'].isin(['BUY', 'SELL'])].head(15)
     for date, row in trades.iterrows():
@@ -434,14 +589,17 @@ def main():
     # Configuration from config.py
     print("Running HMM Strategy Backtest (Regime-Aware Risk Manager)...")
 
-    results_df, metrics = run_backtest()  # Uses config defaults
+    archive_path = archive_path_for(BACKTEST_RESULTS_FILE)
+    results_df, metrics = run_backtest(archive_path=archive_path)  # Uses config defaults
 
-    print_report(results_df, metrics)
+    print_report(results_df, metrics, confidence_intervals(results_df, metrics),
+                 load_posteriors(archive_path))
 
     # Save results
     os.makedirs(RESULTS_DIR, exist_ok=True)
     results_df.to_csv(BACKTEST_RESULTS_FILE)
     print(f"\nResults saved to: {BACKTEST_RESULTS_FILE}")
+    print(f"State posteriors saved to: {archive_path}")
 
 
 if __name__ == "__main__":
@@ -4,15 +4,28 @@ Visualization of HMM Backtest Results
 - State regimes overlay on price
 - Drawdown chart
 - Monthly returns heatmap
+- Long series are downsampled (LTTB) and regime spans drawn as one collection,
+  so million-row backtests render in seconds
+- Regime mapping, labels and transition matrix come from the backtest's state
+  posterior archive when present (no model reload); regime shading is then
+  weighted by the filtered regime probability
 """
 
+import argparse
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+from matplotlib.collections import PolyCollection
+from matplotlib.colors import to_rgba_array
 from matplotlib.patches import Patch
-import pickle
 import os
+from price_store import load_price_data
+from model_store import load_model
+from posterior_archive import archive_path_for, load_posteriors, matches_results, \
+    regime_probability, bull_state as archive_bull_state
+from instrumentation import timer
 from config import (
     DATA_FILE,
     MODEL_FILE,
@@ -20,6 +33,7 @@ from config import (
     BACKTEST_PLOT_FILE,
     STATE_STATS_PLOT_FILE,
     PLOT_START_DATE,
+    PLOT_MAX_POINTS,
     TEST_START_DATE
 )
 
@@ -34,23 +48,234 @@ COLORS = {
     'drawdown': '#e74c3c'   # Red
 }
 
+# Opacity steps of confidence-weighted regime shading
+CONFIDENCE_LEVELS = 8
+
+
+def state_runs(states: np.ndarray) -> tuple:
+    """
+    Run-length encode a state sequence.
+    
+    Returns:
+        starts: Position of the first row of each run
+        lengths: Rows in each run
+        values: State of each run
+    """
+    states = np.asarray(states)
+    if len(states) == 0:
+        return np.array([], dtype=int), np.array([], dtype=int), states
+    
+    starts = np.concatenate([[0], np.flatnonzero(states[1:] != states[:-1]) + 1])
+    lengths = np.diff(np.append(starts, len(states)))
+    return starts, lengths, states[starts]
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    
+    Keeps the first and last points and, from each of n_out - 2 equal
+    buckets in between, the point forming the largest triangle with the
+    previously kept point and the mean of the next bucket. Peaks and
+    troughs survive, so the line keeps its shape.
+    
+    Args:
+        x, y: Finite (N,) coordinates, x increasing
+        n_out: Number of points to keep
+    
+    Returns:
+        Sorted indices of the kept points (all of them if N <= n_out)
+    """
+    n = len(x)
+    if n_out is None or n <= n_out or n_out < 3:
+        return np.arange(n)
+    
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    
+    # Mean of every bucket; the point after the last bucket is the final point
+    x_sums = np.concatenate([[0.0], np.cumsum(x)])
+    y_sums = np.concatenate([[0.0], np.cumsum(y)])
+    next_lo = np.append(edges[1:-1], n - 1)
+    next_hi = np.append(edges[2:], n)
+    next_x = (x_sums[next_hi] - x_sums[next_lo]) / (next_hi - next_lo)
+    next_y = (y_sums[next_hi] - y_sums[next_lo]) / (next_hi - next_lo)
+    
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        area = np.abs((x[a] - next_x[b]) * (y[lo:hi] - y[a])
+                      - (x[a] - x[lo:hi]) * (next_y[b] - y[a]))
+        a = lo + int(np.argmax(area))
+        indices[b + 1] = a
+    
+    return indices
+
+
+def decimate(index: pd.Index, values, max_points: int = PLOT_MAX_POINTS) -> tuple:
+    """
+    Downsample a series for plotting (LTTB, plus its global min and max).
+    
+    Returns:
+        (index, values) of the kept points; unchanged if already short enough
+    """
+    values = np.asarray(values, dtype=float)
+    if max_points is None or len(values) <= max_points:
+        return index, values
+    
+    x = mdates.date2num(index) if isinstance(index, pd.DatetimeIndex) else np.arange(len(values), dtype=float)
+    keep = lttb_indices(x, values, max_points)
+    keep = np.union1d(keep, [np.argmin(values), np.argmax(values)])
+    return index[keep], values[keep]
+
+
+def shade_regimes(ax, index: pd.DatetimeIndex, states: np.ndarray, bull_state: int,
+                  alpha: float = 0.2, zorder: int = 1,
+                  max_spans: int = PLOT_MAX_POINTS,
+                  confidence: np.ndarray = None) -> PolyCollection:
+    """
+    Shade each regime run over the full height of `ax`, as a single artist.
+    
+    Same spans as one ax.axvspan per state change: each run from its first
+    date to the first date of the next run (the last run ends at the last date).
+    With more than max_spans runs (far narrower than a pixel), the date range
+    is split into max_spans equal bins shaded by their majority regime.
+    
+    confidence: Optional per-day weight in [0, 1] that scales the opacity,
+                in CONFIDENCE_LEVELS steps (runs split where the step changes)
+    """
+    states = np.asarray(states)
+    top = CONFIDENCE_LEVELS - 1
+    if confidence is None:
+        levels = np.full(len(states), top)
+    else:
+        levels = np.clip(np.rint(np.asarray(confidence) * top), 0, top).astype(int)
+    
+    starts, _, _ = state_runs(states.astype(int) * CONFIDENCE_LEVELS + levels)
+    x = mdates.date2num(index)
+    left = x[starts]
+    right = np.append(x[starts[1:]], x[-1])
+    is_bull = states[starts] == bull_state
+    levels = levels[starts]
+    
+    if max_spans is not None and len(starts) > max_spans and right[-1] > left[0]:
+        # Bull time and weighted time covered up to each bin edge
+        # (piecewise linear between run edges)
+        edges = np.linspace(left[0], right[-1], max_spans + 1)
+        run_edges = np.append(left, right[-1])
+        bull_time = np.concatenate([[0.0], np.cumsum((right - left) * is_bull)])
+        covered = np.interp(edges, run_edges, bull_time)
+        bin_bull = np.diff(covered) >= 0.5 * np.diff(edges)
+        level_time = np.concatenate([[0.0], np.cumsum((right - left) * levels)])
+        bin_levels = np.rint(np.diff(np.interp(edges, run_edges, level_time)) / np.diff(edges))
+        bin_starts, _, _ = state_runs(bin_bull * CONFIDENCE_LEVELS + bin_levels.astype(int))
+        is_bull = bin_bull[bin_starts]
+        levels = bin_levels[bin_starts]
+        left = edges[bin_starts]
+        right = np.append(edges[bin_starts[1:]], edges[-1])
+    
+    # Rectangles in (data x, axes y) coordinates, like axvspan
+    verts = np.stack([
+        np.column_stack([left, np.zeros_like(left)]),
+        np.column_stack([left, np.ones_like(left)]),
+        np.column_stack([right, np.ones_like(left)]),
+        np.column_stack([right, np.zeros_like(left)])
+    ], axis=1)
+    colors = np.where(is_bull, COLORS['bull'], COLORS['bear'])
+    
+    if confidence is None:
+        spans = PolyCollection(verts, facecolors=colors, edgecolors=colors,
+                               linewidths=plt.rcParams['patch.linewidth'],
+                               alpha=alpha, zorder=zorder, transform=ax.get_xaxis_transform())
+    else:
+        colors = to_rgba_array(colors)
+        colors[:, 3] = alpha * levels / top
+        spans = PolyCollection(verts, facecolors=colors, edgecolors=colors,
+                               linewidths=plt.rcParams['patch.linewidth'],
+                               zorder=zorder, transform=ax.get_xaxis_transform())
+    ax.add_collection(spans, autolim=False)
+    return spans
+
+
+def results_figure() -> dict:
+    """
+    Empty backtest figure: price + regimes, equity curve and drawdown axes.
+    
+    Pass it to plot_results(figure=...) to redraw into the same figure
+    instead of building a new one (batch reports).
+    """
+    fig = plt.figure(figsize=(14, 12))
+    
+    # Layout: 4 rows
+    ax1 = plt.subplot2grid((4, 1), (0, 0), rowspan=2, fig=fig)  # Price + States
+    ax2 = plt.subplot2grid((4, 1), (2, 0), fig=fig)              # Equity curve
+    ax3 = plt.subplot2grid((4, 1), (3, 0), fig=fig)              # Drawdown
+    
+    return {'fig': fig, 'axes': [ax1, ax2, ax3], 'layout': _subplot_params(fig)}
+
+
+def state_stats_figure() -> dict:
+    """Empty state statistics figure (see results_figure); colorbar axes added on first use."""
+    fig, axes = plt.subplots(1, 3, figsize=(14, 4))
+    return {'fig': fig, 'axes': list(axes), 'cax': None, 'layout': _subplot_params(fig)}
+
+
+def _subplot_params(fig) -> dict:
+    params = fig.subplotpars
+    return {key: getattr(params, key) for key in ('left', 'right', 'bottom', 'top', 'wspace', 'hspace')}
+
+
+def _clear_figure(figure: dict):
+    """Empty a template's axes and undo the last tight_layout."""
+    for ax in figure['axes']:
+        ax.cla()
+    if figure.get('cax') is not None:
+        figure['cax'].cla()
+    figure['fig'].subplots_adjust(**figure['layout'])
+
 
 def load_data(data_path: str = DATA_FILE,
               results_path: str = BACKTEST_RESULTS_FILE,
               model_path: str = MODEL_FILE,
-              plot_start: str = PLOT_START_DATE) -> tuple:
-    """Load all required data for plotting."""
+              plot_start: str = PLOT_START_DATE,
+              df: pd.DataFrame = None,
+              results: pd.DataFrame = None,
+              model_data: dict = None,
+              posteriors: dict = None) -> tuple:
+    """
+    Load all required data for plotting.
+    
+    Already loaded price data, backtest results or model dict can be passed
+    in to skip reading the corresponding file. Results read from disk come
+    with the state posterior archive written next to them, if any; the
+    archive (read or passed in) replaces the model when it matches the
+    results.
+    
+    Returns:
+        df, results, config, state_labels, bull_state, posteriors (None
+        without a matching archive)
+    """
     
     # Load price data
-    df = pd.read_csv(data_path, index_col="Date", parse_dates=True)
-    df = df[df.index >= plot_start]
+    if df is None:
+        df = load_price_data(data_path, columns=['Adj Close'], start=plot_start)
+    else:
+        df = df[df.index >= plot_start]
     
     # Load backtest results
-    results = pd.read_csv(results_path, index_col="date", parse_dates=True)
+    if results is None:
+        results, posteriors = load_results(results_path, posteriors)
+    posteriors = matching_posteriors(posteriors, results)
+    
+    if posteriors is not None:
+        # Regime mapping as the backtest used it
+        return (df, results, posteriors['config'], posteriors['state_labels'],
+                archive_bull_state(posteriors), posteriors)
     
     # Load model config
-    with open(model_path, 'rb') as f:
-        model_data = pickle.load(f)
+    if model_data is None:
+        model_data = load_model(model_path)
     
     config = model_data['config']
     state_labels = model_data['state_labels']
@@ -59,7 +284,24 @@ def load_data(data_path: str = DATA_FILE,
     model = model_data['model']
     bull_state = np.argmax([model.means_[i][0] for i in range(config['n_states'])])
     
-    return df, results, config, state_labels, bull_state
+    return df, results, config, state_labels, bull_state, None
+
+
+def load_results(results_path: str, posteriors: dict = None) -> tuple:
+    """Backtest results CSV and its state posterior archive (None if missing)."""
+    results = pd.read_csv(results_path, index_col="date", parse_dates=True)
+    archive_path = archive_path_for(results_path)
+    if posteriors is None and os.path.exists(archive_path):
+        posteriors = load_posteriors(archive_path)
+    return results, posteriors
+
+
+def matching_posteriors(posteriors: dict, results: pd.DataFrame) -> dict:
+    """The archive if it was written with these results, else None."""
+    if posteriors is None or matches_results(posteriors, results):
+        return posteriors
+    print("State posterior archive does not match the results, using the model instead")
+    return None
 
 
 def plot_results(data_path: str = DATA_FILE,
@@ -67,48 +309,52 @@ def plot_results(data_path: str = DATA_FILE,
                  model_path: str = MODEL_FILE,
                  plot_start: str = PLOT_START_DATE,
                  test_start: str = TEST_START_DATE,
-                 output_path: str = BACKTEST_PLOT_FILE):
+                 output_path: str = BACKTEST_PLOT_FILE,
+                 df: pd.DataFrame = None,
+                 results: pd.DataFrame = None,
+                 model_data: dict = None,
+                 figure: dict = None,
+                 posteriors: dict = None):
     """
     Generate comprehensive backtest visualization.
+    
+    figure: Template from results_figure() to clear and redraw into
+            (default: a new figure)
+    posteriors: State posterior archive of the results (see load_data)
     """
     
     # Load data
-    df, results, config, state_labels, bull_state = load_data(
-        data_path, results_path, model_path, plot_start
+    df, results, config, state_labels, bull_state, posteriors = load_data(
+        data_path, results_path, model_path, plot_start, df, results, model_data, posteriors
     )
     
-    # Create figure with subplots
-    fig = plt.figure(figsize=(14, 12))
-    
-    # Layout: 4 rows
-    ax1 = plt.subplot2grid((4, 1), (0, 0), rowspan=2)  # Price + States
-    ax2 = plt.subplot2grid((4, 1), (2, 0))              # Equity curve
-    ax3 = plt.subplot2grid((4, 1), (3, 0))              # Drawdown
+    # Create figure with subplots, or reuse the template
+    if figure is None:
+        figure = results_figure()
+    else:
+        _clear_figure(figure)
+    fig = figure['fig']
+    ax1, ax2, ax3 = figure['axes']
     
     # =========================================
     # PLOT 1: Price with State Regimes
     # =========================================
     
     # Plot price
-    ax1.plot(df.index, df['Adj Close'], color=COLORS['price'], 
+    ax1.plot(*decimate(df.index, df['Adj Close']), color=COLORS['price'], 
              linewidth=1.5, label='SPY Price', zorder=3)
     
     # Shade states (only for test period where we have predictions)
     test_mask = results.index >= test_start
     test_results = results[test_mask]
-    
-    # Find state change points
-    state_changes = test_results['state'].diff().fillna(1) != 0
-    change_dates = test_results.index[state_changes].tolist()
-    change_dates.append(test_results.index[-1])  # Add end date
-    
-    for i in range(len(change_dates) - 1):
-        start = change_dates[i]
-        end = change_dates[i + 1]
-        state = test_results.loc[start, 'state']
-        
-        color = COLORS['bull'] if state == bull_state else COLORS['bear']
-        ax1.axvspan(start, end, alpha=0.2, color=color, zorder=1)
+    test_states = test_results['state'].values
+    shading = None
+    if posteriors is not None:
+        # Probability of the shaded regime: faint at 50/50, full opacity when certain
+        p_bull = regime_probability(posteriors)[test_mask]
+        p_shaded = np.where(test_states == bull_state, p_bull, 1 - p_bull)
+        shading = 0.25 + 0.75 * np.clip(2 * p_shaded - 1, 0, 1)
+    shade_regimes(ax1, test_results.index, test_states, bull_state, confidence=shading)
     
     # Add vertical line at test start
     ax1.axvline(x=pd.Timestamp(test_start), color='black', linestyle='--', 
@@ -125,10 +371,11 @@ def plot_results(data_path: str = DATA_FILE,
     )
     
     # Legend
+    shading_note = ' (faint = uncertain)' if shading is not None else ''
     legend_elements = [
         plt.Line2D([0], [0], color=COLORS['price'], linewidth=2, label='SPY Price'),
-        Patch(facecolor=COLORS['bull'], alpha=0.3, label=f'State {bull_state}: BULL'),
-        Patch(facecolor=COLORS['bear'], alpha=0.3, label=f'State {1-bull_state}: BEAR'),
+        Patch(facecolor=COLORS['bull'], alpha=0.3, label=f'State {bull_state}: BULL{shading_note}'),
+        Patch(facecolor=COLORS['bear'], alpha=0.3, label=f'State {1-bull_state}: BEAR{shading_note}'),
         plt.Line2D([0], [0], color='black', linestyle='--', linewidth=1.5, label='Test Start')
     ]
     ax1.legend(handles=legend_elements, loc='upper left', fontsize=9)
@@ -147,9 +394,9 @@ def plot_results(data_path: str = DATA_FILE,
     first_price = test_results['price'].iloc[0]
     buyhold_equity = initial_capital * (test_results['price'] / first_price)
     
-    ax2.plot(test_results.index, strategy_equity, color=COLORS['strategy'], 
+    ax2.plot(*decimate(test_results.index, strategy_equity), color=COLORS['strategy'], 
              linewidth=2, label='HMM Strategy')
-    ax2.plot(test_results.index, buyhold_equity, color=COLORS['buyhold'], 
+    ax2.plot(*decimate(test_results.index, buyhold_equity), color=COLORS['buyhold'], 
              linewidth=2, linestyle='--', label='Buy & Hold')
     
     # Calculate returns for annotation
@@ -180,9 +427,10 @@ def plot_results(data_path: str = DATA_FILE,
     rolling_max = cumulative.expanding().max()
     drawdown = (cumulative - rolling_max) / rolling_max * 100
     
-    ax3.fill_between(test_results.index, drawdown, 0, 
+    dd_dates, dd_values = decimate(test_results.index, drawdown)
+    ax3.fill_between(dd_dates, dd_values, 0, 
                      color=COLORS['drawdown'], alpha=0.4)
-    ax3.plot(test_results.index, drawdown, color=COLORS['drawdown'], linewidth=1)
+    ax3.plot(dd_dates, dd_values, color=COLORS['drawdown'], linewidth=1)
     
     # Max drawdown annotation
     max_dd = drawdown.min()
@@ -203,11 +451,12 @@ def plot_results(data_path: str = DATA_FILE,
     # Final adjustments
     # =========================================
     
-    plt.tight_layout()
+    fig.tight_layout()
     
     # Save
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    plt.savefig(output_path, dpi=150, bbox_inches='tight', facecolor='white')
+    with timer("plot_render"):
+        fig.savefig(output_path, dpi=150, bbox_inches='tight', facecolor='white')
     print(f"\nPlot saved to: {output_path}")
     
     plt.show()
@@ -217,23 +466,43 @@ def plot_results(data_path: str = DATA_FILE,
 
 def plot_state_statistics(results_path: str = BACKTEST_RESULTS_FILE,
                           model_path: str = MODEL_FILE,
-                          output_path: str = STATE_STATS_PLOT_FILE):
+                          output_path: str = STATE_STATS_PLOT_FILE,
+                          results: pd.DataFrame = None,
+                          model_data: dict = None,
+                          figure: dict = None,
+                          posteriors: dict = None):
     """
     Plot state-specific return distributions and transition stats.
+    
+    figure: Template from state_stats_figure() to clear and redraw into
+            (default: a new figure)
+    posteriors: State posterior archive of the results (see load_data)
     """
     
     # Load data
-    results = pd.read_csv(results_path, index_col="date", parse_dates=True)
-    
-    with open(model_path, 'rb') as f:
-        model_data = pickle.load(f)
-    
-    model = model_data['model']
-    config = model_data['config']
+    if results is None:
+        results, posteriors = load_results(results_path, posteriors)
+    posteriors = matching_posteriors(posteriors, results)
+    
+    if posteriors is not None:
+        config = posteriors['config']
+        trans_matrix = posteriors['transmat']
+        bull_state = archive_bull_state(posteriors)
+    else:
+        if model_data is None:
+            model_data = load_model(model_path)
+        model = model_data['model']
+        config = model_data['config']
+        trans_matrix = model.transmat_
+        bull_state = np.argmax([model.means_[i][0] for i in range(config['n_states'])])
     n_states = config['n_states']
-    bull_state = np.argmax([model.means_[i][0] for i in range(n_states)])
     
-    fig, axes = plt.subplots(1, 3, figsize=(14, 4))
+    if figure is None:
+        figure = state_stats_figure()
+    else:
+        _clear_figure(figure)
+    fig = figure['fig']
+    axes = figure['axes']
     
     # =========================================
     # PLOT 1: Return distribution by state
@@ -260,21 +529,8 @@ def plot_state_statistics(results_path: str = BACKTEST_RESULTS_FILE,
     ax2 = axes[1]
     
     # Calculate state durations
-    state_changes = results['state'].diff().fillna(1) != 0
-    state_runs = []
-    current_state = results['state'].iloc[0]
-    current_length = 0
-    
-    for i, (idx, row) in enumerate(results.iterrows()):
-        if state_changes.iloc[i] and i > 0:
-            state_runs.append({'state': current_state, 'duration': current_length})
-            current_state = row['state']
-            current_length = 1
-        else:
-            current_length += 1
-    state_runs.append({'state': current_state, 'duration': current_length})
-    
-    runs_df = pd.DataFrame(state_runs)
+    _, run_lengths, run_states = state_runs(results['state'].values)
+    runs_df = pd.DataFrame({'state': run_states, 'duration': run_lengths})
     
     for state in range(n_states):
         durations = runs_df[runs_df['state'] == state]['duration']
@@ -294,7 +550,6 @@ def plot_state_statistics(results_path: str = BACKTEST_RESULTS_FILE,
     
     ax3 = axes[2]
     
-    trans_matrix = model.transmat_
     labels = ['BULL' if i == bull_state else 'BEAR' for i in range(n_states)]
     
     im = ax3.imshow(trans_matrix, cmap='Blues', vmin=0, vmax=1)
@@ -314,21 +569,25 @@ def plot_state_statistics(results_path: str = BACKTEST_RESULTS_FILE,
     ax3.set_ylabel('From State', fontsize=10)
     ax3.set_title('Transition Probabilities', fontsize=11, fontweight='bold')
     
-    plt.colorbar(im, ax=ax3, shrink=0.8)
+    if figure['cax'] is None:
+        figure['cax'] = fig.colorbar(im, ax=ax3, shrink=0.8).ax
+    else:
+        fig.colorbar(im, cax=figure['cax'])
     
     # =========================================
     # Final adjustments
     # =========================================
     
-    plt.suptitle(
+    fig.suptitle(
         f'HMM State Analysis | Window: {config["window"]}d | Scale: {config["scale"]}',
         fontsize=13, fontweight='bold', y=1.02
     )
     
-    plt.tight_layout()
+    fig.tight_layout()
     
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    plt.savefig(output_path, dpi=150, bbox_inches='tight', facecolor='white')
+    with timer("plot_render"):
+        fig.savefig(output_path, dpi=150, bbox_inches='tight', facecolor='white')
     print(f"\nState statistics plot saved to: {output_path}")
     
     plt.show()
@@ -336,7 +595,30 @@ def plot_state_statistics(results_path: str = BACKTEST_RESULTS_FILE,
     return fig
 
 
+def self_test():
+    """LTTB downsampling and run-length encoding of the state series."""
+    np.random.seed(42)
+    t = np.arange(100_000, dtype=float)
+    y = np.cumsum(np.random.randn(len(t)))
+    keep = lttb_indices(t, y, 1000)
+    assert len(keep) == 1000 and keep[0] == 0 and keep[-1] == len(t) - 1
+    assert np.all(np.diff(keep) > 0)
+    assert np.abs(np.interp(t, t[keep], y[keep]) - y).max() < 0.1 * np.ptp(y)
+    starts, lengths, values = state_runs([0, 0, 1, 1, 1, 0])
+    assert starts.tolist() == [0, 2, 5] and lengths.tolist() == [2, 3, 1] and values.tolist() == [0, 1, 0]
+    print("Helpers OK: LTTB keeps endpoints and shape, state runs encoded")
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Plot the backtest results")
+    parser.add_argument("--self-test", action="store_true",
+                        help="Check the downsampling and state-run helpers and exit")
+    args = parser.parse_args()
+
+    if args.self_test:
+        self_test()
+        return
+
     print("Generating backtest visualizations...")
 
     # Main results plot (uses config defaults)
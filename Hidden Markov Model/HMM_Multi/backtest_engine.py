@@ -0,0 +1,278 @@
+"""
+Array-Based Backtest Engine
+- Same BUY/SELL/HOLD state machine as RegimeHMMRiskManager, over NumPy arrays
+- Stop-loss, cash, position and total value in one tight loop
+- JIT-compiled with numba when installed, plain Python loop otherwise
+- Produces the same results DataFrame as simulate_trades in 4_backtest.py
+"""
+
+import numpy as np
+import pandas as pd
+from config import (
+    INITIAL_CAPITAL,
+    MAX_POSITION_PCT,
+    STOP_LOSS_PCT
+)
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        """No-op stand-in for numba.njit."""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# Action / signal codes
+HOLD, BUY, SELL = 0, 1, 2
+ACTION_NAMES = np.array(['HOLD', 'BUY', 'SELL'], dtype=object)
+
+
+@njit(cache=True)
+def _simulate_kernel(prices, regimes, initial_capital, initial_position, initial_entry_price,
+                     max_position_pct, stop_loss_pct,
+                     out_regime, out_signal, out_action, out_invested, out_position,
+                     out_cash, out_value, out_stop):
+    """Day-by-day state machine; mirrors RegimeHMMRiskManager exactly."""
+    capital = initial_capital
+    position = initial_position
+    entry_price = initial_entry_price
+    invested = initial_position > 0
+
+    for t in range(len(prices)):
+        price = prices[t]
+        regime = regimes[t]
+
+        # Check stop loss first
+        stop_triggered = False
+        if invested and entry_price > 0:
+            if (entry_price - price) / entry_price >= stop_loss_pct:
+                stop_triggered = True
+
+        # Raw signal: BULL -> BUY, BEAR -> SELL
+        signal = BUY if regime == 0 else SELL
+
+        # Stop loss forces an exit through the undesirable regime
+        if stop_triggered:
+            signal = SELL
+            regime = 1
+
+        # Refine order: block entries in BEAR, allow exits in both regimes
+        action = HOLD
+        if regime == 0:
+            if signal == BUY and not invested:
+                action = BUY
+            elif signal == SELL and invested:
+                action = SELL
+        elif regime == 1:
+            if signal == SELL and invested:
+                action = SELL
+
+        # Execute order
+        if action == BUY and not invested:
+            shares = int(capital * max_position_pct / price)
+            if shares > 0:
+                capital -= shares * price
+                position = shares
+                entry_price = price
+                invested = True
+        elif action == SELL and invested:
+            capital += position * price
+            position = 0
+            entry_price = 0.0
+            invested = False
+
+        out_regime[t] = regime
+        out_signal[t] = signal
+        out_action[t] = action
+        out_invested[t] = invested
+        out_position[t] = position
+        out_cash[t] = capital
+        out_value[t] = capital + position * price
+        out_stop[t] = stop_triggered
+
+
+def simulate_regime_strategy(prices: np.ndarray, regimes: np.ndarray,
+                             initial_capital: float = INITIAL_CAPITAL,
+                             max_position_pct: float = MAX_POSITION_PCT,
+                             stop_loss_pct: float = STOP_LOSS_PCT,
+                             position: int = 0, entry_price: float = 0.0) -> dict:
+    """
+    Run the regime-aware risk manager over price and regime arrays.
+
+    Args:
+        prices: (T,) execution prices
+        regimes: (T,) regime per day (0 = BULL/desirable, 1 = BEAR/undesirable)
+        initial_capital: Cash on the first day
+        position, entry_price: Open position on the first day (to continue
+                               a run split into chunks)
+
+    Returns:
+        dict of (T,) arrays: regime (after stop-loss override), raw_signal
+        and action (codes HOLD/BUY/SELL), invested, position, cash,
+        total_value, stop_triggered
+    """
+    prices = np.ascontiguousarray(prices, dtype=np.float64)
+    regimes = np.ascontiguousarray(regimes, dtype=np.int64)
+    n = len(prices)
+
+    out = {
+        'regime': np.empty(n, dtype=np.int64),
+        'raw_signal': np.empty(n, dtype=np.int8),
+        'action': np.empty(n, dtype=np.int8),
+        'invested': np.empty(n, dtype=np.bool_),
+        'position': np.empty(n, dtype=np.int64),
+        'cash': np.empty(n, dtype=np.float64),
+        'total_value': np.empty(n, dtype=np.float64),
+        'stop_triggered': np.empty(n, dtype=np.bool_)
+    }
+
+    # Without numba, Python scalars from lists are much faster to index than arrays
+    inputs = (prices, regimes) if HAVE_NUMBA else (prices.tolist(), regimes.tolist())
+
+    _simulate_kernel(*inputs, float(initial_capital), int(position), float(entry_price),
+                     float(max_position_pct), float(stop_loss_pct), out['regime'], out['raw_signal'], out['action'],
+                     out['invested'], out['position'], out['cash'], out['total_value'],
+                     out['stop_triggered'])
+
+    return out
+
+
+def run_array_engine(days_df: pd.DataFrame, states: np.ndarray, regimes: np.ndarray,
+                     energies: np.ndarray, risk_mgr) -> tuple:
+    """
+    Drop-in replacement for simulate_trades using the array engine.
+
+    Args:
+        days_df: Trading days with 'Adj Close' and 'return' columns
+        states: Decoded HMM state for each day
+        regimes: Regime for each day (0 = BULL, 1 = BEAR)
+        energies: Wavelet energy observed on each day
+        risk_mgr: RegimeHMMRiskManager; provides the parameters and the
+                  starting portfolio (cash and open position, so a run can
+                  be continued chunk by chunk) and receives the final one
+
+    Returns:
+        results_df: One row per day, indexed by date (same columns as simulate_trades)
+        order_stats: dict with 'orders_executed' and 'orders_blocked'
+    """
+    prices = days_df['Adj Close'].to_numpy(dtype=np.float64)
+    sim = simulate_regime_strategy(prices, regimes, risk_mgr.capital,
+                                   risk_mgr.max_position_pct, risk_mgr.stop_loss_pct,
+                                   risk_mgr.position, risk_mgr.entry_price)
+
+    returns = days_df['return'].to_numpy(dtype=np.float64)
+
+    results_df = pd.DataFrame({
+        'price': prices,
+        'return': np.where(np.isnan(returns), 0.0, returns),
+        'energy': energies,
+        'state': states,
+        'regime': sim['regime'],
+        'raw_signal': ACTION_NAMES[sim['raw_signal']],
+        'action': ACTION_NAMES[sim['action']],
+        'invested': sim['invested'],
+        'position': sim['position'],
+        'cash': sim['cash'],
+        'total_value': sim['total_value'],
+        'stop_triggered': sim['stop_triggered']
+    }, index=pd.Index(days_df.index, name='date'))
+
+    # Leave the risk manager in the same final state as the loop engine
+    if len(prices) > 0:
+        risk_mgr.capital = sim['cash'][-1]
+        risk_mgr.position = int(sim['position'][-1])
+        risk_mgr.invested = bool(sim['invested'][-1])
+        buys = np.nonzero(sim['action'] == BUY)[0]
+        if not risk_mgr.invested:
+            risk_mgr.entry_price = 0.0
+        elif len(buys) > 0:
+            risk_mgr.entry_price = prices[buys[-1]]
+
+    order_stats = {
+        'orders_executed': int(np.sum(sim['action'] != HOLD)),
+        'orders_blocked': int(np.sum(sim['action'] == HOLD))
+    }
+
+    return results_df, order_stats
+
+
+if __name__ == "__main__":
+    # Quick test: identical to the day-by-day RegimeHMMRiskManager loop (4_backtest.py)
+    import contextlib
+    import importlib
+    import os
+
+    from model_store import load_model
+    from price_store import load_price_data
+    from config import DATA_FILE, MODEL_FILE, TEST_START_DATE
+
+    backtest_stage = importlib.import_module("4_backtest")
+    model_data = load_model(MODEL_FILE)
+    strategy = backtest_stage.HMMStrategy(model_data=model_data)
+
+    def assert_engines_match(days_df, states, regimes, energies, stop_loss_pct):
+        """Run both engines on the same days; results, order stats and metrics must be identical."""
+        array_df, array_stats = run_array_engine(
+            days_df, states, regimes, energies,
+            backtest_stage.RegimeHMMRiskManager(stop_loss_pct=stop_loss_pct))
+        loop_df, loop_stats = backtest_stage.simulate_trades(
+            days_df, states, regimes, energies, strategy,
+            backtest_stage.RegimeHMMRiskManager(stop_loss_pct=stop_loss_pct))
+
+        assert list(array_df.columns) == list(loop_df.columns)
+        for column in loop_df.columns:
+            assert array_df[column].equals(loop_df[column]), column
+        assert array_df.index.equals(loop_df.index)
+        assert array_stats == loop_stats, (array_stats, loop_stats)
+
+        array_metrics = backtest_stage.calculate_metrics(array_df, INITIAL_CAPITAL)
+        loop_metrics = backtest_stage.calculate_metrics(loop_df, INITIAL_CAPITAL)
+        assert array_metrics == loop_metrics
+        return array_df, array_stats
+
+    print(f"Test array engine vs loop engine (numba: {HAVE_NUMBA}):")
+
+    # Real data, through run_backtest's two engines
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    df = load_price_data(DATA_FILE, columns=['Adj Close', 'return'])
+    runs = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for engine in ('array', 'loop'):
+            runs[engine] = backtest_stage.run_backtest(test_start=TEST_START_DATE, df=df,
+                                                       model_data=model_data, engine=engine)
+    (array_df, array_metrics), (loop_df, loop_metrics) = runs['array'], runs['loop']
+    assert list(array_df.columns) == list(loop_df.columns)
+    assert array_df.index.equals(loop_df.index)
+    for column in loop_df.columns:
+        assert array_df[column].equals(loop_df[column]), column
+    assert array_metrics == loop_metrics
+
+    # Same days again, engines called directly for the order stats
+    states = array_df['state'].to_numpy()
+    regimes = np.array([strategy.get_regime(state) for state in states])
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        _, order_stats = assert_engines_match(df.loc[array_df.index], states, regimes,
+                                              array_df['energy'].to_numpy(), STOP_LOSS_PCT)
+    print(f"  OK: {DATA_FILE}, {len(array_df)} days, {order_stats}, "
+          f"{int(array_df['stop_triggered'].sum())} stops")
+
+    # Synthetic volatile series with short regimes: many stop-loss exits
+    rng = np.random.default_rng(42)
+    n_days = 2000
+    returns = rng.normal(0.0002, 0.025, n_days)
+    index = pd.bdate_range("2000-01-03", periods=n_days, name="Date")
+    days_df = pd.DataFrame({'Adj Close': 100 * np.cumprod(1 + returns), 'return': returns},
+                           index=index)
+    days_df.iloc[0, 1] = np.nan
+    states = np.repeat(rng.integers(0, model_data['model'].n_components, n_days // 20 + 1), 20)[:n_days]
+    regimes = np.array([strategy.get_regime(state) for state in states])
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        synthetic_df, order_stats = assert_engines_match(days_df, states, regimes,
+                                                         rng.random(n_days), stop_loss_pct=0.02)
+    n_stops = int(synthetic_df['stop_triggered'].sum())
+    assert n_stops > 0
+    print(f"  OK: synthetic, {n_days} days, {order_stats}, {n_stops} stops")
@@ -0,0 +1,193 @@
+"""
+Batch report generation - Render plots for many backtest runs in parallel
+- One report per run directory laid out like UNIVERSE_DIR/<TICKER>/
+  (data/<TICKER>.csv, models/hmm_model.npz, results/backtest_results.csv)
+- Worker processes render with the Agg backend and reuse one figure
+  template per plot type instead of building a new figure per report
+- Reports whose inputs (data, model, results, plot settings, renderer)
+  are unchanged since the last render are skipped, make-style
+"""
+
+import argparse
+import contextlib
+import importlib
+import os
+import time
+import traceback
+from concurrent.futures import as_completed
+
+import matplotlib
+matplotlib.use("Agg")  # Batch run: render plots to files only
+
+import config
+from build_state import hash_file, hash_inputs, load_state, save_state
+from posterior_archive import archive_path_for
+from universe_layout import ticker_paths
+from worker_pool import worker_pool
+from config import (
+    UNIVERSE,
+    UNIVERSE_DIR,
+    MAX_WORKERS,
+    PLOT_START_DATE,
+    TEST_START_DATE,
+    REPORT_STATE_FILE
+)
+
+visualize_stage = importlib.import_module("5_visualize")
+
+# config.py values that change what a report looks like
+REPORT_CONFIG_KEYS = ['PLOT_START_DATE', 'TEST_START_DATE', 'PLOT_MAX_POINTS']
+
+
+def report_job(ticker: str, universe_dir: str = UNIVERSE_DIR) -> dict:
+    """Input and output files of one ticker's report."""
+    paths = ticker_paths(ticker, universe_dir)
+    results_dir = os.path.dirname(paths['results'])
+    return {
+        'name': ticker,
+        'data': paths['data'],
+        'model': paths['model'],
+        'results': paths['results'],
+        'plot': os.path.join(results_dir, "backtest_plot.png"),
+        'stats': os.path.join(results_dir, "state_stats.png")
+    }
+
+
+def report_fingerprint(job: dict) -> str:
+    """Hash of everything that determines a report's plots."""
+    inputs = {
+        'files': {key: hash_file(job[key]) for key in ('data', 'model', 'results')},
+        'config': {key: getattr(config, key) for key in REPORT_CONFIG_KEYS},
+        'renderer': hash_file(visualize_stage.__file__)
+    }
+    # Regime shading and the bull state come from the posterior archive when present
+    archive_path = archive_path_for(job['results'])
+    if os.path.exists(archive_path):
+        inputs['files']['posteriors'] = hash_file(archive_path)
+    return hash_inputs(inputs)
+
+
+# Worker-side figure templates, created on a worker's first report
+_templates = {}
+
+
+def render_report(job: dict, plot_start: str = PLOT_START_DATE,
+                  test_start: str = TEST_START_DATE) -> dict:
+    """
+    Render both plots of one report (runs inside a worker process).
+
+    Never raises: failures are returned as a row with the error.
+    """
+    start_time = time.time()
+
+    try:
+        if 'plot' not in _templates:
+            _templates['plot'] = visualize_stage.results_figure()
+        if 'stats' not in _templates:
+            _templates['stats'] = visualize_stage.state_stats_figure()
+
+        # Keep the plot functions' progress output out of the shared terminal
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            visualize_stage.plot_results(job['data'], job['results'], job['model'],
+                                         plot_start=plot_start, test_start=test_start,
+                                         output_path=job['plot'], figure=_templates['plot'])
+            visualize_stage.plot_state_statistics(job['results'], job['model'],
+                                                  output_path=job['stats'],
+                                                  figure=_templates['stats'])
+        row = {'name': job['name'], 'status': 'rendered'}
+
+    except Exception as e:
+        traceback.print_exc()
+        row = {'name': job['name'], 'status': 'failed', 'error': f"{type(e).__name__}: {e}"}
+
+    row['elapsed_sec'] = time.time() - start_time
+    return row
+
+
+def run_reports(jobs: list, max_workers: int = MAX_WORKERS, force: bool = False,
+                state_path: str = REPORT_STATE_FILE) -> list:
+    """
+    Render every report whose inputs changed, on a bounded process pool.
+
+    Args:
+        jobs: Report jobs (see report_job)
+        max_workers: Process pool size (1 = in-process)
+        force: Re-render every report
+        state_path: Fingerprints of the last successful render of each report
+
+    Returns:
+        One row per job: name, status ('rendered', 'skipped', 'missing
+        inputs' or 'failed') and elapsed_sec
+    """
+    state = {} if force else load_state(state_path)
+    rows = []
+    pending = {}
+
+    for job in jobs:
+        if not all(os.path.exists(job[key]) for key in ('data', 'model', 'results')):
+            rows.append({'name': job['name'], 'status': 'missing inputs', 'elapsed_sec': 0.0})
+            continue
+
+        fingerprint = report_fingerprint(job)
+        if (state.get(job['plot']) == fingerprint
+                and os.path.exists(job['plot']) and os.path.exists(job['stats'])):
+            rows.append({'name': job['name'], 'status': 'skipped', 'elapsed_sec': 0.0})
+        else:
+            pending[job['plot']] = (job, fingerprint)
+
+    print(f"Reports: {len(pending)} to render, {len(rows)} skipped or missing inputs")
+
+    def record(row, job, fingerprint):
+        rows.append(row)
+        if row['status'] == 'rendered':
+            state[job['plot']] = fingerprint
+            save_state(state, state_path)
+        detail = f"{row['elapsed_sec']:.2f}s" if row['status'] == 'rendered' else row.get('error', '')
+        print(f"  [{len(rows)}/{len(jobs)}] {job['name']:12s} {row['status'].upper():8s} {detail}")
+
+    if max_workers == 1:
+        for job, fingerprint in pending.values():
+            record(render_report(job), job, fingerprint)
+    elif pending:
+        with worker_pool(max_workers=max_workers) as pool:
+            futures = {pool.submit(render_report, job): key for key, (job, _) in pending.items()}
+
+            for future in as_completed(futures):
+                job, fingerprint = pending[futures[future]]
+                try:
+                    row = future.result()
+                except Exception as e:
+                    # Worker process died (e.g. out of memory)
+                    row = {'name': job['name'], 'status': 'failed',
+                           'error': f"{type(e).__name__}: {e}", 'elapsed_sec': 0.0}
+                record(row, job, fingerprint)
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render backtest reports for many runs")
+    parser.add_argument("--tickers", nargs="+", default=UNIVERSE, help="Ticker list")
+    parser.add_argument("--universe-dir", default=UNIVERSE_DIR, help="Root of per-ticker runs")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Process pool size")
+    parser.add_argument("--force", action="store_true", help="Re-render every report")
+    args = parser.parse_args()
+
+    # Ensure we're in the right directory
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    jobs = [report_job(ticker, args.universe_dir) for ticker in args.tickers]
+
+    start_time = time.time()
+    rows = run_reports(jobs, args.workers, force=args.force)
+
+    counts = {}
+    for row in rows:
+        counts[row['status']] = counts.get(row['status'], 0) + 1
+    print(f"\nCompleted in {time.time() - start_time:.1f}s: "
+          + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+
+
+if __name__ == "__main__":
+    main()
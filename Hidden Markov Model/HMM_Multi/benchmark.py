@@ -0,0 +1,394 @@
+"""
+Performance Benchmark Suite
+- Synthetic regime-switching return series of growing length (1k -> 1M rows)
+  and growing universes (1 -> 500 tickers)
+- Times and memory-profiles (tracemalloc peak) each pipeline stage
+- Saves results as JSON so runs can be compared across commits
+- Flags superlinear scaling (log-log slope of time vs size)
+"""
+
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use("Agg")  # Plots are rendered to files only
+
+import numpy as np
+import pandas as pd
+
+from wavelet_features import extract_wavelet_features
+from batch_hmm import fit_batch_hmm
+from worker_pool import limit_threads
+from config import BENCHMARK_DIR, WINDOW, SCALE, N_STATES, INITIAL_CAPITAL
+
+# Stage scripts start with a digit, so import them by name
+train_stage = importlib.import_module("3_train_hmm")
+backtest_stage = importlib.import_module("4_backtest")
+visualize_stage = importlib.import_module("5_visualize")
+
+ROW_SIZES = [1_000, 3_000, 10_000, 30_000, 100_000, 300_000, 1_000_000]
+TICKER_SIZES = [1, 10, 100, 500]
+QUICK_ROW_SIZES = [1_000, 3_000, 10_000, 30_000, 100_000]
+QUICK_TICKER_SIZES = [1, 10, 100]
+ROWS_PER_TICKER = 2520            # ~10 years of daily bars
+BENCH_EM_ITERS = 5                # EM iterations per training benchmark
+SUPERLINEAR_EXPONENT = 1.25       # Flag when time grows faster than n^1.25
+REGRESSION_RATIO = 1.25           # --compare: flag when this much slower
+MIN_TIMED_SEC = 1e-3              # Ignore sizes faster than this when fitting slopes
+SCALING_POINTS = 3                # Largest sizes used to fit the scaling exponent
+
+
+# ============================================================================
+# SYNTHETIC DATA
+# ============================================================================
+
+def make_synthetic_prices(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Regime-switching price series shaped like the downloaded data.
+
+    Returns:
+        DataFrame with 'Adj Close' and 'return' on an hourly DatetimeIndex
+        (daily bars would run past pandas' date range at 1M rows)
+    """
+    rng = np.random.default_rng(seed)
+
+    # Two-state Markov chain: calm bull, volatile bear
+    switches = rng.random(n_rows) < 0.01
+    regimes = np.cumsum(switches) % 2
+    returns = np.where(regimes == 0,
+                       rng.normal(0.0005, 0.008, n_rows),
+                       rng.normal(-0.0008, 0.02, n_rows))
+    returns[0] = np.nan
+
+    prices = 100.0 * np.cumprod(1 + np.nan_to_num(returns))
+    index = pd.date_range("1900-01-01", periods=n_rows, freq="h", name="Date")
+
+    return pd.DataFrame({'Adj Close': prices, 'return': returns}, index=index)
+
+
+def make_model_data(n_states: int = N_STATES, window: int = WINDOW, scale: float = SCALE) -> dict:
+    """Model dict fit on a small synthetic sample, shared by all sizes."""
+    df = make_synthetic_prices(10_000, seed=1)
+    obs, _ = train_stage.prepare_observations(df, window=window, scale=scale, use_cache=False)
+    obs_mean, obs_std = obs.mean(axis=0), obs.std(axis=0)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        model = train_stage.train_hmm((obs - obs_mean) / obs_std, n_states=n_states, verbose=False)
+        state_labels = train_stage.analyze_states(model, n_states)
+
+    return {
+        'model': model,
+        'obs_mean': obs_mean,
+        'obs_std': obs_std,
+        'state_labels': state_labels,
+        'config': {'n_states': n_states, 'window': window, 'scale': scale,
+                   'scales': [scale], 'train_end': str(df.index[-1])}
+    }
+
+
+# ============================================================================
+# STAGES
+# ============================================================================
+# Each stage: setup(n, shared) -> context (not timed), run(context) -> optional extras dict
+
+def _backtest_context(n: int, shared: dict) -> dict:
+    df = make_synthetic_prices(n)
+    features = extract_wavelet_features(df['return'].values, WINDOW, SCALE)[:, None]
+    return {'df': df, 'features': features, 'model_data': shared['model_data'],
+            'test_start': str(df.index[n // 5])}
+
+
+def _run_backtest(ctx: dict, decode: str = 'prefix') -> dict:
+    results_df, _ = backtest_stage.run_backtest(
+        test_start=ctx['test_start'], decode=decode, model_data=ctx['model_data'],
+        features=ctx['features'], df=ctx['df'])
+    return {'days': len(results_df)}
+
+
+def _results_context(n: int, shared: dict) -> dict:
+    ctx = _backtest_context(n, shared)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        ctx['results'], _ = backtest_stage.run_backtest(
+            test_start=ctx['test_start'], model_data=ctx['model_data'],
+            features=ctx['features'], df=ctx['df'])
+    ctx['output_path'] = os.path.join(shared['tmp_dir'], "plot.png")
+    return ctx
+
+
+def _run_metrics(results: pd.DataFrame) -> dict:
+    backtest_stage.calculate_metrics(results, INITIAL_CAPITAL)
+    return {}
+
+
+def _run_train(obs: np.ndarray) -> dict:
+    model = train_stage.train_hmm(obs, n_iter=BENCH_EM_ITERS, verbose=False)
+    return {'em_iterations': model.monitor_.iter}
+
+
+def _universe(n_tickers: int) -> list:
+    return [make_synthetic_prices(ROWS_PER_TICKER, seed=i) for i in range(n_tickers)]
+
+
+def _prepare_universe(frames: list) -> list:
+    sequences = []
+    for df in frames:
+        obs, _ = train_stage.prepare_observations(df, window=WINDOW, scale=SCALE, use_cache=False)
+        sequences.append((obs - obs.mean(axis=0)) / obs.std(axis=0))
+    return sequences
+
+
+def _run_shared_train(sequences: list) -> dict:
+    _, info = fit_batch_hmm(sequences, n_iter=BENCH_EM_ITERS, tol=-np.inf, max_workers=1)
+    return {'em_iterations': info['em_iterations']}
+
+
+def _normalized_obs(n: int) -> np.ndarray:
+    obs, _ = train_stage.prepare_observations(make_synthetic_prices(n), window=WINDOW,
+                                              scale=SCALE, use_cache=False)
+    return (obs - obs.mean(axis=0)) / obs.std(axis=0)
+
+
+STAGES = {
+    # name: (axis, max_size, setup, run)
+    'extract_wavelet_features': (
+        'rows', None,
+        lambda n, shared: make_synthetic_prices(n)['return'].values,
+        lambda returns: extract_wavelet_features(returns, WINDOW, SCALE)),
+    'prepare_observations': (
+        'rows', None,
+        lambda n, shared: make_synthetic_prices(n),
+        lambda df: train_stage.prepare_observations(df, WINDOW, SCALE, use_cache=False)),
+    'train_hmm': (
+        'rows', None,
+        lambda n, shared: _normalized_obs(n),
+        _run_train),
+    'run_backtest': (
+        'rows', None,
+        _backtest_context,
+        _run_backtest),
+    'run_backtest_per_day': (
+        'rows', 10_000,           # Reference decoder re-runs Viterbi every day
+        _backtest_context,
+        lambda ctx: _run_backtest(ctx, decode='per_day')),
+    'calculate_metrics': (
+        'rows', None,
+        lambda n, shared: _results_context(n, shared)['results'],
+        _run_metrics),
+    'plot_results': (
+        'rows', None,
+        _results_context,
+        lambda ctx: visualize_stage.plot_results(
+            plot_start=str(ctx['df'].index[0]), test_start=ctx['test_start'],
+            output_path=ctx['output_path'], df=ctx['df'], results=ctx['results'],
+            model_data=ctx['model_data'])),
+    'plot_state_statistics': (
+        'rows', None,
+        _results_context,
+        lambda ctx: visualize_stage.plot_state_statistics(
+            output_path=ctx['output_path'], results=ctx['results'],
+            model_data=ctx['model_data'])),
+    'prepare_universe': (
+        'tickers', None,
+        lambda n, shared: _universe(n),
+        _prepare_universe),
+    'train_shared_hmm': (
+        'tickers', None,
+        lambda n, shared: _prepare_universe(_universe(n)),
+        _run_shared_train),
+}
+
+
+# ============================================================================
+# RUNNER
+# ============================================================================
+
+def measure(run, context, repeat: int = 1, memory: bool = True) -> dict:
+    """
+    Time a stage (best of `repeat`) and, separately, its tracemalloc peak.
+
+    Memory is measured in its own run because tracing slows Python code.
+    """
+    seconds = []
+    extras = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            result = run(context)
+            seconds.append(time.perf_counter() - start_time)
+            extras = result if isinstance(result, dict) else {}
+            matplotlib.pyplot.close('all')
+
+        peak_mb = None
+        if memory:
+            tracemalloc.start()
+            run(context)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1024**2
+            tracemalloc.stop()
+            matplotlib.pyplot.close('all')
+
+    return {'seconds': min(seconds), 'peak_mb': peak_mb, **extras}
+
+
+def scaling_exponent(sizes: list, seconds: list) -> float:
+    """
+    Least-squares slope of log(time) vs log(size) over the largest sizes.
+
+    Fixed per-call overhead flattens the curve at small sizes, so only the
+    last SCALING_POINTS usable sizes are fitted. None with < 2 points.
+    """
+    points = [(n, t) for n, t in zip(sizes, seconds) if t >= MIN_TIMED_SEC][-SCALING_POINTS:]
+    if len(points) < 2:
+        return None
+    n, t = np.log(np.array(points)).T
+    return float(np.polyfit(n, t, 1)[0])
+
+
+def run_benchmarks(stages: list, row_sizes: list, ticker_sizes: list,
+                   repeat: int = 1, memory: bool = True) -> dict:
+    """
+    Run every stage at every size on its axis.
+
+    Returns:
+        dict with 'results' (one entry per stage and size) and 'scaling'
+        (exponent and superlinear flag per stage)
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        shared = {'model_data': make_model_data(), 'tmp_dir': tmp_dir}
+        results = []
+        scaling = {}
+
+        for name in stages:
+            axis, max_size, setup, run = STAGES[name]
+            sizes = [n for n in (row_sizes if axis == 'rows' else ticker_sizes)
+                     if max_size is None or n <= max_size]
+
+            # Untimed warm-up: JIT compilation, lazy imports, caches
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                run(setup(sizes[0], shared))
+                matplotlib.pyplot.close('all')
+
+            timings = []
+            for n in sizes:
+                context = setup(n, shared)
+                entry = {'stage': name, 'axis': axis, 'size': n,
+                         **measure(run, context, repeat, memory)}
+                # EM stages: compare time per iteration across sizes
+                entry['unit_seconds'] = entry['seconds'] / entry.get('em_iterations', 1)
+                results.append(entry)
+                timings.append(entry['unit_seconds'])
+
+                peak = f"{entry['peak_mb']:9.1f} MB" if entry['peak_mb'] is not None else ""
+                print(f"  {name:26s} {axis:7s} {n:>9,}  {entry['seconds']:9.4f}s {peak}")
+
+            exponent = scaling_exponent(sizes, timings)
+            scaling[name] = {
+                'axis': axis,
+                'exponent': exponent,
+                'superlinear': exponent is not None and exponent > SUPERLINEAR_EXPONENT
+            }
+
+    return {'results': results, 'scaling': scaling}
+
+
+def run_metadata() -> dict:
+    """Commit, versions and machine, stored with every run."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def print_scaling(scaling: dict):
+    print("\nScaling (time ~ size^k):")
+    for name, s in scaling.items():
+        exponent = "n/a" if s['exponent'] is None else f"{s['exponent']:.2f}"
+        flag = "  <- SUPERLINEAR" if s['superlinear'] else ""
+        print(f"  {name:26s} per {s['axis']:7s} k = {exponent}{flag}")
+
+
+def compare_runs(baseline: dict, current: dict) -> list:
+    """
+    Compare two saved runs stage by stage and size by size.
+
+    Returns:
+        List of (stage, size, baseline_sec, current_sec, ratio, regressed)
+    """
+    old = {(e['stage'], e['size']): e['unit_seconds'] for e in baseline['results']}
+    rows = []
+    for e in current['results']:
+        key = (e['stage'], e['size'])
+        if key in old and old[key] > 0:
+            ratio = e['unit_seconds'] / old[key]
+            rows.append((*key, old[key], e['unit_seconds'], ratio,
+                         ratio > REGRESSION_RATIO and e['unit_seconds'] >= MIN_TIMED_SEC))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HMM pipeline stages")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--quick", action="store_true",
+                        help=f"Up to {QUICK_ROW_SIZES[-1]:,} rows and {QUICK_TICKER_SIZES[-1]} tickers")
+    parser.add_argument("--repeat", type=int, default=1, help="Timing runs per size (best kept)")
+    parser.add_argument("--no-memory", action="store_true", help="Skip tracemalloc runs")
+    parser.add_argument("--output", default=None, help="JSON file (default: BENCHMARK_DIR)")
+    parser.add_argument("--compare", default=None, help="Earlier JSON run to compare against")
+    args = parser.parse_args()
+
+    # Ensure we're in the right directory
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    # Benchmark single-core behaviour unless OMP_NUM_THREADS says otherwise
+    if "OMP_NUM_THREADS" not in os.environ:
+        limit_threads()
+
+    row_sizes = QUICK_ROW_SIZES if args.quick else ROW_SIZES
+    ticker_sizes = QUICK_TICKER_SIZES if args.quick else TICKER_SIZES
+
+    print("=" * 70)
+    print("HMM PIPELINE BENCHMARKS")
+    print("=" * 70)
+
+    run = {'meta': run_metadata(), 'row_sizes': row_sizes, 'ticker_sizes': ticker_sizes}
+    run.update(run_benchmarks(args.stages, row_sizes, ticker_sizes, args.repeat,
+                              memory=not args.no_memory))
+    print_scaling(run['scaling'])
+
+    output = args.output or os.path.join(
+        BENCHMARK_DIR, f"bench_{time.strftime('%Y%m%d_%H%M%S')}_{run['meta']['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(run, f, indent=2)
+    print(f"\nResults saved to: {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nComparison with {args.compare} (commit {baseline['meta']['commit']}):")
+        for stage, size, old_sec, new_sec, ratio, regressed in compare_runs(baseline, run):
+            flag = "  <- REGRESSION" if regressed else ""
+            print(f"  {stage:26s} {size:>9,}  {old_sec:9.4f}s -> {new_sec:9.4f}s  x{ratio:.2f}{flag}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Bootstrap Confidence Intervals for Backtest Metrics
+- Resamples the daily strategy returns (paired with the buy & hold returns of
+  the same days) into thousands of paths held in one (n_paths, n_days) array
+- Stationary bootstrap (random block lengths, Politis-Romano) or moving
+  block bootstrap (fixed block length), both circular
+- Metrics computed across all paths at once with the same definitions as
+  calculate_metrics in 4_backtest.py: sums from per-block prefix-sum
+  differences, drawdowns from the cumulative log growth of every path
+- Paths processed in chunks to bound memory
+"""
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    BOOTSTRAP_PATHS,
+    BOOTSTRAP_BLOCK,
+    BOOTSTRAP_CONFIDENCE,
+    BOOTSTRAP_CHUNK,
+    RANDOM_STATE
+)
+
+# Metrics with intervals, in report order
+BOOTSTRAP_METRICS = ('total_return', 'excess_return', 'sharpe_ratio', 'max_drawdown', 'win_rate')
+
+
+def draw_blocks(n: int, n_paths: int, block: float = BOOTSTRAP_BLOCK,
+                method: str = 'stationary', rng: np.random.Generator = None) -> tuple:
+    """
+    Random blocks covering n_paths paths of n days, laid end to end.
+
+    Args:
+        n: Number of days in the original series
+        n_paths: Number of paths
+        block: Mean block length ('stationary') or block length ('block')
+        method: 'stationary' (geometric block lengths, a new block starts
+                with probability 1/block each day) or 'block' (fixed length)
+        rng: NumPy random generator
+
+    Returns:
+        position: (n_blocks,) first position of each block in the flattened
+                  (n_paths * n) stream; every path starts a new block
+        length: (n_blocks,) days in each block
+        first_day: (n_blocks,) day of the original series each block starts
+                   at (blocks wrap around the end circularly)
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    total = n_paths * n
+    path_starts = np.arange(0, total, n)
+
+    if method == 'stationary':
+        # Geometric gaps between block starts, drawn until the stream is covered
+        gaps = []
+        covered = 0
+        while covered < total:
+            gap = rng.geometric(1.0 / block, size=int(total / block * 1.1) + 100)
+            gaps.append(gap)
+            covered += gap.sum()
+        starts = np.cumsum(np.concatenate(gaps))
+        # Merge with the path starts: both are sorted, so a stable sort is a linear merge
+        position = np.sort(np.concatenate([path_starts, starts[starts < total]]), kind='stable')
+        position = position[np.append(True, np.diff(position) != 0)]
+    elif method == 'block':
+        position = (path_starts[:, None] + np.arange(0, n, int(block))).ravel()
+    else:
+        raise ValueError(f"Unknown bootstrap method: {method}")
+
+    length = np.diff(np.append(position, total))
+    first_day = rng.integers(0, n, size=len(position))
+    return position, length, first_day
+
+
+def bootstrap_indices(n: int, n_paths: int, block: float = BOOTSTRAP_BLOCK,
+                      method: str = 'stationary', rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Resampled day indices, one row per path (see draw_blocks).
+
+    Returns:
+        (n_paths, n) array of indices into the original series
+    """
+    position, length, first_day = draw_blocks(n, n_paths, block, method, rng)
+    return _unwrapped_indices(position, length, first_day, n_paths * n).reshape(n_paths, n) % n
+
+
+def _unwrapped_indices(position: np.ndarray, length: np.ndarray, first_day: np.ndarray,
+                       total: int) -> np.ndarray:
+    """Day index of every stream position, in [0, 2n) (index a doubled series, no modulo)."""
+    return np.repeat(first_day - position, length) + np.arange(total)
+
+
+def path_metrics(returns: np.ndarray, benchmark_returns: np.ndarray,
+                 first_day_growth: float = 1.0) -> dict:
+    """
+    Metrics of many return paths at once.
+
+    Args:
+        returns: (n_paths, n_days) daily strategy returns
+        benchmark_returns: (n_paths, n_days) daily buy & hold returns
+        first_day_growth: Strategy value on the first day / initial capital
+                          (the first day has no daily return)
+
+    Returns:
+        dict of metric name -> (n_paths,) array
+    """
+    growth = np.cumprod(1 + returns, axis=1)
+    total_return = first_day_growth * growth[:, -1] - 1
+    buy_hold_return = np.prod(1 + benchmark_returns, axis=1) - 1
+
+    std = returns.std(axis=1, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(std > 0, np.sqrt(252) * returns.mean(axis=1) / std, 0.0)
+
+    rolling_max = np.maximum.accumulate(growth, axis=1)
+    max_drawdown = ((growth - rolling_max) / rolling_max).min(axis=1)
+
+    return {
+        'total_return': total_return,
+        'excess_return': total_return - buy_hold_return,
+        'sharpe_ratio': sharpe,
+        'max_drawdown': max_drawdown,
+        'win_rate': (returns > 0).mean(axis=1)
+    }
+
+
+def _block_metrics(returns: np.ndarray, benchmark_returns: np.ndarray, blocks: tuple,
+                   n_paths: int, first_day_growth: float) -> dict:
+    """
+    path_metrics for resampled paths, computed block by block.
+
+    Sums (mean, variance, wins, log growth) come from prefix sums over the
+    doubled series, one difference per block, so they cost O(n_blocks).
+    Only the drawdown, which needs each path's running maximum, touches
+    every day: it runs on cumulative log growth.
+    """
+    n = len(returns)
+    position, length, first_day = blocks
+    log_growth = np.log1p(returns)
+
+    def block_sums(x):
+        prefix = np.concatenate([[0.0], np.cumsum(np.concatenate([x, x]))])
+        sums = prefix[first_day + length] - prefix[first_day]
+        return np.add.reduceat(sums, np.searchsorted(position, np.arange(0, n_paths * n, n)))
+
+    total = block_sums(returns)
+    total_sq = block_sums(returns ** 2)
+    wins = block_sums((returns > 0).astype(float))
+    log_total = block_sums(log_growth)
+    log_benchmark = block_sums(np.log1p(benchmark_returns))
+
+    mean = total / n
+    std = np.sqrt(np.maximum(total_sq - total * mean, 0) / (n - 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(std > 0, np.sqrt(252) * mean / std, 0.0)
+
+    # Cumulative log growth of every path and its running maximum
+    idx = _unwrapped_indices(position, length, first_day, n_paths * n)
+    growth = np.cumsum(np.concatenate([log_growth, log_growth])[idx].reshape(n_paths, n), axis=1)
+    drop = growth - np.maximum.accumulate(growth, axis=1)
+    max_drawdown = np.expm1(drop.min(axis=1))
+
+    total_return = first_day_growth * np.exp(log_total) - 1
+    return {
+        'total_return': total_return,
+        'excess_return': total_return - np.expm1(log_benchmark),
+        'sharpe_ratio': sharpe,
+        'max_drawdown': max_drawdown,
+        'win_rate': wins / n
+    }
+
+
+def bootstrap_metrics(results_df: pd.DataFrame, initial_capital: float,
+                      n_paths: int = BOOTSTRAP_PATHS, block: float = BOOTSTRAP_BLOCK,
+                      method: str = 'stationary', confidence: float = BOOTSTRAP_CONFIDENCE,
+                      chunk_size: int = BOOTSTRAP_CHUNK,
+                      random_state: int = RANDOM_STATE) -> dict:
+    """
+    Bootstrap confidence intervals for the backtest metrics.
+
+    Strategy and buy & hold returns are resampled with the same blocks, so
+    the excess return interval keeps their correlation. The metrics of the
+    original (unresampled) path are those of calculate_metrics.
+
+    Args:
+        results_df: Backtest results (total_value and price columns)
+        initial_capital: Starting capital
+        n_paths: Number of bootstrap paths
+        block: Mean block length in days ('stationary') or block length ('block')
+        method: 'stationary' or 'block'
+        confidence: Two-sided interval coverage (e.g. 0.95)
+        chunk_size: Paths resampled at a time (memory ~ 4 * chunk_size * n_days * 8 bytes)
+        random_state: Seed
+
+    Returns:
+        dict with n_paths, block, method, confidence and intervals:
+        metric name -> {'low', 'high', 'std'}
+    """
+    values = results_df['total_value'].to_numpy(dtype=float)
+    prices = results_df['price'].to_numpy(dtype=float)
+    returns = values[1:] / values[:-1] - 1
+    benchmark_returns = prices[1:] / prices[:-1] - 1
+    first_day_growth = values[0] / initial_capital
+
+    rng = np.random.default_rng(random_state)
+    samples = {name: np.empty(n_paths) for name in BOOTSTRAP_METRICS}
+
+    for lo in range(0, n_paths, chunk_size):
+        hi = min(lo + chunk_size, n_paths)
+        blocks = draw_blocks(len(returns), hi - lo, block, method, rng)
+        chunk = _block_metrics(returns, benchmark_returns, blocks, hi - lo, first_day_growth)
+        for name in BOOTSTRAP_METRICS:
+            samples[name][lo:hi] = chunk[name]
+
+    tail = (1 - confidence) / 2 * 100
+    intervals = {
+        name: {
+            'low': float(np.percentile(samples[name], tail)),
+            'high': float(np.percentile(samples[name], 100 - tail)),
+            'std': float(samples[name].std(ddof=1))
+        }
+        for name in BOOTSTRAP_METRICS
+    }
+
+    return {
+        'n_paths': n_paths,
+        'block': block,
+        'method': method,
+        'confidence': confidence,
+        'intervals': intervals
+    }
+
+
+if __name__ == "__main__":
+    # Quick test: identity path reproduces calculate_metrics, then timing on 20 years
+    import importlib
+    import time
+
+    backtest_stage = importlib.import_module("4_backtest")
+
+    np.random.seed(42)
+    n_days = 252 * 20
+    dates = pd.bdate_range("2000-01-03", periods=n_days)
+    prices = 100 * np.cumprod(1 + np.random.randn(n_days) * 0.01)
+    invested = (np.arange(n_days) // 50) % 2 == 0
+    total_value = 1e5 * np.cumprod(1 + np.where(invested, np.r_[0, np.diff(prices) / prices[:-1]], 0))
+    fake_results = pd.DataFrame({
+        'price': prices, 'total_value': total_value, 'invested': invested,
+        'action': 'HOLD', 'regime': (~invested).astype(int)
+    }, index=dates)
+
+    metrics = backtest_stage.calculate_metrics(fake_results.copy(), 1e5)
+    values = fake_results['total_value'].to_numpy()
+    returns = values[1:] / values[:-1] - 1
+    benchmark = prices[1:] / prices[:-1] - 1
+    point = path_metrics(returns[None, :], benchmark[None, :], values[0] / 1e5)
+    for name in BOOTSTRAP_METRICS:
+        assert np.isclose(point[name][0], metrics[name]), name
+    print("Test bootstrap:")
+    print("  OK: original path reproduces calculate_metrics")
+
+    for method in ('stationary', 'block'):
+        # Block-wise metrics match the direct per-path computation on the same paths
+        blocks = draw_blocks(len(returns), 200, 20, method, np.random.default_rng(0))
+        idx = bootstrap_indices(len(returns), 200, 20, method, np.random.default_rng(0))
+        fast = _block_metrics(returns, benchmark, blocks, 200, values[0] / 1e5)
+        direct = path_metrics(returns[idx], benchmark[idx], values[0] / 1e5)
+        for name in BOOTSTRAP_METRICS:
+            assert np.allclose(fast[name], direct[name]), (method, name)
+        print(f"  OK: {method} bootstrap, mean block length {len(returns) * 200 / len(blocks[0]):.1f} days (target 20)")
+
+    start = time.perf_counter()
+    result = bootstrap_metrics(fake_results, 1e5, n_paths=10_000)
+    elapsed = time.perf_counter() - start
+    print(f"  10,000 paths x {n_days} days: {elapsed:.2f}s")
+    for name, ci in result['intervals'].items():
+        print(f"  {name:15s} {metrics[name]:+8.3f}  [{ci['low']:+8.3f}, {ci['high']:+8.3f}]")
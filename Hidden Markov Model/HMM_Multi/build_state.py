@@ -0,0 +1,38 @@
+"""
+Build State - make-style skip bookkeeping
+- Content hashes of files and fingerprints of input dicts
+- JSON state file with the fingerprint of each target's last successful build
+- Shared by run_pipeline.py (stages) and batch_report.py (rendered reports)
+"""
+
+import hashlib
+import json
+import os
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """Content hash of a file."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_inputs(inputs: dict) -> str:
+    """Hash of a JSON-serializable dict (other values hashed by their str())."""
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_state(path: str) -> dict:
+    """Fingerprints recorded by the last successful build of each target."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(state: dict, path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(state, f, indent=2)
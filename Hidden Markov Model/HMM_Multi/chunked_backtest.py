@@ -0,0 +1,299 @@
+"""
+Out-of-Core Backtest - Run the backtest over bars read in chunks
+- For minute/tick bar files larger than memory: one chunk of bars is read
+  (price store slices or CSV chunks), decoded, traded and appended to the
+  results CSV at a time
+- Carried across chunk boundaries: the last window-1 returns (wavelet
+  window tail), the prefix Viterbi lattice column, the last decoded state,
+  the risk manager's portfolio and the last portfolio value
+- Output identical to the in-memory run_backtest on the same file
+"""
+
+import argparse
+import importlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from wavelet_features import BLOCK_ROWS, extract_wavelet_feature_bank
+from hmm_inference import resume_prefix_viterbi
+from price_store import iter_price_chunks
+from backtest_engine import run_array_engine
+from model_store import load_model
+from instrumentation import count, timer
+from config import (
+    DATA_FILE,
+    MODEL_FILE,
+    BACKTEST_RESULTS_FILE,
+    TEST_START_DATE,
+    STOP_LOSS_PCT,
+    CHUNK_ROWS
+)
+
+# Stage scripts start with a digit, so import them by name
+backtest_stage = importlib.import_module("4_backtest")
+
+# Results columns calculate_metrics reads
+METRIC_COLUMNS = ['price', 'total_value', 'action', 'invested', 'regime']
+
+
+class ChunkedBacktest:
+    """
+    run_backtest as a sequence of chunks.
+
+    Feed consecutive chunks of price data (in date order) to feed() and
+    call finish() after the last one; each call returns the results rows
+    it completed. Rows before the test period are only kept as lookback
+    (the last `window` of them), as in run_backtest. Rows are processed up
+    to wavelet block boundaries (wavelet_features.BLOCK_ROWS), so energies
+    are bit-identical to one extraction over the whole file; the remainder
+    waits for the next chunk.
+    """
+
+    def __init__(self, model_data: dict, test_start: str = TEST_START_DATE,
+                 stop_loss_pct: float = STOP_LOSS_PCT):
+        config = model_data['config']
+        self.window = config['window']
+        self.scales = config.get('scales', [config['scale']])  # Older models: single scale
+        self.test_start = pd.Timestamp(test_start)
+
+        self.strategy = backtest_stage.HMMStrategy(model_data=model_data)
+        self.risk_mgr = backtest_stage.RegimeHMMRiskManager(stop_loss_pct=stop_loss_pct)
+        self.order_stats = {'orders_executed': 0, 'orders_blocked': 0}
+
+        self.pending = None           # Rows read but not processed yet
+        self.started = False          # Test period reached
+        self.n_lookback = 0           # Lookback rows at the front of pending
+        self.n_processed = 0          # Rows processed (from the lookback start)
+        self.tail = np.empty(0)       # Last window-1 returns (wavelet window tail)
+        self.delta = None             # Prefix Viterbi lattice column
+        self.n_valid = 0              # Valid observations decoded so far
+        self.last_state = -1          # State and energy of the last valid observation
+        self.last_energy = np.nan
+        self.last_value = np.nan      # Portfolio value of the last trading day
+        self.first_day = None
+        self.last_day = None
+        self.n_days = 0
+
+    def feed(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add the next chunk of price data.
+
+        Args:
+            chunk: Rows with 'Adj Close' and 'return' columns, following
+                   the previous chunk
+
+        Returns:
+            Results rows completed by this chunk (possibly empty)
+        """
+        pending = chunk if self.pending is None else pd.concat([self.pending, chunk])
+
+        if not self.started:
+            first_test = pending.index.searchsorted(self.test_start)
+            if first_test == len(pending):
+                self.pending = pending.iloc[-self.window:]
+                return self._empty_results()
+
+            # Same history as run_backtest: `window` rows before the test period
+            lookback_start = max(first_test - self.window, 0)
+            pending = pending.iloc[lookback_start:]
+            self.n_lookback = first_test - lookback_start
+            self.started = True
+
+        # Process up to the last complete wavelet block
+        n_total = self.n_processed + len(pending)
+        n_ready = (n_total - self.window + 1) // BLOCK_ROWS * BLOCK_ROWS + self.window - 1
+        n_ready = max(n_ready - self.n_processed, 0)
+
+        self.pending = pending.iloc[n_ready:]
+        return self._process(pending.iloc[:n_ready])
+
+    def finish(self) -> pd.DataFrame:
+        """Process the rows still pending after the last chunk."""
+        pending, self.pending = self.pending, None
+        if not self.started or pending is None:
+            return self._empty_results()
+        return self._process(pending)
+
+    def _empty_results(self) -> pd.DataFrame:
+        return self._process(pd.DataFrame({'Adj Close': [], 'return': []},
+                                          index=pd.DatetimeIndex([], name='Date')))
+
+    def _process(self, block: pd.DataFrame) -> pd.DataFrame:
+        """Features, states and trades of the next rows."""
+        with timer("chunked_backtest.block"):
+            count("chunked_backtest.rows", len(block))
+            n_lookback = min(self.n_lookback, len(block))
+            self.n_lookback -= n_lookback
+            self.n_processed += len(block)
+
+            # Wavelet energies: the tail supplies the windows that straddle the boundary
+            returns = block['return'].to_numpy(dtype=float)
+            series = np.concatenate([self.tail, returns])
+            energies = extract_wavelet_feature_bank(series, window=self.window,
+                                                    scales=self.scales)[len(self.tail):]
+            self.tail = series[max(len(series) - self.window + 1, 0):]
+
+            # Decode the valid observations, continuing the lattice of earlier blocks
+            obs = np.column_stack([returns, energies])
+            valid_mask = ~np.isnan(obs).any(axis=1)
+            valid_obs = obs[valid_mask]
+            model = self.strategy.model
+            obs_norm = (valid_obs - self.strategy.obs_mean) / self.strategy.obs_std
+            valid_states, self.delta = resume_prefix_viterbi(
+                model.startprob_, model.transmat_, model._compute_log_likelihood(obs_norm),
+                self.delta)
+
+            # State and energy of the last valid observation up to each row
+            n_valid_block = np.cumsum(valid_mask)
+            n_valid_through = self.n_valid + n_valid_block
+            row_states = np.full(len(block), self.last_state)
+            row_energies = np.full(len(block), self.last_energy)
+            if len(valid_obs):
+                has_valid = n_valid_block > 0
+                row_states[has_valid] = valid_states[n_valid_block[has_valid] - 1]
+                row_energies[has_valid] = valid_obs[n_valid_block[has_valid] - 1, 1]
+                self.n_valid += len(valid_obs)
+                self.last_state = valid_states[-1]
+                self.last_energy = valid_obs[-1, 1]
+
+            # Days with enough valid history to trade
+            tradable = n_valid_through[n_lookback:] >= self.window
+            days_df = block.iloc[n_lookback:][tradable]
+            states = row_states[n_lookback:][tradable]
+            regimes = np.where(states == self.strategy.bull_state, 0, 1)
+
+            results_df, order_stats = run_array_engine(days_df, states, regimes,
+                                                       row_energies[n_lookback:][tradable],
+                                                       self.risk_mgr)
+
+        for key in self.order_stats:
+            self.order_stats[key] += order_stats[key]
+
+        # Daily strategy return, as calculate_metrics adds it to run_backtest's results
+        values = results_df['total_value'].to_numpy()
+        results_df['strategy_return'] = values / np.concatenate([[self.last_value], values[:-1]]) - 1
+
+        if len(results_df):
+            self.first_day = results_df.index[0] if self.first_day is None else self.first_day
+            self.last_day = results_df.index[-1]
+            self.n_days += len(results_df)
+            self.last_value = values[-1]
+
+        return results_df
+
+
+def run_chunked_backtest(data_path: str = DATA_FILE, model_path: str = MODEL_FILE,
+                         output_path: str = BACKTEST_RESULTS_FILE,
+                         test_start: str = TEST_START_DATE,
+                         stop_loss_pct: float = STOP_LOSS_PCT,
+                         chunk_rows: int = CHUNK_ROWS, model_data: dict = None,
+                         with_metrics: bool = True) -> tuple:
+    """
+    Backtest a price file chunk by chunk, appending results to a CSV.
+
+    Memory is bounded by chunk_rows during the run. With with_metrics,
+    calculate_metrics then reads back the five results columns it uses.
+
+    Args:
+        data_path: CSV file or price store (Date index, 'Adj Close' and
+                   'return' columns)
+        model_path: Model artifact
+        output_path: Results CSV, same content as run_backtest's results_df.to_csv
+        test_start: First date (or timestamp) of the test period
+        stop_loss_pct: Stop loss threshold for the risk manager
+        chunk_rows: Bars per chunk
+        model_data: Already loaded model dict (skips reading model_path)
+        with_metrics: Compute calculate_metrics from the written results
+
+    Returns:
+        metrics: calculate_metrics dict (None without with_metrics)
+        order_stats: dict with 'orders_executed' and 'orders_blocked'
+    """
+    if model_data is None:
+        model_data = load_model(model_path)
+    backtest = ChunkedBacktest(model_data, test_start, stop_loss_pct)
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, 'w', newline='') as f:
+        def write(results_df):
+            if len(results_df):
+                results_df.to_csv(f, header=f.tell() == 0)
+
+        for chunk in iter_price_chunks(data_path, chunk_rows, columns=['Adj Close', 'return']):
+            write(backtest.feed(chunk))
+        write(backtest.finish())
+
+    if backtest.n_days == 0:
+        raise ValueError(f"No tradable days on or after {test_start}")
+
+    print(f"\nBacktest period: {backtest.first_day} to {backtest.last_day}")
+    print(f"Test days: {backtest.n_days}")
+    print(f"\nOrder Statistics:")
+    print(f"  Orders executed: {backtest.order_stats['orders_executed']}")
+    print(f"  Orders blocked:  {backtest.order_stats['orders_blocked']}")
+
+    metrics = None
+    if with_metrics:
+        # Round-trip float parsing reads back exactly the values written
+        results = pd.read_csv(output_path, usecols=METRIC_COLUMNS, float_precision='round_trip',
+                              dtype={'action': 'category'})
+        metrics = backtest_stage.calculate_metrics(results, backtest.risk_mgr.initial_capital)
+
+    return metrics, backtest.order_stats
+
+
+def verify_chunked(data_path: str, output_path: str, metrics: dict, model_path: str = MODEL_FILE,
+                   test_start: str = TEST_START_DATE, stop_loss_pct: float = STOP_LOSS_PCT,
+                   model_data: dict = None):
+    """Check a chunked run against the in-memory run_backtest on the same file."""
+    results_df, expected = backtest_stage.run_backtest(data_path, model_path,
+                                                       test_start=test_start,
+                                                       stop_loss_pct=stop_loss_pct,
+                                                       model_data=model_data)
+    expected_path = f"{output_path}.in_memory"
+    results_df.to_csv(expected_path)
+    try:
+        with open(output_path, 'rb') as f, open(expected_path, 'rb') as g:
+            assert f.read() == g.read(), "Results file mismatch"
+    finally:
+        os.remove(expected_path)
+    assert all(np.array_equal(metrics[k], expected[k]) if k != 'regime_distribution'
+               else metrics[k] == expected[k] for k in expected), "Metrics mismatch"
+    print(f"OK: chunked run matches run_backtest on {len(results_df)} bars")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest a large bar file chunk by chunk")
+    parser.add_argument("--data", default=DATA_FILE, help="CSV file or price store")
+    parser.add_argument("--model", default=MODEL_FILE, help="Model artifact")
+    parser.add_argument("--output", default=BACKTEST_RESULTS_FILE, help="Results CSV")
+    parser.add_argument("--test-start", default=TEST_START_DATE, help="First test date/timestamp")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="Bars per chunk")
+    parser.add_argument("--verify", action="store_true",
+                        help="Also run the in-memory backtest and check the outputs are identical")
+    args = parser.parse_args()
+
+    # Ensure we're in the right directory
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    start_time = time.time()
+    metrics, _ = run_chunked_backtest(args.data, args.model, args.output, args.test_start,
+                                      chunk_rows=args.chunk_rows)
+    print(f"\nCompleted in {time.time() - start_time:.1f}s, results saved to: {args.output}")
+    print(f"\nFinal Value:         ${metrics['final_value']:,.2f}")
+    print(f"Strategy Return:     {metrics['total_return_pct']:+.2f}%")
+    print(f"Buy & Hold Return:   {metrics['buy_hold_return_pct']:+.2f}%")
+    print(f"Sharpe Ratio:        {metrics['sharpe_ratio']:.3f}")
+    print(f"Max Drawdown:        {metrics['max_drawdown_pct']:.2f}%")
+    print(f"Time Invested:       {metrics['time_invested_pct']:.1f}%")
+
+    if args.verify:
+        verify_chunked(args.data, args.output, metrics, args.model, args.test_start)
+
+
+if __name__ == "__main__":
+    main()
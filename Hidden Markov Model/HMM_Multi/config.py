@@ -20,6 +20,7 @@ TEST_START_DATE = "2008-01-01"  # First date for testing (inclusive)
 # Visualization Settings
 PLOT_START_DATE = "2007-01-01"  # Start date for price chart visualization
                                 # (shows context before test period)
+PLOT_MAX_POINTS = 4000          # Longer lines are LTTB-downsampled (None = plot every point)
 
 # ============================================================================
 # MODEL CONFIGURATION
@@ -29,8 +30,11 @@ PLOT_START_DATE = "2007-01-01"  # Start date for price chart visualization
 N_STATES = 2        # Number of hidden states (2 = BULL/BEAR)
 WINDOW = 5          # Wavelet window size (days)
 SCALE = 5           # Wavelet scale parameter
+SCALES = [SCALE]    # Wavelet scales in the feature bank (one energy column each)
 N_ITER = 100        # Max EM iterations for HMM training
 RANDOM_STATE = 42   # Random seed for reproducibility
+N_INIT = 1          # EM restarts (seeds RANDOM_STATE, RANDOM_STATE + 1, ...);
+                    # the fit with the best log-likelihood is kept
 
 # ============================================================================
 # TRADING CONFIGURATION
@@ -41,6 +45,66 @@ INITIAL_CAPITAL = 100000.0    # Starting portfolio value
 MAX_POSITION_PCT = 1.0        # Max % of capital to invest (1.0 = 100%)
 STOP_LOSS_PCT = 0.02          # Stop loss threshold (0.02 = 2%)
 
+# Bootstrap confidence intervals in the backtest report (bootstrap.py)
+BOOTSTRAP_PATHS = 10000       # Resampled return paths (0 = no intervals)
+BOOTSTRAP_BLOCK = 21          # Mean block length in days (~1 month)
+BOOTSTRAP_CONFIDENCE = 0.95   # Two-sided interval coverage
+BOOTSTRAP_CHUNK = 1000        # Paths resampled at a time (bounds memory)
+
+# Out-of-core backtest (chunked_backtest.py): bars read, decoded and written per chunk
+CHUNK_ROWS = 250_000          # Bars per chunk (bounds memory)
+
+# ============================================================================
+# UNIVERSE CONFIGURATION
+# ============================================================================
+
+# Multi-ticker mode (run_universe.py)
+UNIVERSE = ["SPY", "QQQ", "IWM", "DIA", "XLF", "XLE", "XLK", "XLV"]
+UNIVERSE_DIR = "universe"     # Per-ticker data/models/results go here
+MAX_WORKERS = None            # Process pool size (None = all cores)
+SHARED_MODEL_FILE = f"{UNIVERSE_DIR}/shared_model.npz"  # One HMM fit to every ticker
+
+# Portfolio backtest (portfolio_backtest.py): allocation across UNIVERSE by regime
+PORTFOLIO_REBALANCE = "signal"  # "signal": whenever the BULL set changes; int k: every k days
+PORTFOLIO_WEIGHTING = "equal"   # "equal" or "probability" (filtered P(BULL) weights)
+PORTFOLIO_TOP_N = None          # Hold at most N assets (None = every BULL asset)
+
+# ============================================================================
+# SWEEP CONFIGURATION
+# ============================================================================
+
+# Hyperparameter grid (run_sweep.py): every combination is evaluated
+SWEEP_GRID = {
+    'n_states': [2, 3],
+    'window': [5, 10, 20],
+    'scale': [5, 10],
+    'stop_loss_pct': [0.02, 0.05]
+}
+SWEEP_RANK_BY = "sharpe_ratio"  # Metric from calculate_metrics used for ranking
+
+# Ensemble members (ensemble_hmm.py --train): one model per combination,
+# evaluated together and combined by vote
+ENSEMBLE_GRID = {
+    'n_states': [2],
+    'window': [5, 10],
+    'scale': [5, 10],
+    'random_state': [42, 43, 44]
+}
+
+# ============================================================================
+# WALK-FORWARD CONFIGURATION
+# ============================================================================
+
+# Periodic retraining during the test period (walk_forward.py)
+WF_RETRAIN_EVERY = 21         # Retrain every N test days (~monthly)
+WF_TRAIN_WINDOW = None        # Rows per refit (None = expanding window)
+WF_WARM_START = "chain"       # "chain": start EM from the previous refit (sequential)
+                              # "anchor": start EM from the initial fit (parallel)
+
+# Online EM (online_hmm.py): nightly updates from new observations only
+ONLINE_FORGETTING = 0.998     # Weight decay per observation (1.0 = never forget;
+                              # 0.998 ~ 500-observation memory)
+
 # ============================================================================
 # FILE PATHS
 # ============================================================================
@@ -52,13 +116,36 @@ DATA_FILE = f"{DATA_DIR}/{TICKER}.csv"
 
 # Model
 MODEL_DIR = "models"
-MODEL_FILE = f"{MODEL_DIR}/hmm_model.pkl"
+MODEL_FILE = f"{MODEL_DIR}/hmm_model.npz"
+ONLINE_MODEL_FILE = f"{MODEL_DIR}/hmm_online.npz"  # Model + online EM statistics
+ENSEMBLE_DIR = f"{MODEL_DIR}/ensemble"  # One .npz per ensemble member
 
 # Results
 RESULTS_DIR = "results"
 BACKTEST_RESULTS_FILE = f"{RESULTS_DIR}/backtest_results.csv"
 BACKTEST_PLOT_FILE = f"{RESULTS_DIR}/backtest_plot.png"
 STATE_STATS_PLOT_FILE = f"{RESULTS_DIR}/state_stats.png"
+SWEEP_RESULTS_FILE = f"{RESULTS_DIR}/sweep_results.csv"
+WF_RESULTS_FILE = f"{RESULTS_DIR}/walk_forward_results.csv"
+WF_RETRAIN_LOG_FILE = f"{RESULTS_DIR}/walk_forward_retrains.csv"
+ENSEMBLE_RESULTS_FILE = f"{RESULTS_DIR}/ensemble_regimes.csv"
+PORTFOLIO_RESULTS_FILE = f"{RESULTS_DIR}/portfolio_results.csv"
+BENCHMARK_DIR = f"{RESULTS_DIR}/benchmarks"  # benchmark.py JSON runs
+
+# Feature cache (wavelet energies, reused across runs)
+CACHE_DIR = "cache"
+FEATURE_CACHE_DIR = f"{CACHE_DIR}/features"
+FEATURE_CACHE_MAX_BYTES = 512 * 1024**2  # LRU eviction budget (512 MB)
+USE_FEATURE_CACHE = True
+
+# Pipeline runner state (stage input fingerprints)
+PIPELINE_STATE_FILE = f"{CACHE_DIR}/pipeline_state.json"
+REPORT_STATE_FILE = f"{CACHE_DIR}/report_state.json"  # batch_report.py input fingerprints
+
+# Instrumentation (timers, counters, peak memory per stage); off unless
+# HMM_PROFILE=1 is set or run_pipeline.py --profile is used
+PROFILE_ENV_VAR = "HMM_PROFILE"
+RUN_REPORT_FILE = f"{RESULTS_DIR}/run_report.json"
 
 # ============================================================================
 # HELPER FUNCTIONS
@@ -80,6 +167,7 @@ def print_config():
     print(f"HMM States:       {N_STATES}")
     print(f"Wavelet Window:   {WINDOW} days")
     print(f"Wavelet Scale:    {SCALE}")
+    print(f"Feature Scales:   {SCALES}")
     print(f"Max Iterations:   {N_ITER}")
 
     print("\n--- TRADING SETTINGS ---")
@@ -91,6 +179,7 @@ def print_config():
     print(f"Data File:        {DATA_FILE}")
     print(f"Model File:       {MODEL_FILE}")
     print(f"Results File:     {BACKTEST_RESULTS_FILE}")
+    print(f"Run Report:       {RUN_REPORT_FILE} ({PROFILE_ENV_VAR}=1 to enable)")
     print("="*70 + "\n")
 
 
@@ -0,0 +1,405 @@
+"""
+Ensemble HMM Inference - many regime models over one observation stream
+- Members differ in seed, window, scales and number of states; their
+  parameters are stacked into (M, K) / (M, K, K) arrays (smaller models
+  padded with unreachable states)
+- One wavelet feature bank per window (union of the members' scales),
+  computed once and shared by every member with that window
+- One vectorized forward pass over time evaluates every member's filter
+  and prefix-Viterbi recursion together (same states as HMMStrategy)
+- Per-model and aggregated regime probabilities, plus a majority vote
+"""
+
+import argparse
+import contextlib
+import importlib
+import itertools
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from feature_cache import load_feature_bank
+from hmm_inference import GaussianHMMParams, gaussian_log_likelihood
+from model_store import load_model, save_model
+from price_store import load_price_data
+from instrumentation import count, timer
+from config import (
+    DATA_FILE,
+    TRAIN_END_DATE,
+    TEST_START_DATE,
+    N_STATES,
+    N_ITER,
+    ENSEMBLE_GRID,
+    ENSEMBLE_DIR,
+    ENSEMBLE_RESULTS_FILE,
+    USE_FEATURE_CACHE
+)
+
+# Stage scripts start with a digit, so import them by name
+train_stage = importlib.import_module("3_train_hmm")
+
+
+class HMMEnsemble:
+    """
+    Stacked parameters of several trained models (model dicts as load_model returns).
+
+    Each member keeps its own features (window, scales) and normalization;
+    states are mapped to regimes as in HMMStrategy (highest mean return =
+    BULL = regime 0).
+    """
+
+    def __init__(self, members: list, weights: np.ndarray = None):
+        self.members = members
+        self.n_models = len(members)
+        self.n_states = max(m['model'].n_components for m in members)
+        self.weights = (np.full(self.n_models, 1 / self.n_models) if weights is None
+                        else np.asarray(weights, dtype=float) / np.sum(weights))
+
+        M, K = self.n_models, self.n_states
+        self.startprob = np.zeros((M, K))
+        self.transmat = np.zeros((M, K, K))
+        self.bull_state = np.empty(M, dtype=int)
+        for i, member in enumerate(members):
+            model = member['model']
+            k = model.n_components
+            self.startprob[i, :k] = model.startprob_
+            self.transmat[i, :k, :k] = model.transmat_
+            self.transmat[i, k:, k:] = np.eye(K - k)  # Padding states: never entered
+            self.bull_state[i] = np.argmax(model.means_[:, 0])
+
+    @classmethod
+    def from_files(cls, model_paths: list, weights: np.ndarray = None) -> 'HMMEnsemble':
+        return cls([load_model(path) for path in model_paths], weights)
+
+    def feature_banks(self, returns: np.ndarray, use_cache: bool = USE_FEATURE_CACHE) -> dict:
+        """
+        Wavelet energies per window, for the union of the scales its members use.
+
+        Returns:
+            dict window -> (scales, (N, n_scales) energies)
+        """
+        scales_by_window = {}
+        for member in self.members:
+            config = member['config']
+            scales = config.get('scales', [config['scale']])
+            scales_by_window.setdefault(config['window'], set()).update(scales)
+
+        banks = {}
+        for window, scales in scales_by_window.items():
+            scales = sorted(scales)
+            banks[window] = (scales, load_feature_bank(returns, window=window, scales=scales,
+                                                       use_cache=use_cache))
+        return banks
+
+    def emission_log_likelihood(self, returns: np.ndarray, banks: dict) -> tuple:
+        """
+        Per-member emission log-likelihoods over a shared time axis.
+
+        Returns:
+            framelogprob: (M, N, K); -inf for padding states, NaN on invalid rows
+            valid: (M, N) rows where the member has a complete observation
+        """
+        n_samples = len(returns)
+        framelogprob = np.full((self.n_models, n_samples, self.n_states), -np.inf)
+        valid = np.empty((self.n_models, n_samples), dtype=bool)
+
+        for i, member in enumerate(self.members):
+            config, model = member['config'], member['model']
+            bank_scales, energies = banks[config['window']]
+            columns = [bank_scales.index(s) for s in config.get('scales', [config['scale']])]
+            obs = np.column_stack([returns, energies[:, columns]])
+            valid[i] = ~np.isnan(obs).any(axis=1)
+
+            obs_norm = (obs[valid[i]] - member['obs_mean']) / member['obs_std']
+            k = model.n_components
+            framelogprob[i, valid[i], :k] = gaussian_log_likelihood(obs_norm, model.means_,
+                                                                    model.covars_)
+            framelogprob[i, ~valid[i]] = np.nan
+
+        return framelogprob, valid
+
+    def forward(self, framelogprob: np.ndarray, valid: np.ndarray) -> tuple:
+        """
+        Filter and prefix-Viterbi recursions of every member in one pass over time.
+
+        Invalid rows are skipped, as the backtest drops them: a member's state
+        carries over unchanged and its recursion starts at its first valid row.
+
+        Returns:
+            filtered: (N, M, K) P(state | member's observations so far), NaN
+                      before the member's first valid row
+            states: (N, M) last Viterbi state of the prefix, -1 before the first valid row
+        """
+        M, n_samples, K = framelogprob.shape
+        count("ensemble_forward_calls")
+        count("ensemble_days", n_samples * M)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_startprob = np.log(self.startprob)
+            log_transmat = np.log(self.transmat)
+            frame_max = np.where(valid[:, :, None], framelogprob, 0).max(axis=2, keepdims=True)
+            frameprob = np.exp(framelogprob - frame_max)
+
+        filtered = np.full((n_samples, M, K), np.nan)
+        states = np.full((n_samples, M), -1)
+        alpha = self.startprob.copy()
+        delta = log_startprob.copy()
+        started = np.zeros(M, dtype=bool)
+
+        with np.errstate(invalid='ignore'):
+            for t in range(n_samples):
+                step = valid[:, t][:, None]
+                first = ~started[:, None]
+
+                # Forward filter (normalized)
+                prior = np.where(first, self.startprob, np.einsum('mk,mkl->ml', alpha, self.transmat))
+                a = prior * frameprob[:, t]
+                alpha = np.where(step, a / a.sum(axis=1, keepdims=True), alpha)
+
+                # Viterbi lattice, same recursion as hmm_inference.prefix_viterbi
+                d = np.where(first, log_startprob,
+                             (delta[:, :, None] + log_transmat).max(axis=1)) + framelogprob[:, t]
+                delta = np.where(step, d, delta)
+
+                started |= valid[:, t]
+                filtered[t, started] = alpha[started]
+                states[t, started] = delta[started].argmax(axis=1)
+
+        return filtered, states
+
+    def predict(self, returns: np.ndarray, use_cache: bool = USE_FEATURE_CACHE) -> dict:
+        """
+        Regime probabilities of every member and of the ensemble.
+
+        Args:
+            returns: (N,) daily returns (the members' observation stream)
+
+        Returns:
+            dict with
+            - filtered: (N, M, K) per-member filtered state probabilities
+            - states: (N, M) per-member prefix-Viterbi states (-1 = no data yet)
+            - p_bull: (N, M) per-member filtered P(BULL)
+            - ensemble_p_bull: (N,) weighted mean of p_bull over members with data
+            - vote: (N,) weighted share of members whose state is BULL
+            - regime: (N,) 0 (BULL) when the vote is a strict majority, else 1
+        """
+        returns = np.asarray(returns, dtype=float)
+        with timer("ensemble.features"):
+            banks = self.feature_banks(returns, use_cache=use_cache)
+        with timer("ensemble.emissions"):
+            framelogprob, valid = self.emission_log_likelihood(returns, banks)
+        with timer("ensemble.forward"):
+            filtered, states = self.forward(framelogprob, valid)
+
+        members = np.arange(self.n_models)
+        p_bull = filtered[:, members, self.bull_state]
+        has_data = states >= 0
+        weight = np.where(has_data, self.weights, 0.0)
+        total = weight.sum(axis=1)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ensemble_p_bull = np.where(has_data, p_bull, 0.0) @ self.weights / total
+            vote = ((states == self.bull_state) * weight).sum(axis=1) / total
+
+        return {
+            'filtered': filtered,
+            'states': states,
+            'p_bull': p_bull,
+            'ensemble_p_bull': ensemble_p_bull,
+            'vote': vote,
+            'regime': np.where(vote > 0.5, 0, 1)
+        }
+
+    def to_frame(self, prediction: dict, index: pd.Index, names: list = None) -> pd.DataFrame:
+        """Per-member P(BULL) and state columns plus the aggregate, indexed by date."""
+        names = names or [f"m{i}" for i in range(self.n_models)]
+        columns = {}
+        for i, name in enumerate(names):
+            columns[f"p_bull_{name}"] = prediction['p_bull'][:, i]
+            columns[f"state_{name}"] = prediction['states'][:, i]
+        columns.update({'ensemble_p_bull': prediction['ensemble_p_bull'],
+                        'vote': prediction['vote'], 'regime': prediction['regime']})
+        return pd.DataFrame(columns, index=index)
+
+
+def member_name(params: dict) -> str:
+    """File-name friendly id of an ensemble member, e.g. 's2_w5_sc10_seed42'."""
+    return (f"s{params['n_states']}_w{params['window']}_sc{params['scale']:g}"
+            f"_seed{params['random_state']}")
+
+
+def train_members(grid: dict = ENSEMBLE_GRID, data_path: str = DATA_FILE,
+                  ensemble_dir: str = ENSEMBLE_DIR, train_end: str = TRAIN_END_DATE) -> list:
+    """
+    Train one model per grid combination and save it under ensemble_dir.
+
+    Returns:
+        Saved model paths, in grid order
+    """
+    keys = list(grid)
+    train_df = load_price_data(data_path, columns=['return'], end=train_end)
+    paths = []
+
+    for values in itertools.product(*grid.values()):
+        params = dict(zip(keys, values))
+        params.setdefault('n_states', N_STATES)
+        start_time = time.time()
+
+        obs, _ = train_stage.prepare_observations(train_df, window=params['window'],
+                                                  scales=[params['scale']])
+        obs_mean, obs_std = obs.mean(axis=0), obs.std(axis=0)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            model = train_stage.train_hmm((obs - obs_mean) / obs_std, n_states=params['n_states'],
+                                          n_iter=N_ITER, random_state=params['random_state'],
+                                          verbose=False, n_init=1)
+            state_labels = train_stage.analyze_states(model, params['n_states'])
+
+        path = os.path.join(ensemble_dir, f"{member_name(params)}.npz")
+        save_model({
+            'model': model,
+            'obs_mean': obs_mean,
+            'obs_std': obs_std,
+            'state_labels': state_labels,
+            'config': {
+                'n_states': params['n_states'],
+                'window': params['window'],
+                'scale': params['scale'],
+                'scales': [params['scale']],
+                'train_end': train_end,
+                'random_state': params['random_state']
+            }
+        }, path)
+        paths.append(path)
+        print(f"  {member_name(params)}: {time.time() - start_time:.1f}s")
+
+    return paths
+
+
+def run_ensemble(model_paths: list, data_path: str = DATA_FILE,
+                 test_start: str = TEST_START_DATE,
+                 output_path: str = ENSEMBLE_RESULTS_FILE) -> pd.DataFrame:
+    """Evaluate the ensemble on the price data and save the test-period regimes."""
+    ensemble = HMMEnsemble.from_files(model_paths)
+    df = load_price_data(data_path, columns=['return'])
+
+    start_time = time.time()
+    prediction = ensemble.predict(df['return'].values)
+    elapsed = time.time() - start_time
+
+    names = [os.path.splitext(os.path.basename(path))[0] for path in model_paths]
+    regimes = ensemble.to_frame(prediction, df.index, names)
+    regimes = regimes[regimes.index >= test_start]
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    regimes.to_csv(output_path)
+
+    member_regimes = np.where(prediction['states'] == ensemble.bull_state, 0, 1)
+    test_rows = df.index >= test_start
+    flips = np.abs(np.diff(member_regimes[test_rows], axis=0)).sum(axis=0)
+    print(f"\n{ensemble.n_models} models over {len(df)} days in {elapsed:.2f}s")
+    print(f"Regime flips in the test period: members {flips.min()}-{flips.max()} "
+          f"(median {np.median(flips):.0f}), ensemble vote "
+          f"{np.abs(np.diff(regimes['regime'].values)).sum()}")
+    print(f"Ensemble regimes saved to: {output_path}")
+    return regimes
+
+
+def self_test():
+    """Stacked pass vs one model at a time, on synthetic regimes."""
+    from hmm_inference import filter_smooth, predict_prefix_states
+
+    rng = np.random.default_rng(42)
+    regimes = (np.arange(3000) // 150) % 2
+    returns = np.where(regimes == 0, 0.0008, -0.001) + rng.normal(0, 0.01, 3000) * (1 + regimes)
+    returns[0] = np.nan
+    train_df = pd.DataFrame({'return': returns[:2000]})
+
+    members = []
+    for n_states, window, scale, seed in [(2, 5, 5, 42), (2, 10, 10, 43), (3, 5, 10, 44),
+                                          (2, 20, 5, 45), (3, 10, 5, 46), (2, 5, 5, 47)]:
+        obs, _ = train_stage.prepare_observations(train_df, window=window, scales=[scale],
+                                                  use_cache=False)
+        obs_mean, obs_std = obs.mean(axis=0), obs.std(axis=0)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            model = train_stage.train_hmm((obs - obs_mean) / obs_std, n_states=n_states,
+                                          random_state=seed, verbose=False, n_init=1)
+        members.append({'model': GaussianHMMParams.from_model(model), 'obs_mean': obs_mean,
+                        'obs_std': obs_std, 'state_labels': {},
+                        'config': {'n_states': n_states, 'window': window, 'scale': scale,
+                                   'scales': [scale]}})
+
+    ensemble = HMMEnsemble(members)
+    start = time.perf_counter()
+    prediction = ensemble.predict(returns, use_cache=False)
+    stacked_sec = time.perf_counter() - start
+
+    # Reference: each member decoded on its own, as HMMStrategy does
+    start = time.perf_counter()
+    reference = []
+    for member in members:
+        config, model = member['config'], member['model']
+        obs, _ = train_stage.prepare_observations(pd.DataFrame({'return': returns}),
+                                                  window=config['window'],
+                                                  scales=config['scales'], use_cache=False)
+        obs_norm = (obs - member['obs_mean']) / member['obs_std']
+        filtered, _, _ = filter_smooth(model.startprob_, model.transmat_,
+                                       model._compute_log_likelihood(obs_norm))
+        reference.append((predict_prefix_states(model, obs_norm), filtered))
+    loop_sec = time.perf_counter() - start
+
+    print("Test ensemble inference:")
+    for i, (states, filtered) in enumerate(reference):
+        k = members[i]['model'].n_components
+        rows = prediction['states'][:, i] >= 0
+        assert np.array_equal(prediction['states'][rows, i], states)
+        assert np.allclose(prediction['filtered'][rows, i, :k], filtered)
+        assert np.all(prediction['filtered'][rows, i, k:] == 0)
+    print(f"  OK: {len(members)} members (2 and 3 states, windows 5-20) match "
+          f"per-model prefix Viterbi and filter")
+
+    vote = prediction['vote'][~np.isnan(prediction['vote'])]
+    assert np.all((vote >= 0) & (vote <= 1))
+    assert np.allclose(np.nanmean(prediction['p_bull'][2000:], axis=1),
+                       prediction['ensemble_p_bull'][2000:])
+    print(f"  OK: aggregate probabilities and vote")
+    print(f"  {len(returns)} days: stacked {stacked_sec:.3f}s, one model at a time {loop_sec:.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ensemble-of-HMMs regime inference")
+    parser.add_argument("--train", action="store_true",
+                        help="Train the ENSEMBLE_GRID members first")
+    parser.add_argument("--models", nargs="+", default=None,
+                        help="Member model files (default: every .npz in ENSEMBLE_DIR)")
+    parser.add_argument("--data", default=DATA_FILE, help="Price data (CSV or store)")
+    parser.add_argument("--output", default=ENSEMBLE_RESULTS_FILE, help="Regimes CSV")
+    parser.add_argument("--self-test", action="store_true",
+                        help="Check the stacked pass against per-model decoding and exit")
+    args = parser.parse_args()
+
+    if args.self_test:
+        self_test()
+        return
+
+    # Ensure we're in the right directory
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    model_paths = args.models
+    if args.train:
+        print(f"Training ensemble members into {ENSEMBLE_DIR}/ ...")
+        model_paths = train_members(data_path=args.data)
+    elif model_paths is None:
+        if os.path.isdir(ENSEMBLE_DIR):
+            model_paths = sorted(os.path.join(ENSEMBLE_DIR, name)
+                                 for name in os.listdir(ENSEMBLE_DIR) if name.endswith('.npz'))
+        if not model_paths:
+            parser.error(f"No members in {ENSEMBLE_DIR}/: run with --train or pass --models")
+
+    run_ensemble(model_paths, args.data, output_path=args.output)
+
+
+if __name__ == "__main__":
+    main()
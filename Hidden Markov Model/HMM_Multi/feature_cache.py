@@ -0,0 +1,249 @@
+"""
+Content-Addressed Feature Cache
+- Key: hash of the return series + (window, scales, wavelets)
+- Energies stored as .npy files and returned memory-mapped (read-only)
+- Appended rows reuse the longest cached prefix; only the tail is computed
+- LRU eviction on a total size budget
+"""
+
+import glob
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from wavelet_features import DEFAULT_WAVELET, BLOCK_ROWS, extract_wavelet_feature_bank
+from instrumentation import count, timer
+from config import (
+    FEATURE_CACHE_DIR,
+    FEATURE_CACHE_MAX_BYTES,
+    USE_FEATURE_CACHE
+)
+
+
+def hash_array(values: np.ndarray) -> str:
+    """Content hash of a float64 array."""
+    data = np.ascontiguousarray(values, dtype=np.float64)
+    return hashlib.sha1(data.tobytes()).hexdigest()
+
+
+def feature_params_key(window: int, scales: list, wavelets: list = None) -> str:
+    """Hash of the feature parameters (independent of the data)."""
+    wavelets = [DEFAULT_WAVELET] if wavelets is None else wavelets
+    params = {
+        'window': int(window),
+        'scales': [float(s) for s in scales],
+        'wavelets': list(wavelets)
+    }
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class FeatureCache:
+    """
+    On-disk cache of wavelet feature banks.
+
+    Each entry is a pair of files named <params_key>_<data_hash>:
+    - .npy:  (N, n_features) float64 energies
+    - .json: metadata (row count, data hash); its mtime is the LRU clock
+
+    Entries are written atomically and never modified, so concurrent
+    processes can share a cache directory safely.
+    """
+
+    def __init__(self, cache_dir: str = FEATURE_CACHE_DIR,
+                 max_bytes: int = FEATURE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'prefix_hits': 0, 'misses': 0}
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, params_key: str, data_hash: str, ext: str) -> str:
+        return os.path.join(self.cache_dir, f"{params_key}_{data_hash[:16]}{ext}")
+
+    def _load(self, params_key: str, data_hash: str) -> np.ndarray:
+        """Memory-map a cached entry and mark it as recently used."""
+        array = np.load(self._path(params_key, data_hash, '.npy'), mmap_mode='r')
+        os.utime(self._path(params_key, data_hash, '.json'))
+        return array
+
+    def _entries(self, params_key: str = '*') -> list:
+        """Metadata of all entries (optionally for one parameter set)."""
+        entries = []
+        for meta_path in glob.glob(os.path.join(self.cache_dir, f"{params_key}_*.json")):
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                meta['meta_path'] = meta_path
+                meta['last_access'] = os.path.getmtime(meta_path)
+                entries.append(meta)
+            except (OSError, ValueError):
+                continue  # Concurrently evicted or partially written
+        return entries
+
+    def _store(self, params_key: str, data_hash: str, energies: np.ndarray):
+        """Atomically write an entry, then enforce the size budget."""
+        npy_path = self._path(params_key, data_hash, '.npy')
+        meta_path = self._path(params_key, data_hash, '.json')
+
+        tmp_path = f"{npy_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, energies)
+        os.replace(tmp_path, npy_path)
+
+        meta = {
+            'params_key': params_key,
+            'data_hash': data_hash,
+            'n_rows': int(energies.shape[0]),
+            'nbytes': int(energies.nbytes),
+            'created': time.time()
+        }
+        tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+        self.evict(keep=meta_path)
+
+    def evict(self, keep: str = None):
+        """Remove least recently used entries until the cache fits the budget."""
+        entries = sorted(self._entries(), key=lambda e: e['last_access'])
+        total = sum(e['nbytes'] for e in entries)
+
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry['meta_path'] == keep:
+                continue
+            for path in (entry['meta_path'][:-5] + '.npy', entry['meta_path']):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= entry['nbytes']
+
+    def get_or_compute(self, returns: np.ndarray, window: int, scales: list,
+                       wavelets: list = None) -> np.ndarray:
+        """
+        Return the wavelet feature bank for `returns`, computing only what is missing.
+
+        Args:
+            returns: Full array of returns
+            window: Lookback window size
+            scales: Wavelet scales
+            wavelets: Wavelet names (default: complex morlet only)
+
+        Returns:
+            (N, n_features) read-only memory-mapped array of energies
+        """
+        returns = np.ascontiguousarray(returns, dtype=np.float64)
+        n = len(returns)
+        params_key = feature_params_key(window, scales, wavelets)
+        data_hash = hash_array(returns)
+
+        # Exact hit
+        if os.path.exists(self._path(params_key, data_hash, '.json')):
+            try:
+                array = self._load(params_key, data_hash)
+                self.stats['hits'] += 1
+                count("feature_cache.hits")
+                return array
+            except OSError:
+                pass  # Evicted between check and load
+
+        # Longest cached prefix of this series (rows appended since last run)
+        prefix = None
+        candidates = [e for e in self._entries(params_key) if 0 < e['n_rows'] < n]
+        for entry in sorted(candidates, key=lambda e: -e['n_rows']):
+            if hash_array(returns[:entry['n_rows']]) == entry['data_hash']:
+                try:
+                    prefix = self._load(params_key, entry['data_hash'])
+                    break
+                except OSError:
+                    continue
+
+        if prefix is not None:
+            # Energies at t only depend on [t - window + 1, t]; restart at a
+            # block boundary so the result equals a full extraction exactly
+            n_cached = len(prefix)
+            tail_start = max(0, n_cached - window + 1) // BLOCK_ROWS * BLOCK_ROWS
+            with timer("wavelet_extraction"):
+                tail = extract_wavelet_feature_bank(returns[tail_start:], window, scales, wavelets)
+            if tail_start == 0:
+                energies = tail
+            else:
+                keep = tail_start + window - 1
+                energies = np.concatenate([prefix[:keep], tail[window - 1:]])
+            self.stats['prefix_hits'] += 1
+            count("feature_cache.prefix_hits")
+            count("wavelet_rows", n - tail_start)
+        else:
+            with timer("wavelet_extraction"):
+                energies = extract_wavelet_feature_bank(returns, window, scales, wavelets)
+            self.stats['misses'] += 1
+            count("feature_cache.misses")
+            count("wavelet_rows", n)
+
+        self._store(params_key, data_hash, energies)
+
+        return self._load(params_key, data_hash)
+
+
+_default_cache = None
+
+
+def get_feature_cache() -> FeatureCache:
+    """Process-wide cache using the config.py directory and budget."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = FeatureCache()
+    return _default_cache
+
+
+def load_feature_bank(returns: np.ndarray, window: int, scales: list,
+                      wavelets: list = None, use_cache: bool = USE_FEATURE_CACHE) -> np.ndarray:
+    """
+    Wavelet feature bank, served from the on-disk cache when enabled.
+
+    Returns:
+        (N, n_features) array of energies
+    """
+    if not use_cache:
+        count("wavelet_rows", len(returns))
+        with timer("wavelet_extraction"):
+            return extract_wavelet_feature_bank(returns, window, scales, wavelets)
+    return get_feature_cache().get_or_compute(returns, window, scales, wavelets)
+
+
+if __name__ == "__main__":
+    # Quick test: miss, exact hit, prefix reuse and eviction
+    import tempfile
+
+    np.random.seed(42)
+    n_prefix = 2 * BLOCK_ROWS + 500  # Prefix spans more than one block: tail is spliced on
+    fake_returns = np.random.randn(n_prefix + 300) * 0.02
+    scales = [2.0, 5.0]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = FeatureCache(cache_dir=tmp_dir, max_bytes=10**7)
+
+        first = cache.get_or_compute(fake_returns[:n_prefix], window=20, scales=scales)
+        again = cache.get_or_compute(fake_returns[:n_prefix], window=20, scales=scales)
+        grown = cache.get_or_compute(fake_returns, window=20, scales=scales)
+        expected = extract_wavelet_feature_bank(fake_returns, window=20, scales=scales)
+
+        print("Test feature cache:")
+        print(f"  Stats: {cache.stats}")
+        assert cache.stats == {'hits': 1, 'prefix_hits': 1, 'misses': 1}
+        assert np.array_equal(grown, expected, equal_nan=True), "Prefix reuse mismatch"
+        assert np.array_equal(first, again, equal_nan=True)
+        recomputed = len(fake_returns) - (n_prefix - 20 + 1) // BLOCK_ROWS * BLOCK_ROWS
+        print(f"  OK: prefix reuse matches full extraction ({recomputed} of "
+              f"{len(fake_returns)} rows recomputed)")
+
+        cache.max_bytes = grown.nbytes
+        cache.evict()
+        print(f"  Entries after evicting to {cache.max_bytes} bytes: {len(cache._entries())}")
+        assert len(cache._entries()) == 1
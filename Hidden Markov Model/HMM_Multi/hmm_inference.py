@@ -0,0 +1,303 @@
+"""
+HMM Inference Utilities
+- Prefix Viterbi decoding: last Viterbi state of every prefix in one pass
+- Equivalent to calling model.predict(obs[:t+1])[-1] for every t, in O(N*K^2)
+- Resumable: the lattice column carries the decode across chunks
+- Forward-backward: filtered and smoothed state probabilities and per-day
+  log-likelihood contributions
+- GaussianHMMParams: NumPy-only Gaussian HMM for inference (no hmmlearn import)
+"""
+
+import numpy as np
+
+from instrumentation import count
+
+
+def _log(x: np.ndarray) -> np.ndarray:
+    """Elementwise log that maps zero probabilities to -inf without warnings."""
+    with np.errstate(divide='ignore'):
+        return np.log(x)
+
+
+def prefix_viterbi(startprob: np.ndarray, transmat: np.ndarray,
+                   framelogprob: np.ndarray) -> np.ndarray:
+    """
+    Decode the last Viterbi state of every prefix of an observation sequence.
+
+    The Viterbi lattice delta_t(j) only depends on observations 0..t, and a
+    full Viterbi decode of the prefix [0, t] ends in argmax_j delta_t(j).
+    A single forward pass therefore yields the same per-day states as
+    re-running Viterbi on every growing prefix.
+
+    Args:
+        startprob: (K,) initial state distribution
+        transmat: (K, K) transition matrix
+        framelogprob: (N, K) per-frame emission log-likelihoods
+
+    Returns:
+        (N,) array where entry t is the last state of Viterbi(obs[:t+1])
+    """
+    n_samples, n_states = framelogprob.shape
+    states = np.empty(n_samples, dtype=int)
+    count("prefix_viterbi_calls")
+    count("days_decoded", n_samples)
+
+    if n_samples == 0:
+        return states
+
+    # Same recursion order as hmmlearn's viterbi lattice
+    delta = _log(startprob) + framelogprob[0]
+    states[0] = np.argmax(delta)
+    states[1:], _ = _prefix_viterbi_from(delta, _log(transmat), framelogprob[1:])
+
+    return states
+
+
+def _prefix_viterbi_from(delta: np.ndarray, log_transmat: np.ndarray,
+                         framelogprob: np.ndarray) -> tuple:
+    """Prefix Viterbi recursion from a lattice column; returns (states, last column)."""
+    states = np.empty(len(framelogprob), dtype=int)
+
+    for t in range(len(framelogprob)):
+        delta = (delta[:, None] + log_transmat).max(axis=0) + framelogprob[t]
+        states[t] = np.argmax(delta)
+
+    return states, delta
+
+
+def resume_prefix_viterbi(startprob: np.ndarray, transmat: np.ndarray,
+                          framelogprob: np.ndarray, delta: np.ndarray = None) -> tuple:
+    """
+    prefix_viterbi over a sequence split into chunks, one chunk per call.
+
+    Passing each call's returned lattice column to the next call gives
+    exactly the states of prefix_viterbi on the whole sequence.
+
+    Args:
+        startprob: (K,) initial state distribution
+        transmat: (K, K) transition matrix
+        framelogprob: (N, K) emission log-likelihoods of this chunk
+        delta: (K,) lattice column after the previous chunk (None for the first)
+
+    Returns:
+        states: (N,) prefix Viterbi states of this chunk
+        delta: (K,) lattice column after this chunk (None if nothing decoded yet)
+    """
+    count("prefix_viterbi_calls")
+    count("days_decoded", len(framelogprob))
+
+    if delta is None:
+        if len(framelogprob) == 0:
+            return np.empty(0, dtype=int), None
+        first = _log(startprob) + framelogprob[0]
+        states, delta = _prefix_viterbi_from(first, _log(transmat), framelogprob[1:])
+        return np.concatenate([[np.argmax(first)], states]), delta
+
+    return _prefix_viterbi_from(delta, _log(transmat), framelogprob)
+
+
+def viterbi(startprob: np.ndarray, transmat: np.ndarray,
+            framelogprob: np.ndarray) -> np.ndarray:
+    """
+    Most likely state sequence (full Viterbi decode with backtracking).
+
+    Returns:
+        (N,) array of states
+    """
+    n_samples, n_states = framelogprob.shape
+    log_transmat = _log(transmat)
+    states = np.empty(n_samples, dtype=int)
+    count("viterbi_calls")
+    count("days_decoded", n_samples)
+
+    if n_samples == 0:
+        return states
+
+    backpointers = np.empty((n_samples, n_states), dtype=int)
+    delta = _log(startprob) + framelogprob[0]
+
+    for t in range(1, n_samples):
+        scores = delta[:, None] + log_transmat
+        backpointers[t] = scores.argmax(axis=0)
+        delta = scores.max(axis=0) + framelogprob[t]
+
+    states[-1] = np.argmax(delta)
+    for t in range(n_samples - 1, 0, -1):
+        states[t - 1] = backpointers[t, states[t]]
+
+    return states
+
+
+def filter_smooth(startprob: np.ndarray, transmat: np.ndarray,
+                  framelogprob: np.ndarray) -> tuple:
+    """
+    Scaled forward-backward pass.
+
+    Args:
+        startprob: (K,) initial state distribution
+        transmat: (K, K) transition matrix
+        framelogprob: (N, K) per-frame emission log-likelihoods
+
+    Returns:
+        filtered: (N, K) P(S_t | O_0..t), causal
+        smoothed: (N, K) P(S_t | O_0..N-1), uses the whole sequence
+        loglik: (N,) log P(O_t | O_0..t-1); sums to the sequence log-likelihood
+    """
+    n_samples, n_states = framelogprob.shape
+    count("forward_backward_calls")
+
+    frame_max = framelogprob.max(axis=1, keepdims=True) if n_samples else np.zeros((0, 1))
+    frameprob = np.exp(framelogprob - frame_max)
+
+    filtered = np.empty((n_samples, n_states))
+    scale = np.empty(n_samples)
+    prior = startprob
+    for t in range(n_samples):
+        a = prior * frameprob[t]
+        scale[t] = a.sum()
+        filtered[t] = a / scale[t]
+        prior = filtered[t] @ transmat
+
+    bwd = np.ones((n_samples, n_states))
+    for t in range(n_samples - 2, -1, -1):
+        bwd[t] = ((frameprob[t + 1] * bwd[t + 1]) @ transmat.T) / scale[t + 1]
+
+    smoothed = filtered * bwd
+    smoothed /= smoothed.sum(axis=1, keepdims=True)
+
+    return filtered, smoothed, np.log(scale) + frame_max[:, 0]
+
+
+def gaussian_log_likelihood(X: np.ndarray, means: np.ndarray, covars: np.ndarray,
+                            min_covar: float = 1e-7) -> np.ndarray:
+    """
+    Per-state log density of full-covariance Gaussians.
+
+    Same computation as hmmlearn's full-covariance emission model
+    (Cholesky factor, retried with min_covar on the diagonal if needed).
+
+    Args:
+        X: (N, n_features) observations
+        means: (K, n_features) state means
+        covars: (K, n_features, n_features) state covariances
+
+    Returns:
+        (N, K) log-likelihood of each observation under each state
+    """
+    X = np.asarray(X, dtype=float)
+    n_features = means.shape[1]
+    log_prob = np.empty((len(X), len(means)))
+
+    for k, (mu, cv) in enumerate(zip(means, covars)):
+        try:
+            cv_chol = np.linalg.cholesky(cv)
+        except np.linalg.LinAlgError:
+            cv_chol = np.linalg.cholesky(cv + min_covar * np.eye(n_features))
+
+        cv_log_det = 2 * np.sum(np.log(np.diagonal(cv_chol)))
+        cv_sol = np.linalg.solve(cv_chol, (X - mu).T)
+        log_prob[:, k] = -.5 * (n_features * np.log(2 * np.pi)
+                                + (cv_sol ** 2).sum(axis=0)
+                                + cv_log_det)
+
+    return log_prob
+
+
+class GaussianHMMParams:
+    """
+    Fitted full-covariance Gaussian HMM reduced to its parameter arrays.
+
+    Exposes the attributes and methods of hmmlearn's GaussianHMM that the
+    backtest and plots use (startprob_, transmat_, means_, covars_,
+    predict), so it can stand in for the fitted model at inference time.
+    """
+
+    def __init__(self, startprob: np.ndarray, transmat: np.ndarray,
+                 means: np.ndarray, covars: np.ndarray):
+        self.startprob_ = np.asarray(startprob, dtype=float)
+        self.transmat_ = np.asarray(transmat, dtype=float)
+        self.means_ = np.asarray(means, dtype=float)
+        self.covars_ = np.asarray(covars, dtype=float)
+        self.n_components = len(self.startprob_)
+
+    @classmethod
+    def from_model(cls, model) -> 'GaussianHMMParams':
+        """Copy the parameters of a fitted hmmlearn GaussianHMM."""
+        return cls(model.startprob_, model.transmat_, model.means_, model.covars_)
+
+    def _compute_log_likelihood(self, X: np.ndarray) -> np.ndarray:
+        return gaussian_log_likelihood(X, self.means_, self.covars_)
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Most likely state sequence for X (full Viterbi decode)."""
+        return viterbi(self.startprob_, self.transmat_, self._compute_log_likelihood(X))
+
+
+def predict_prefix_states(model, observations: np.ndarray) -> np.ndarray:
+    """
+    Causal (no lookahead) state decoding for a fitted model.
+
+    Args:
+        model: Fitted hmmlearn HMM (e.g. GaussianHMM) or GaussianHMMParams
+        observations: (N, n_features) array, already normalized
+
+    Returns:
+        (N,) array of states; entry t equals model.predict(observations[:t+1])[-1]
+    """
+    framelogprob = model._compute_log_likelihood(observations)
+    return prefix_viterbi(model.startprob_, model.transmat_, framelogprob)
+
+
+if __name__ == "__main__":
+    # Equivalence test: prefix decoding vs per-day model.predict loop
+    from hmmlearn.hmm import GaussianHMM
+
+    np.random.seed(42)
+    fake_obs = np.concatenate([
+        np.random.randn(150, 2) * 0.5,
+        np.random.randn(100, 2) * 1.5 + 1.0,
+        np.random.randn(150, 2) * 0.5,
+    ])
+
+    model = GaussianHMM(n_components=2, covariance_type="full",
+                        n_iter=50, random_state=42)
+    model.fit(fake_obs)
+
+    fast_states = predict_prefix_states(model, fake_obs)
+    loop_states = np.array([model.predict(fake_obs[:t + 1])[-1]
+                            for t in range(len(fake_obs))])
+
+    n_match = np.sum(fast_states == loop_states)
+    print("Test prefix Viterbi decoding:")
+    print(f"  Observations: {len(fake_obs)}")
+    print(f"  Matching states: {n_match}/{len(fake_obs)}")
+    assert np.array_equal(fast_states, loop_states), "Prefix Viterbi mismatch"
+    print("  OK: prefix decode matches per-day predict loop")
+
+    # NumPy-only parameters decode exactly like the hmmlearn model
+    params = GaussianHMMParams.from_model(model)
+    assert np.allclose(params._compute_log_likelihood(fake_obs),
+                       model._compute_log_likelihood(fake_obs))
+    assert np.array_equal(params.predict(fake_obs), model.predict(fake_obs))
+    assert np.array_equal(predict_prefix_states(params, fake_obs), fast_states)
+    print("  OK: GaussianHMMParams matches hmmlearn (likelihoods, predict, prefix decode)")
+
+    # Chunked decode carries the lattice column across chunk boundaries
+    chunked, delta = [], None
+    for lo in range(0, len(fake_obs), 64):
+        states, delta = resume_prefix_viterbi(model.startprob_, model.transmat_,
+                                              model._compute_log_likelihood(fake_obs[lo:lo + 64]),
+                                              delta)
+        chunked.append(states)
+    assert np.array_equal(np.concatenate(chunked), fast_states)
+    print("  OK: chunked prefix decode matches a single pass")
+
+    # Forward-backward matches hmmlearn's posteriors and score
+    framelogprob = model._compute_log_likelihood(fake_obs)
+    filtered, smoothed, loglik = filter_smooth(model.startprob_, model.transmat_, framelogprob)
+    assert np.allclose(smoothed, model.predict_proba(fake_obs))
+    assert np.isclose(loglik.sum(), model.score(fake_obs))
+    assert np.allclose(filtered[-1], smoothed[-1])
+    assert np.allclose(filtered[99], filter_smooth(model.startprob_, model.transmat_,
+                                                   framelogprob[:100])[1][-1])
+    print("  OK: filtered/smoothed probabilities and log-likelihood match hmmlearn")
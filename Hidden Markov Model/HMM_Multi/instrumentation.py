@@ -0,0 +1,238 @@
+"""
+Pipeline Instrumentation
+- Timers (context managers), counters and per-stage tracemalloc peaks
+- Off by default with near-zero overhead: timer() returns a shared no-op
+  context and count() returns immediately
+- Switched on with the HMM_PROFILE=1 environment variable or --profile
+- Structured JSON run report plus a human-readable summary
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import time
+import tracemalloc
+
+from config import PROFILE_ENV_VAR, RUN_REPORT_FILE
+
+_enabled = False
+_track_memory = False
+_timers = {}      # name -> {'calls', 'total_sec', 'max_sec'}
+_counters = {}    # name -> int
+_stages = []      # [{'name', 'sec', 'peak_mb', 'peak_delta_mb'}] in completion order
+_stage_stack = []  # Peaks of the enclosing stages (nested stages)
+_started = None
+_report_registered = False
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+def enable(memory: bool = True, report_at_exit: bool = False):
+    """
+    Start collecting.
+
+    Args:
+        memory: Also record tracemalloc peaks per stage (slows allocation-heavy code)
+        report_at_exit: Print the summary and write the JSON report when the process exits
+    """
+    global _enabled, _track_memory, _started, _report_registered
+    _enabled = True
+    _track_memory = memory
+    if _started is None:
+        _started = time.time()
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if report_at_exit and not _report_registered:
+        atexit.register(_report_at_exit)
+        _report_registered = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    if _track_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """Drop everything collected so far."""
+    _timers.clear()
+    _counters.clear()
+    _stages.clear()
+    _stage_stack.clear()
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        entry = _timers.get(self.name)
+        if entry is None:
+            entry = _timers[self.name] = {'calls': 0, 'total_sec': 0.0, 'max_sec': 0.0}
+        entry['calls'] += 1
+        entry['total_sec'] += elapsed
+        entry['max_sec'] = max(entry['max_sec'], elapsed)
+        return False
+
+
+def timer(name: str):
+    """
+    Time a block, accumulated under `name`.
+
+    Usage:
+        with timer("wavelet_extraction"):
+            ...
+    """
+    return _Timer(name) if _enabled else _NULL_CONTEXT
+
+
+def count(name: str, n: int = 1):
+    """Add n to a counter (e.g. EM iterations, days decoded)."""
+    if not _enabled:
+        return
+    _counters[name] = _counters.get(name, 0) + n
+
+
+class _Stage:
+    __slots__ = ('name', 'start', 'base')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        if _track_memory:
+            # Resetting the peak hides it from the enclosing stage: carry it over
+            if _stage_stack:
+                _stage_stack[-1] = max(_stage_stack[-1], tracemalloc.get_traced_memory()[1])
+            _stage_stack.append(0)
+            tracemalloc.reset_peak()
+            self.base = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        peak_mb = peak_delta_mb = None
+        if _track_memory and tracemalloc.is_tracing():
+            peak = max(_stage_stack.pop(), tracemalloc.get_traced_memory()[1])
+            if _stage_stack:
+                _stage_stack[-1] = max(_stage_stack[-1], peak)
+            peak_mb = peak / 1024**2
+            peak_delta_mb = (peak - self.base) / 1024**2
+        _stages.append({'name': self.name, 'sec': elapsed,
+                        'peak_mb': peak_mb, 'peak_delta_mb': peak_delta_mb})
+        return False
+
+
+def stage(name: str):
+    """
+    Time a pipeline stage and record its peak traced memory.
+
+    peak_mb is the process-wide traced peak during the stage; peak_delta_mb
+    is how far it rose above what was already allocated when the stage began.
+    """
+    return _Stage(name) if _enabled else _NULL_CONTEXT
+
+
+def report() -> dict:
+    """Everything collected so far as a JSON-serializable dict."""
+    return {
+        'started': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(_started)) if _started else None,
+        'wall_sec': time.time() - _started if _started else None,
+        'stages': list(_stages),
+        'timers': {name: dict(entry) for name, entry in sorted(_timers.items())},
+        'counters': dict(sorted(_counters.items()))
+    }
+
+
+def save_report(path: str = RUN_REPORT_FILE) -> str:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=2)
+    return path
+
+
+def print_summary():
+    """Human-readable run report (companion to config.print_config)."""
+    data = report()
+
+    print("\n" + "="*60)
+    print("RUN PROFILE")
+    print("="*60)
+
+    if data['stages']:
+        print("\nStages:")
+        for s in data['stages']:
+            peak = (f"  peak {s['peak_mb']:8.1f} MB (+{s['peak_delta_mb']:.1f} MB in stage)"
+                    if s['peak_mb'] is not None else "")
+            print(f"  {s['name']:28s} {s['sec']:9.3f}s{peak}")
+
+    if data['timers']:
+        print("\nTimers (total / calls / max):")
+        for name, t in sorted(data['timers'].items(), key=lambda item: -item[1]['total_sec']):
+            print(f"  {name:28s} {t['total_sec']:9.3f}s  {t['calls']:>7}  {t['max_sec']:.4f}s")
+
+    if data['counters']:
+        print("\nCounters:")
+        for name, value in data['counters'].items():
+            print(f"  {name:28s} {value:>12,}")
+
+    print("="*60)
+
+
+def _report_at_exit():
+    if _enabled and (_stages or _timers or _counters):
+        print_summary()
+        print(f"Run report saved to: {save_report()}")
+
+
+# Environment switch: profile any script without code changes
+if os.environ.get(PROFILE_ENV_VAR, "") not in ("", "0"):
+    enable(report_at_exit=True)
+
+
+if __name__ == "__main__":
+    # Quick test: nested stages, timers, counters, and the cost when disabled
+    import numpy as np
+
+    n_calls = 200_000
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        with timer("noop"):
+            pass
+        count("noop")
+    off_ns = (time.perf_counter() - start) / n_calls * 1e9
+    print(f"Disabled overhead: {off_ns:.0f} ns per timer + count")
+    assert not _timers and not _counters
+
+    enable()
+    with stage("outer"):
+        big = np.ones(4_000_000)  # ~30 MB
+        del big
+        with stage("inner"):
+            with timer("small_alloc"):
+                small = np.ones(1_000_000)  # ~8 MB
+            count("rows", len(small))
+            del small
+    data = report()
+    inner, outer = data['stages']
+    print(f"Stages: outer +{outer['peak_delta_mb']:.1f} MB, inner +{inner['peak_delta_mb']:.1f} MB")
+    assert 7 < inner['peak_delta_mb'] < 12
+    assert outer['peak_delta_mb'] > 28, "Inner stage hid the outer peak"
+    assert data['counters'] == {'rows': 1_000_000}
+    assert data['timers']['small_alloc']['calls'] == 1
+    json.dumps(data)
+    print("  OK")
@@ -0,0 +1,229 @@
+"""
+Metrics Engine - Backtest metrics for many equity curves at once
+- One row per strategy: (n_strategies, T) equity, price, action, regime and
+  invested matrices in, one (n_strategies,) array per metric out
+- Every metric of calculate_metrics in 4_backtest.py, computed with the same
+  floating-point operations in the same order, so each row matches the
+  per-curve function exactly
+- Helpers to stack backtest results DataFrames into matrices (grouped by
+  length) and to turn the arrays back into calculate_metrics dicts
+"""
+
+import numpy as np
+import pandas as pd
+
+from backtest_engine import ACTION_NAMES
+
+
+def _row_mean_std(x: np.ndarray) -> tuple:
+    """Row-wise mean and sample std, computed as pandas Series.mean/.std do."""
+    n = x.shape[1]
+    mean = x.sum(axis=1) / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = ((mean[:, None] - x) ** 2).sum(axis=1) / (n - 1)
+    if n < 2:
+        var = np.full(len(x), np.nan)
+    return mean, np.sqrt(var)
+
+
+def _action_counts(action: np.ndarray) -> dict:
+    """BUY/SELL/HOLD counts per row, from action names or backtest_engine codes."""
+    counts = {}
+    for code, name in enumerate(ACTION_NAMES):
+        match = code if action.dtype.kind in 'iu' else name
+        counts[name] = (action == match).sum(axis=1)
+    return counts
+
+
+def regime_distributions(regime: np.ndarray) -> list:
+    """
+    Per-row regime frequencies, as Series.value_counts(normalize=True).to_dict().
+
+    Keys are ordered by count (largest first), ties by first appearance.
+    """
+    values = np.unique(regime)
+    counts = np.stack([(regime == v).sum(axis=1) for v in values], axis=1)
+    first_seen = np.stack([np.argmax(regime == v, axis=1) for v in values], axis=1)
+    n = regime.shape[1]
+
+    distributions = []
+    for row_counts, row_first in zip(counts, first_seen):
+        present = np.flatnonzero(row_counts)
+        order = present[np.lexsort((row_first[present], -row_counts[present]))]
+        distributions.append({values[k].item(): row_counts[k] / n for k in order})
+    return distributions
+
+
+def calculate_metrics_matrix(total_value: np.ndarray, price: np.ndarray, action: np.ndarray,
+                             regime: np.ndarray, invested: np.ndarray,
+                             initial_capital) -> dict:
+    """
+    Performance metrics of many equity curves in one vectorized pass.
+
+    Args:
+        total_value: (n_strategies, T) portfolio value per day
+        price: (n_strategies, T) asset price per day (buy & hold benchmark)
+        action: (n_strategies, T) action names ('BUY', 'SELL', 'HOLD') or
+                backtest_engine action codes
+        regime: (n_strategies, T) regime per day
+        invested: (n_strategies, T) invested flag per day
+        initial_capital: Starting capital, scalar or (n_strategies,)
+
+    Returns:
+        dict of metric name -> (n_strategies,) array, with the keys of
+        calculate_metrics; 'regime_distribution' is a list of dicts
+    """
+    total_value = np.asarray(total_value, dtype=float)
+    price = np.asarray(price, dtype=float)
+    action = np.asarray(action)
+    regime = np.asarray(regime)
+    invested = np.asarray(invested)
+    n_strategies, n_days = total_value.shape
+    initial_capital = np.broadcast_to(np.asarray(initial_capital, dtype=float), (n_strategies,))
+
+    final_value = total_value[:, -1]
+    total_return = (final_value - initial_capital) / initial_capital
+
+    first_price = price[:, 0]
+    buy_hold_return = (price[:, -1] - first_price) / first_price
+
+    # Daily returns of strategy (pct_change without the leading NaN)
+    daily_returns = total_value[:, 1:] / total_value[:, :-1] - 1
+
+    # Sharpe ratio (annualized), 0 when the std is 0 or undefined
+    mean, std = _row_mean_std(daily_returns)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(std > 0, np.sqrt(252) * mean / std, 0)
+
+    # Max drawdown
+    if n_days > 1:
+        cumulative = np.cumprod(1 + daily_returns, axis=1)
+        rolling_max = np.maximum.accumulate(cumulative, axis=1)
+        max_drawdown = ((cumulative - rolling_max) / rolling_max).min(axis=1)
+    else:
+        max_drawdown = np.full(n_strategies, np.nan)
+
+    # Win rate
+    winning_days = (daily_returns > 0).sum(axis=1)
+    win_rate = winning_days / (n_days - 1) if n_days > 1 else np.zeros(n_strategies)
+
+    counts = _action_counts(action)
+    time_invested_pct = invested.sum(axis=1) / n_days * 100
+
+    return {
+        'initial_capital': initial_capital,
+        'final_value': final_value,
+        'total_return': total_return,
+        'total_return_pct': total_return * 100,
+        'buy_hold_return': buy_hold_return,
+        'buy_hold_return_pct': buy_hold_return * 100,
+        'excess_return': total_return - buy_hold_return,
+        'excess_return_pct': (total_return - buy_hold_return) * 100,
+        'sharpe_ratio': sharpe,
+        'max_drawdown': max_drawdown,
+        'max_drawdown_pct': max_drawdown * 100,
+        'win_rate': win_rate,
+        'win_rate_pct': win_rate * 100,
+        'num_buys': counts['BUY'],
+        'num_sells': counts['SELL'],
+        'num_holds': counts['HOLD'],
+        'time_invested_pct': time_invested_pct,
+        'regime_distribution': regime_distributions(regime)
+    }
+
+
+def metrics_rows(matrix_metrics: dict) -> list:
+    """Split calculate_metrics_matrix output into one calculate_metrics dict per row."""
+    return [{name: values[i] for name, values in matrix_metrics.items()}
+            for i in range(len(matrix_metrics['final_value']))]
+
+
+def calculate_metrics_batch(results: list, initial_capital) -> list:
+    """
+    calculate_metrics for many backtest results DataFrames.
+
+    Results of equal length are stacked and evaluated in one pass each.
+    Unlike calculate_metrics, the DataFrames are not modified.
+
+    Args:
+        results: Backtest results DataFrames (total_value, price, action,
+                 regime and invested columns)
+        initial_capital: Starting capital, scalar or one per DataFrame
+
+    Returns:
+        One metrics dict per DataFrame, in input order
+    """
+    capital = np.broadcast_to(np.asarray(initial_capital, dtype=float), (len(results),))
+    groups = {}
+    for i, results_df in enumerate(results):
+        groups.setdefault(len(results_df), []).append(i)
+
+    metrics = [None] * len(results)
+    for members in groups.values():
+        def stack(column):
+            return np.stack([results[i][column].to_numpy() for i in members])
+
+        group_metrics = calculate_metrics_matrix(stack('total_value'), stack('price'),
+                                                 stack('action'), stack('regime'),
+                                                 stack('invested'), capital[members])
+        for i, row in zip(members, metrics_rows(group_metrics)):
+            metrics[i] = row
+    return metrics
+
+
+if __name__ == "__main__":
+    # Quick test: every row matches calculate_metrics exactly, then timing
+    import importlib
+    import time
+
+    backtest_stage = importlib.import_module("4_backtest")
+
+    rng = np.random.default_rng(42)
+    n_strategies, n_days = 500, 252 * 4
+    dates = pd.bdate_range("2015-01-02", periods=n_days)
+    prices = 100 * np.cumprod(1 + rng.normal(0, 0.01, size=(n_strategies, n_days)), axis=1)
+    invested = rng.random((n_strategies, n_days)) < 0.6
+    asset_returns = np.concatenate([np.zeros((n_strategies, 1)),
+                                    prices[:, 1:] / prices[:, :-1] - 1], axis=1)
+    total_value = 1e5 * np.cumprod(1 + np.where(invested, asset_returns, 0), axis=1)
+    total_value[0] = 1e5  # Never invested: zero std, sharpe 0
+    codes = rng.integers(0, 3, size=(n_strategies, n_days))
+    actions = ACTION_NAMES[codes]
+    regimes = rng.integers(0, 2, size=(n_strategies, n_days))
+    regimes[1] = 1
+
+    results = [pd.DataFrame({'price': prices[i], 'total_value': total_value[i],
+                             'invested': invested[i], 'action': actions[i],
+                             'regime': regimes[i]}, index=dates)
+               for i in range(n_strategies)]
+
+    start = time.perf_counter()
+    expected = [backtest_stage.calculate_metrics(df.copy(), 1e5) for df in results]
+    loop_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = calculate_metrics_matrix(total_value, prices, actions, regimes, invested, 1e5)
+    matrix_sec = time.perf_counter() - start
+
+    print("Test metrics engine:")
+    for want, got in zip(expected, metrics_rows(batch)):
+        assert want.keys() == got.keys()
+        for name in want:
+            assert want[name] == got[name], (name, want[name], got[name])
+        assert list(want['regime_distribution']) == list(got['regime_distribution'])
+    print(f"  OK: {n_strategies} curves match calculate_metrics exactly")
+
+    # Action codes give the same counts as action names
+    coded = calculate_metrics_matrix(total_value, prices, codes, regimes, invested, 1e5)
+    assert all((coded[k] == batch[k]).all() for k in ('num_buys', 'num_sells', 'num_holds'))
+    print("  OK: action codes")
+
+    # Mixed lengths through the DataFrame helper
+    mixed = [results[0], results[1].iloc[:300], results[2]]
+    for want_df, got in zip(mixed, calculate_metrics_batch(mixed, 1e5)):
+        want = backtest_stage.calculate_metrics(want_df.copy(), 1e5)
+        assert all(want[name] == got[name] for name in want)
+    print("  OK: calculate_metrics_batch with mixed lengths")
+
+    print(f"  {n_strategies} curves x {n_days} days: calculate_metrics loop {loop_sec:.2f}s, "
+          f"matrix {matrix_sec:.3f}s ({loop_sec / matrix_sec:.0f}x)")
@@ -0,0 +1,146 @@
+"""
+Model Artifact Storage
+- Versioned .npz file: HMM parameter arrays, normalization stats, labels, config
+- Loads in milliseconds without importing hmmlearn
+- Loaded once per process and shared by every consumer
+- Legacy pickled models (hmm_model.pkl) are still readable
+"""
+
+import json
+import os
+import pickle
+
+import numpy as np
+
+from hmm_inference import GaussianHMMParams
+from config import MODEL_FILE
+
+MODEL_FORMAT_VERSION = 1
+ARRAY_KEYS = ('startprob', 'transmat', 'means', 'covars', 'obs_mean', 'obs_std')
+
+# Process-wide cache: absolute path -> (file signature, model dict)
+_loaded_models = {}
+
+
+def _file_signature(path: str) -> tuple:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def save_model(model_data: dict, model_path: str = MODEL_FILE, extra_arrays: dict = None):
+    """
+    Write a model dict as a compact .npz artifact.
+
+    Args:
+        model_data: dict with 'model' (fitted GaussianHMM or GaussianHMMParams),
+                    'obs_mean', 'obs_std', 'state_labels' and 'config'
+        model_path: Output file
+        extra_arrays: Additional named arrays stored alongside (e.g. online
+                      EM statistics); read_model ignores them
+    """
+    model = model_data['model']
+    arrays = {
+        'format_version': np.array(MODEL_FORMAT_VERSION),
+        'startprob': model.startprob_,
+        'transmat': model.transmat_,
+        'means': model.means_,
+        'covars': model.covars_,
+        'obs_mean': np.asarray(model_data['obs_mean'], dtype=float),
+        'obs_std': np.asarray(model_data['obs_std'], dtype=float),
+        'state_labels': np.array(json.dumps(
+            {int(state): label for state, label in model_data['state_labels'].items()})),
+        'config': np.array(json.dumps(model_data['config']))
+    }
+    for key, value in (extra_arrays or {}).items():
+        if key in arrays:
+            raise ValueError(f"Extra array '{key}' clashes with a model array")
+        arrays[key] = np.asarray(value)
+
+    os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
+    tmp_path = f"{model_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, model_path)
+
+    _loaded_models.pop(os.path.abspath(model_path), None)
+
+
+def read_model(model_path: str) -> dict:
+    """
+    Read a model artifact from disk (no caching).
+
+    Returns:
+        dict with 'model' (GaussianHMMParams), 'obs_mean', 'obs_std',
+        'state_labels' and 'config'
+    """
+    if model_path.endswith('.pkl'):
+        # Legacy format: pickled hmmlearn model (imports hmmlearn)
+        with open(model_path, 'rb') as f:
+            model_data = pickle.load(f)
+        model_data['model'] = GaussianHMMParams.from_model(model_data['model'])
+        return model_data
+
+    with np.load(model_path, allow_pickle=False) as npz:
+        version = int(npz['format_version'])
+        if version > MODEL_FORMAT_VERSION:
+            raise ValueError(f"Model format version {version} is newer than supported "
+                             f"({MODEL_FORMAT_VERSION}): {model_path}")
+        arrays = {key: npz[key] for key in ARRAY_KEYS}
+        state_labels = json.loads(str(npz['state_labels']))
+        config = json.loads(str(npz['config']))
+
+    return {
+        'model': GaussianHMMParams(arrays['startprob'], arrays['transmat'],
+                                   arrays['means'], arrays['covars']),
+        'obs_mean': arrays['obs_mean'],
+        'obs_std': arrays['obs_std'],
+        'state_labels': {int(state): label for state, label in state_labels.items()},
+        'config': config
+    }
+
+
+def load_model(model_path: str = MODEL_FILE) -> dict:
+    """
+    Load a model artifact once per process.
+
+    Repeated calls return the same dict until the file changes on disk.
+    Treat the result as read-only.
+    """
+    key = os.path.abspath(model_path)
+    signature = _file_signature(model_path)
+
+    cached = _loaded_models.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    model_data = read_model(model_path)
+    _loaded_models[key] = (signature, model_data)
+    return model_data
+
+
+if __name__ == "__main__":
+    # Convert a legacy pickle (if present) to .npz and verify it decodes identically
+    import time
+
+    legacy_path = os.path.splitext(MODEL_FILE)[0] + ".pkl"
+    if os.path.exists(legacy_path):
+        with open(legacy_path, 'rb') as f:
+            legacy = pickle.load(f)
+        save_model(legacy, MODEL_FILE)
+        print(f"Model converted: {legacy_path} -> {MODEL_FILE}")
+
+    start = time.perf_counter()
+    model_data = load_model(MODEL_FILE)
+    load_ms = (time.perf_counter() - start) * 1000
+    assert load_model(MODEL_FILE) is model_data, "Model not shared within the process"
+    print(f"Model loaded: {MODEL_FILE} ({load_ms:.2f} ms)")
+
+    if os.path.exists(legacy_path):
+        np.random.seed(42)
+        fake_obs = np.random.randn(300, len(legacy['obs_mean']))
+        assert np.allclose(model_data['model']._compute_log_likelihood(fake_obs),
+                           legacy['model']._compute_log_likelihood(fake_obs))
+        assert np.array_equal(model_data['model'].predict(fake_obs),
+                              legacy['model'].predict(fake_obs))
+        assert model_data['config'] == legacy['config']
+        print("  OK: .npz model decodes identically to the pickled model")
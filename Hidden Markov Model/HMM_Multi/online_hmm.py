@@ -0,0 +1,416 @@
+"""
+Online EM for the Gaussian HMM
+- Keeps the sufficient statistics of EM (expected state occupancies,
+  transitions, first and second moments per state) instead of the data
+- update(new_obs) runs forward-backward over the new observations only,
+  starting from the filtered state of the last observation, adds their
+  statistics and re-estimates the parameters with the usual M-step
+- Forgetting factor: every statistic decays by ONLINE_FORGETTING per new
+  observation, so old regimes fade out
+- Persisted as a regular model artifact (usable by the backtest) plus the
+  online statistics; a nightly refresh costs time proportional to the new
+  rows, not to the history
+"""
+
+import argparse
+import contextlib
+import importlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from wavelet_features import extract_wavelet_feature_bank
+from hmm_inference import GaussianHMMParams, gaussian_log_likelihood
+from batch_hmm import mstep
+from model_store import load_model, save_model
+from price_store import load_price_data
+from instrumentation import count, timer
+from config import (
+    DATA_FILE,
+    MODEL_FILE,
+    ONLINE_MODEL_FILE,
+    ONLINE_FORGETTING
+)
+
+# Stage scripts start with a digit, so import them by name
+train_stage = importlib.import_module("3_train_hmm")
+
+# Statistics decayed and accumulated by update() (the start statistic only
+# concerns the first observation ever, so it is kept as is)
+DECAYED_STATS = ('trans', 'post', 'obs', 'obs*obs.T')
+STATS_ARRAYS = {'start': 'online_start', 'trans': 'online_trans', 'post': 'online_post',
+                'obs': 'online_obs', 'obs*obs.T': 'online_obs2'}
+
+
+def weighted_estep(params: dict, X: np.ndarray, weights: np.ndarray,
+                   alpha: np.ndarray = None) -> tuple:
+    """
+    Forward-backward over one sequence, with per-observation weights.
+
+    Args:
+        params: startprob, transmat, means, covars
+        X: (T, n_features) normalized observations
+        weights: (T,) weight of each observation's statistics
+        alpha: (K,) filtered state distribution of the observation before
+               X (None: X starts a sequence and uses startprob)
+
+    Returns:
+        stats: dict with logprob (of X given the past), start, trans, post,
+               obs and obs*obs.T, as in batch_hmm.batch_estep
+        alpha: (K,) filtered state distribution of X's last observation
+    """
+    startprob, transmat = params['startprob'], params['transmat']
+    n_samples, n_states = len(X), len(startprob)
+
+    framelogprob = gaussian_log_likelihood(X, params['means'], params['covars'])
+    frame_max = framelogprob.max(axis=1, keepdims=True)
+    frameprob = np.exp(framelogprob - frame_max)
+
+    # Forward pass (normalized), continuing from the carried filtered state
+    fwd = np.empty((n_samples, n_states))
+    scale = np.empty(n_samples)
+    a = (startprob if alpha is None else alpha @ transmat) * frameprob[0]
+    scale[0] = a.sum()
+    fwd[0] = a / scale[0]
+    for t in range(1, n_samples):
+        a = (fwd[t - 1] @ transmat) * frameprob[t]
+        scale[t] = a.sum()
+        fwd[t] = a / scale[t]
+
+    # Backward pass within the batch
+    bwd = np.ones((n_samples, n_states))
+    for t in range(n_samples - 2, -1, -1):
+        bwd[t] = ((frameprob[t + 1] * bwd[t + 1]) @ transmat.T) / scale[t + 1]
+
+    posteriors = fwd * bwd
+    weighted_post = posteriors * weights[:, None]
+
+    # Expected transitions into each step (the first one from the carried state)
+    into = frameprob * bwd / scale[:, None] * weights[:, None]
+    if alpha is None:
+        trans = np.einsum('tk,tl->kl', fwd[:-1], into[1:]) * transmat
+        start = posteriors[0]
+    else:
+        trans = np.einsum('tk,tl->kl', np.vstack([alpha, fwd[:-1]]), into) * transmat
+        start = np.zeros(n_states)
+
+    stats = {
+        'logprob': np.sum(np.log(scale) + frame_max[:, 0]),
+        'start': start,
+        'trans': trans,
+        'post': weighted_post.sum(axis=0),
+        'obs': weighted_post.T @ X,
+        'obs*obs.T': np.einsum('tk,td,te->kde', weighted_post, X, X)
+    }
+    return stats, fwd[-1]
+
+
+def decay_weights(n: int, forgetting: float) -> np.ndarray:
+    """Weight of each of n consecutive observations at the time of the last one."""
+    return forgetting ** np.arange(n - 1, -1, -1, dtype=float)
+
+
+class OnlineGaussianHMM:
+    """
+    Trained Gaussian HMM plus the EM statistics needed to keep updating it.
+
+    The parameters after an update are the M-step of the decayed statistics
+    of every observation seen so far; each observation's statistics are
+    computed once, with the parameters current when it arrived.
+    """
+
+    def __init__(self, model_data: dict, stats: dict, alpha: np.ndarray,
+                 forgetting: float = ONLINE_FORGETTING):
+        self.model_data = model_data
+        self.stats = stats
+        self.alpha = alpha
+        self.forgetting = forgetting
+
+    @property
+    def model(self) -> GaussianHMMParams:
+        return self.model_data['model']
+
+    @property
+    def online_config(self) -> dict:
+        return self.model_data['config']['online']
+
+    @classmethod
+    def from_training(cls, model_data: dict, train_obs: np.ndarray,
+                      last_date: str = None,
+                      forgetting: float = ONLINE_FORGETTING) -> 'OnlineGaussianHMM':
+        """
+        Start from a trained model and the observations it was trained on.
+
+        Args:
+            model_data: Trained model dict (train_and_save / load_model)
+            train_obs: (N, n_features) raw training observations (as
+                       prepare_observations returns them)
+            last_date: Date of the last training observation (where
+                       refresh_online_model continues)
+            forgetting: Weight decay per observation
+        """
+        X = (train_obs - model_data['obs_mean']) / model_data['obs_std']
+        stats, alpha = weighted_estep(_params(model_data['model']), X,
+                                      decay_weights(len(X), forgetting))
+        stats.pop('logprob')
+
+        model_data = dict(model_data)
+        model_data['config'] = dict(model_data['config'], online={
+            'forgetting': forgetting,
+            'n_obs': len(X),
+            'n_updates': 0,
+            'last_date': None if last_date is None else str(last_date)
+        })
+        return cls(model_data, stats, alpha, forgetting)
+
+    def update(self, new_obs: np.ndarray, last_date: str = None) -> dict:
+        """
+        Add new observations and re-estimate the parameters.
+
+        Args:
+            new_obs: (n, n_features) raw observations following the last
+                     ones seen (NaN-free rows, as prepare_observations keeps)
+            last_date: Date of the last new observation
+
+        Returns:
+            dict with n_obs, log_likelihood (of new_obs given the history,
+            before the update) and update_sec
+        """
+        start_time = time.time()
+        new_obs = np.asarray(new_obs, dtype=float)
+        if len(new_obs) == 0:
+            return {'n_obs': 0, 'log_likelihood': 0.0, 'update_sec': 0.0}
+
+        with timer("online_update"):
+            X = (new_obs - self.model_data['obs_mean']) / self.model_data['obs_std']
+            params = _params(self.model)
+            batch, self.alpha = weighted_estep(params, X, decay_weights(len(X), self.forgetting),
+                                               self.alpha)
+
+            decay = self.forgetting ** len(X)
+            for key in DECAYED_STATS:
+                self.stats[key] = decay * self.stats[key] + batch[key]
+
+            params = mstep(params, self.stats)
+            model = GaussianHMMParams(params['startprob'], params['transmat'],
+                                      params['means'], params['covars'])
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                state_labels = train_stage.analyze_states(model, model.n_components)
+
+        count("online_updates")
+        count("online_obs", len(X))
+
+        online = dict(self.online_config)
+        online['n_obs'] += len(X)
+        online['n_updates'] += 1
+        if last_date is not None:
+            online['last_date'] = str(last_date)
+        self.model_data = dict(self.model_data, model=model, state_labels=state_labels,
+                               config=dict(self.model_data['config'], online=online))
+
+        return {'n_obs': len(X), 'log_likelihood': float(batch['logprob']),
+                'update_sec': time.time() - start_time}
+
+    def save(self, path: str = ONLINE_MODEL_FILE):
+        """Write the model artifact with the online statistics alongside."""
+        extra = {name: self.stats[key] for key, name in STATS_ARRAYS.items()}
+        extra['online_alpha'] = self.alpha
+        save_model(self.model_data, path, extra_arrays=extra)
+
+    @classmethod
+    def load(cls, path: str = ONLINE_MODEL_FILE) -> 'OnlineGaussianHMM':
+        """Read a model saved by save()."""
+        model_data = load_model(path)
+        if 'online' not in model_data['config']:
+            raise ValueError(f"{path} has no online EM statistics (see --init)")
+        with np.load(path, allow_pickle=False) as npz:
+            stats = {key: npz[name] for key, name in STATS_ARRAYS.items()}
+            alpha = npz['online_alpha']
+        return cls(model_data, stats, alpha, model_data['config']['online']['forgetting'])
+
+
+def _params(model) -> dict:
+    return {'startprob': model.startprob_, 'transmat': model.transmat_,
+            'means': model.means_, 'covars': model.covars_}
+
+
+def new_observations(df: pd.DataFrame, after: str, window: int, scales: list) -> tuple:
+    """
+    Observations of the rows after a date, computing features for those rows only.
+
+    Args:
+        df: Price data with a 'return' column
+        after: Date of the last observation already seen
+        window: Wavelet window
+        scales: Wavelet scales
+
+    Returns:
+        observations: (n, 1 + n_scales) NaN-free observations
+        index: Their dates
+    """
+    first = df.index.searchsorted(pd.Timestamp(after), side='right')
+    lo = max(first - window + 1, 0)
+    returns = df['return'].to_numpy(dtype=float)[lo:]
+    energies = extract_wavelet_feature_bank(returns, window=window, scales=scales)
+
+    obs = np.column_stack([returns, energies])[first - lo:]
+    valid_mask = ~np.isnan(obs).any(axis=1)
+    return obs[valid_mask], df.index[first:][valid_mask]
+
+
+def init_online_model(data_path: str = DATA_FILE, model_path: str = MODEL_FILE,
+                      online_path: str = ONLINE_MODEL_FILE,
+                      forgetting: float = ONLINE_FORGETTING) -> OnlineGaussianHMM:
+    """Build the online model from a trained model and its training data."""
+    model_data = load_model(model_path)
+    config = model_data['config']
+    train_df = load_price_data(data_path, columns=['return'], end=config['train_end'])
+    train_obs, train_index = train_stage.prepare_observations(
+        train_df, window=config['window'], scales=config.get('scales', [config['scale']]))
+
+    online = OnlineGaussianHMM.from_training(model_data, train_obs, train_index[-1].date(),
+                                             forgetting)
+    online.save(online_path)
+    return online
+
+
+def refresh_online_model(data_path: str = DATA_FILE,
+                         online_path: str = ONLINE_MODEL_FILE) -> dict:
+    """
+    Nightly refresh: update the online model with the rows added since its last update.
+
+    Returns:
+        update() info plus the date range absorbed
+    """
+    online = OnlineGaussianHMM.load(online_path)
+    config = online.model_data['config']
+    df = load_price_data(data_path, columns=['return'])
+    obs, index = new_observations(df, online.online_config['last_date'], config['window'],
+                                  config.get('scales', [config['scale']]))
+
+    if len(obs) == 0:
+        return {'n_obs': 0, 'first_date': None, 'last_date': online.online_config['last_date']}
+
+    info = online.update(obs, last_date=index[-1].date())
+    online.save(online_path)
+    info.update({'first_date': str(index[0].date()), 'last_date': str(index[-1].date())})
+    return info
+
+
+def self_test():
+    """Quick test on synthetic regimes whose means drift after the training period."""
+    import tempfile
+
+    from batch_hmm import batch_estep
+
+    rng = np.random.default_rng(42)
+
+    def simulate(n, drift):
+        states = (np.arange(n) // 120) % 2
+        ret = np.where(states == 0, 0.001 + drift, -0.002 - drift) + rng.normal(0, 0.01, n) * (1 + states)
+        energy = np.where(states == 0, 0.2, 0.6 + drift * 100) + rng.normal(0, 0.05, n)
+        return np.column_stack([ret, energy])
+
+    train_obs, live_obs = simulate(2400, 0.0), simulate(1260, 0.002)
+    obs_mean, obs_std = train_obs.mean(axis=0), train_obs.std(axis=0)
+
+    start = time.time()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        fitted = train_stage.train_hmm((train_obs - obs_mean) / obs_std, n_states=2,
+                                       n_init=1, verbose=False)
+        labels = train_stage.analyze_states(fitted, 2)
+    refit_sec = time.time() - start
+    model_data = {'model': GaussianHMMParams.from_model(fitted), 'obs_mean': obs_mean,
+                  'obs_std': obs_std, 'state_labels': labels,
+                  'config': {'n_states': 2, 'window': 60, 'scale': 10.0, 'scales': [10.0]}}
+
+    print("Test online EM:")
+
+    # Without forgetting, the statistics are those of the batch E-step, and
+    # the M-step of a converged fit gives back (nearly) the same parameters
+    online = OnlineGaussianHMM.from_training(model_data, train_obs, forgetting=1.0)
+    X = (train_obs - obs_mean) / obs_std
+    reference = batch_estep(_params(model_data['model']), X[None], np.array([len(X)]))
+    for key in STATS_ARRAYS:
+        assert np.allclose(online.stats[key], reference[key]), key
+    refit = mstep(_params(model_data['model']), online.stats)
+    assert np.allclose(refit['means'], fitted.means_, atol=1e-2)
+    assert np.allclose(refit['transmat'], fitted.transmat_, atol=1e-2)
+    print("  OK: statistics match the batch E-step; M-step is a fixed point of the fit")
+
+    # Monthly updates: the online model tracks the drift, the static one does not
+    online = OnlineGaussianHMM.from_training(model_data, train_obs)
+    static_ll, online_ll, update_sec = 0.0, 0.0, []
+    static_alpha = online.alpha
+    for lo in range(0, len(live_obs), 21):
+        batch = live_obs[lo:lo + 21]
+        Xb = (batch - obs_mean) / obs_std
+        stats, static_alpha = weighted_estep(_params(model_data['model']), Xb,
+                                             np.ones(len(Xb)), static_alpha)
+        static_ll += stats['logprob']
+        info = online.update(batch)
+        online_ll += info['log_likelihood']
+        update_sec.append(info['update_sec'])
+    assert online.online_config['n_obs'] == len(train_obs) + len(live_obs)
+    assert online_ll > static_ll
+    print(f"  OK: out-of-sample log-likelihood online {online_ll:.1f} vs static {static_ll:.1f}")
+
+    # Persistence: the saved model continues exactly, and still loads as a plain model
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "online.npz")
+        online.save(path)
+        restored = OnlineGaussianHMM.load(path)
+        assert load_model(path)['config']['online']['n_updates'] == len(update_sec)
+    extra = simulate(21, 0.002)
+    online.update(extra)
+    restored.update(extra)
+    assert np.array_equal(online.model.means_, restored.model.means_)
+    assert np.array_equal(online.model.covars_, restored.model.covars_)
+    assert np.array_equal(online.alpha, restored.alpha)
+    print("  OK: save/load round trip continues identically")
+
+    print(f"  21-observation update: {np.median(update_sec) * 1000:.1f} ms "
+          f"(full refit on {len(train_obs)} observations: {refit_sec * 1000:.0f} ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Online EM updates of the trained HMM")
+    parser.add_argument("--init", action="store_true",
+                        help="Build the online model from the trained model and its training data")
+    parser.add_argument("--data", default=DATA_FILE, help="Price data (CSV or store)")
+    parser.add_argument("--model", default=MODEL_FILE, help="Trained model (for --init)")
+    parser.add_argument("--output", default=ONLINE_MODEL_FILE, help="Online model artifact")
+    parser.add_argument("--forgetting", type=float, default=ONLINE_FORGETTING,
+                        help="Weight decay per observation (for --init)")
+    parser.add_argument("--self-test", action="store_true",
+                        help="Run the synthetic-data checks and exit")
+    args = parser.parse_args()
+
+    if args.self_test:
+        self_test()
+        return
+
+    # Ensure we're in the right directory
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    if args.init or not os.path.exists(args.output):
+        online = init_online_model(args.data, args.model, args.output, args.forgetting)
+        print(f"Online model initialized from {args.model}: "
+              f"{online.online_config['n_obs']} training observations up to "
+              f"{online.online_config['last_date']}, forgetting {online.forgetting}")
+
+    info = refresh_online_model(args.data, args.output)
+    if info['n_obs'] == 0:
+        print(f"No new observations after {info['last_date']}")
+    else:
+        print(f"Updated with {info['n_obs']} observations ({info['first_date']} to "
+              f"{info['last_date']}) in {info['update_sec'] * 1000:.1f} ms, "
+              f"log-likelihood {info['log_likelihood']:.2f}")
+    print(f"Online model saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""
+Portfolio Backtest - regime allocation across a universe of assets
+- Positions, entry prices, stop levels and values as (T, n_assets) arrays;
+  each day is one vectorized step over all assets
+- Per asset, the rules of RegimeHMMRiskManager: no new entries in BEAR,
+  exits in BEAR, stop loss forces an exit for the day
+- Cross-sectional allocation: capital split over the assets in BULL
+  (equal or regime-probability weights, optionally the top N only)
+- Rebalancing on every change of the target set, or every k days
+- With one asset, identical to the single-instrument array engine
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from backtest_engine import HOLD, BUY, SELL
+from metrics_engine import calculate_metrics_matrix, metrics_rows
+from posterior_archive import archive_path_for, load_posteriors, regime_probability
+from universe_layout import ticker_paths
+from config import (
+    UNIVERSE,
+    UNIVERSE_DIR,
+    INITIAL_CAPITAL,
+    MAX_POSITION_PCT,
+    STOP_LOSS_PCT,
+    PORTFOLIO_REBALANCE,
+    PORTFOLIO_WEIGHTING,
+    PORTFOLIO_TOP_N,
+    PORTFOLIO_RESULTS_FILE
+)
+
+
+def simulate_portfolio(prices: np.ndarray, regimes: np.ndarray, scores: np.ndarray = None,
+                       initial_capital: float = INITIAL_CAPITAL,
+                       max_position_pct: float = MAX_POSITION_PCT,
+                       stop_loss_pct: float = STOP_LOSS_PCT,
+                       rebalance=PORTFOLIO_REBALANCE, top_n: int = PORTFOLIO_TOP_N) -> dict:
+    """
+    Run the regime-gated portfolio over price and regime matrices.
+
+    Each day, per asset: the stop loss is checked against the entry price,
+    positions in BEAR (or stopped out) are sold, and the target set is the
+    assets in BULL that were not stopped out. On rebalance days the
+    tradable capital (cash + positions with a price today) times
+    max_position_pct is split over the target set by weight and converted
+    to whole shares; sells are executed before buys.
+
+    Args:
+        prices: (T, N) execution prices; NaN where an asset has no price
+                (not listed yet or no bar): no trade, valued at its last price
+        regimes: (T, N) regime per day (0 = BULL, anything else = no entry)
+        scores: (T, N) non-negative allocation weights (e.g. P(BULL));
+                None = equal weights
+        rebalance: 'signal' = rebalance whenever the target set (less assets
+                   whose budget buys no whole share) differs from the
+                   holdings; int k = rebalance every k days (exits still
+                   happen daily, entries wait for the next rebalance)
+        top_n: Hold at most the top_n target assets by score (None = all)
+
+    Returns:
+        dict of (T, N) arrays: position, entry_price, stop_level (NaN when
+        flat), value, action (codes HOLD/BUY/SELL), stop_triggered, regime
+        (after the stop-loss override); and (T,) arrays: cash, total_value,
+        n_holdings, turnover (traded value / total value)
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    regimes = np.asarray(regimes)
+    n_days, n_assets = prices.shape
+    if rebalance != 'signal' and (not isinstance(rebalance, (int, np.integer)) or rebalance < 1):
+        raise ValueError(f"Unknown rebalance rule: {rebalance!r} (use 'signal' or a day count)")
+
+    out = {
+        'position': np.empty((n_days, n_assets), dtype=np.int64),
+        'entry_price': np.empty((n_days, n_assets)),
+        'value': np.empty((n_days, n_assets)),
+        'action': np.empty((n_days, n_assets), dtype=np.int8),
+        'stop_triggered': np.empty((n_days, n_assets), dtype=np.bool_),
+        'regime': np.empty((n_days, n_assets), dtype=np.int64),
+        'cash': np.empty(n_days),
+        'total_value': np.empty(n_days),
+        'turnover': np.empty(n_days)
+    }
+
+    cash = float(initial_capital)
+    position = np.zeros(n_assets, dtype=np.int64)
+    entry_price = np.zeros(n_assets)
+    last_price = np.full(n_assets, np.nan)
+
+    for t in range(n_days):
+        price = prices[t]
+        tradable = ~np.isnan(price)
+        last_price = np.where(tradable, price, last_price)
+        held = position > 0
+        regime = np.where(regimes[t] == 0, 0, 1)
+
+        # Stop loss first (same test as RegimeHMMRiskManager.check_stop_loss)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stop = held & tradable & (entry_price > 0) & ((entry_price - price) / entry_price >= stop_loss_pct)
+        regime[stop] = 1  # Treat as undesirable to allow exit
+
+        # Exits: BEAR or stopped out
+        exits = held & tradable & (regime != 0)
+        traded = 0.0
+        if exits.any():
+            proceeds = position[exits] * price[exits]
+            cash += proceeds.sum()
+            traded += proceeds.sum()
+            position[exits] = 0
+            entry_price[exits] = 0.0
+
+        # Target set: tradable assets in BULL, best top_n by score
+        target = tradable & (regime == 0)
+        weight = np.where(target, 1.0 if scores is None else scores[t], 0.0)
+        if top_n is not None and target.sum() > top_n:
+            weight[np.argsort(-weight, kind='stable')[top_n:]] = 0.0
+            target = weight > 0
+
+        # Whole shares per target asset at today's prices
+        desired = np.zeros(n_assets, dtype=np.int64)
+        if weight.sum() > 0:
+            capital = cash + np.dot(position[tradable], price[tradable])
+            budget = capital * max_position_pct * (weight / weight.sum())
+            desired[target] = (budget[target] / price[target]).astype(np.int64)
+
+        if rebalance == 'signal':
+            # Target assets whose budget buys no share are never held: leave
+            # them out, or every day would look like a change of the target set
+            rebalance_today = not np.array_equal(target & (held | (desired > 0)), held & tradable)
+        else:
+            rebalance_today = t % rebalance == 0
+
+        buys = np.zeros(n_assets, dtype=np.bool_)
+        sells = exits.copy()
+        if rebalance_today and weight.sum() > 0:
+            desired[~tradable] = position[~tradable]
+            delta = desired - position
+
+            # Sells before buys
+            sells |= delta < 0
+            buys = delta > 0
+            if sells.any():
+                proceeds = -delta[delta < 0] * price[delta < 0]
+                cash += proceeds.sum()
+                traded += proceeds.sum()
+            if buys.any():
+                cost = delta[buys] * price[buys]
+                cash -= cost.sum()
+                traded += cost.sum()
+                entry_price[buys & (position == 0)] = price[buys & (position == 0)]
+            position = desired
+            entry_price[position == 0] = 0.0
+
+        value = position * last_price
+        out['position'][t] = position
+        out['entry_price'][t] = entry_price
+        out['value'][t] = np.where(position > 0, value, 0.0)
+        out['action'][t] = np.where(buys, BUY, np.where(sells, SELL, HOLD))
+        out['stop_triggered'][t] = stop
+        out['regime'][t] = regime
+        out['cash'][t] = cash
+        out['total_value'][t] = cash + out['value'][t].sum()
+        out['turnover'][t] = traded / out['total_value'][t]
+
+    held = out['position'] > 0
+    out['stop_level'] = np.where(held, out['entry_price'] * (1 - stop_loss_pct), np.nan)
+    out['n_holdings'] = held.sum(axis=1)
+    return out
+
+
+def load_universe_regimes(tickers: list = UNIVERSE, universe_dir: str = UNIVERSE_DIR) -> dict:
+    """
+    Price, regime and P(BULL) matrices from run_universe.py's per-ticker backtests.
+
+    Regimes come from each ticker's state posterior archive (decoded state
+    through the model's regime mapping, before any stop-loss override).
+
+    Returns:
+        dict with 'index' (union of the dates), 'tickers', and (T, N)
+        'prices', 'regimes' (-1 where a ticker has no day) and 'p_bull'
+    """
+    prices, regimes, p_bull = {}, {}, {}
+
+    for ticker in tickers:
+        results_path = ticker_paths(ticker, universe_dir)['results']
+        archive_path = archive_path_for(results_path)
+        if not os.path.exists(archive_path):
+            raise FileNotFoundError(f"{archive_path} missing: run run_universe.py first")
+        results = pd.read_csv(results_path, index_col="date", parse_dates=True,
+                              usecols=['date', 'price'])
+        posteriors = load_posteriors(archive_path)
+        prices[ticker] = results['price']
+        regimes[ticker] = pd.Series(posteriors['regime_map'][posteriors['state']],
+                                    index=posteriors['index'])
+        p_bull[ticker] = pd.Series(regime_probability(posteriors), index=posteriors['index'])
+
+    prices = pd.DataFrame(prices)
+    align = dict(index=prices.index, columns=prices.columns)
+    return {
+        'index': prices.index,
+        'tickers': list(prices.columns),
+        'prices': prices.to_numpy(),
+        'regimes': pd.DataFrame(regimes).reindex(**align).fillna(-1).to_numpy(dtype=np.int64),
+        'p_bull': pd.DataFrame(p_bull).reindex(**align).fillna(0.0).to_numpy()
+    }
+
+
+def portfolio_metrics(sim: dict, prices: np.ndarray,
+                      initial_capital: float = INITIAL_CAPITAL) -> dict:
+    """
+    calculate_metrics for the portfolio, against an equal-weight buy & hold.
+
+    The benchmark holds each asset from its first price on, rebalanced
+    daily to equal weights over the assets with a price.
+    """
+    # Daily return of each asset (NaN before its first price and on missing bars)
+    last_prices = pd.DataFrame(prices).ffill().to_numpy()
+    asset_returns = pd.DataFrame(prices[1:] / last_prices[:-1] - 1)
+    benchmark = np.concatenate([[1.0], np.cumprod(1 + asset_returns.mean(axis=1).fillna(0.0).to_numpy())])
+
+    actions = sim['action']
+    day_action = np.where((actions == BUY).any(axis=1), BUY,
+                          np.where((actions == SELL).any(axis=1), SELL, HOLD))
+    metrics = metrics_rows(calculate_metrics_matrix(
+        sim['total_value'][None], benchmark[None], day_action[None],
+        (sim['n_holdings'] == 0).astype(int)[None], (sim['n_holdings'] > 0)[None],
+        initial_capital))[0]
+    metrics.pop('regime_distribution')
+    metrics['avg_holdings'] = sim['n_holdings'].mean()
+    metrics['annual_turnover'] = sim['turnover'].mean() * 252
+    return metrics
+
+
+def run_portfolio_backtest(tickers: list = UNIVERSE, universe_dir: str = UNIVERSE_DIR,
+                           rebalance=PORTFOLIO_REBALANCE, weighting: str = PORTFOLIO_WEIGHTING,
+                           top_n: int = PORTFOLIO_TOP_N,
+                           output_path: str = PORTFOLIO_RESULTS_FILE) -> tuple:
+    """
+    Backtest the regime allocation on run_universe.py's outputs.
+
+    Args:
+        weighting: 'equal' or 'probability' (weights = filtered P(BULL))
+
+    Returns:
+        results_df: Daily cash, total value, holdings count, turnover and
+                    per-ticker positions
+        metrics: portfolio_metrics dict
+    """
+    if weighting not in ('equal', 'probability'):
+        raise ValueError(f"Unknown weighting: {weighting}")
+
+    universe = load_universe_regimes(tickers, universe_dir)
+    start_time = time.time()
+    sim = simulate_portfolio(universe['prices'], universe['regimes'],
+                             universe['p_bull'] if weighting == 'probability' else None,
+                             rebalance=rebalance, top_n=top_n)
+    elapsed = time.time() - start_time
+
+    results_df = pd.DataFrame({'cash': sim['cash'], 'total_value': sim['total_value'],
+                               'n_holdings': sim['n_holdings'], 'turnover': sim['turnover']},
+                              index=pd.Index(universe['index'], name='date'))
+    positions = pd.DataFrame(sim['position'], index=results_df.index,
+                             columns=[f"position_{t}" for t in universe['tickers']])
+    results_df = pd.concat([results_df, positions], axis=1)
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    results_df.to_csv(output_path)
+
+    print(f"\n{len(universe['tickers'])} assets x {len(results_df)} days simulated in {elapsed:.2f}s")
+    return results_df, portfolio_metrics(sim, universe['prices'])
+
+
+def self_test():
+    """One asset matches the single-instrument engine; timing on a large universe."""
+    from backtest_engine import simulate_regime_strategy
+
+    rng = np.random.default_rng(42)
+    n_days = 2520
+    prices = 100 * np.cumprod(1 + rng.normal(0.0003, 0.015, n_days))
+    regimes = np.repeat(rng.integers(0, 2, n_days // 10), 10)
+
+    single = simulate_regime_strategy(prices, regimes, stop_loss_pct=0.03)
+    sim = simulate_portfolio(prices[:, None], regimes[:, None], stop_loss_pct=0.03,
+                             rebalance='signal')
+
+    print("Test portfolio backtest:")
+    assert np.array_equal(sim['total_value'], single['total_value'])
+    assert np.array_equal(sim['cash'], single['cash'])
+    assert np.array_equal(sim['position'][:, 0], single['position'])
+    assert np.array_equal(sim['action'][:, 0], single['action'])
+    assert np.array_equal(sim['stop_triggered'][:, 0], single['stop_triggered'])
+    assert np.array_equal(sim['regime'][:, 0], single['regime'])
+    print(f"  OK: one asset matches simulate_regime_strategy exactly "
+          f"({int(single['stop_triggered'].sum())} stops)")
+
+    # A BULL asset too expensive for its budget must not trigger daily rebalances
+    drift = np.cumprod(1 + rng.normal(0, 0.005, (50, 2)), axis=0)
+    sim = simulate_portfolio(drift * [100.0, 1e6], np.zeros((50, 2), dtype=int),
+                             initial_capital=100_000, stop_loss_pct=1.0, rebalance='signal')
+    trade_days = np.flatnonzero((sim['action'] != HOLD).any(axis=1))
+    assert np.array_equal(trade_days, [0]), trade_days
+    print("  OK: unaffordable target asset does not force rebalances")
+
+    # Many assets, some listed late; capital never overdrawn, holdings within top_n
+    n_days, n_assets = 252 * 30, 500
+    returns = rng.normal(0.0003, 0.02, (n_days, n_assets))
+    prices = 50 * np.cumprod(1 + returns, axis=0)
+    listed = rng.integers(0, n_days // 2, n_assets)
+    prices[np.arange(n_days)[:, None] < listed] = np.nan
+    regimes = np.repeat(rng.integers(0, 2, (n_days // 21 + 1, n_assets)), 21, axis=0)[:n_days]
+    scores = rng.random((n_days, n_assets))
+
+    for rule, top_n in (('signal', None), (21, 50)):
+        start = time.perf_counter()
+        sim = simulate_portfolio(prices, regimes, scores, initial_capital=1e7,
+                                 rebalance=rule, top_n=top_n)
+        elapsed = time.perf_counter() - start
+        assert np.all(sim['cash'] >= -1e-6)
+        assert top_n is None or sim['n_holdings'].max() <= top_n
+        assert not (sim['position'][np.isnan(prices)] > 0).any()  # Nothing held before listing
+        print(f"  OK: {n_assets} assets x {n_days} days, rebalance={rule}, top_n={top_n}: "
+              f"{elapsed:.2f}s, avg holdings {sim['n_holdings'].mean():.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regime-allocated portfolio backtest")
+    parser.add_argument("--tickers", nargs="+", default=UNIVERSE, help="Tickers to allocate across")
+    parser.add_argument("--rebalance", default=str(PORTFOLIO_REBALANCE),
+                        help="'signal' or a number of days")
+    parser.add_argument("--weighting", choices=['equal', 'probability'], default=PORTFOLIO_WEIGHTING,
+                        help="Weights over the BULL assets")
+    parser.add_argument("--top-n", type=int, default=PORTFOLIO_TOP_N,
+                        help="Hold at most this many assets")
+    parser.add_argument("--output", default=PORTFOLIO_RESULTS_FILE, help="Results CSV")
+    parser.add_argument("--self-test", action="store_true",
+                        help="Check against the single-asset engine and time a large universe")
+    args = parser.parse_args()
+
+    # Ensure we're in the right directory
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    if args.self_test:
+        self_test()
+        return
+
+    rebalance = args.rebalance if args.rebalance == 'signal' else int(args.rebalance)
+    results_df, metrics = run_portfolio_backtest(args.tickers, rebalance=rebalance,
+                                                 weighting=args.weighting, top_n=args.top_n,
+                                                 output_path=args.output)
+
+    print(f"\nPeriod: {results_df.index[0].date()} to {results_df.index[-1].date()}")
+    print(f"Strategy Return:     {metrics['total_return_pct']:+.2f}%")
+    print(f"Equal-Weight B&H:    {metrics['buy_hold_return_pct']:+.2f}%")
+    print(f"Sharpe Ratio:        {metrics['sharpe_ratio']:.3f}")
+    print(f"Max Drawdown:        {metrics['max_drawdown_pct']:.2f}%")
+    print(f"Avg Holdings:        {metrics['avg_holdings']:.1f}")
+    print(f"Annual Turnover:     {metrics['annual_turnover']:.1f}x")
+    print(f"\nResults saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+State Posterior Archive
+- Written by the backtest next to its results CSV: filtered (causal) and
+  smoothed state probabilities, log-likelihood contribution and decoded
+  state of every backtest day, indexed by date
+- Also holds the regime mapping, state labels, transition matrix and model
+  config, so plots and reports read it instead of re-loading the model
+- Versioned .npz, written atomically like the model store
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from config import BACKTEST_RESULTS_FILE
+
+ARCHIVE_FORMAT_VERSION = 1
+ARCHIVE_SUFFIX = ".posteriors.npz"
+
+
+def archive_path_for(results_path: str = BACKTEST_RESULTS_FILE) -> str:
+    """Archive file that belongs to a backtest results CSV."""
+    return os.path.splitext(results_path)[0] + ARCHIVE_SUFFIX
+
+
+def build_archive(index: pd.DatetimeIndex, filtered: np.ndarray, smoothed: np.ndarray,
+                  loglik: np.ndarray, states: np.ndarray, regime_map: np.ndarray,
+                  model_data: dict) -> dict:
+    """
+    Assemble an archive dict (the same layout load_posteriors returns).
+
+    Args:
+        index: Backtest days
+        filtered: (N, K) P(state | observations up to the day)
+        smoothed: (N, K) P(state | all observations of the run); looks ahead,
+                  for analysis only
+        loglik: (N,) log-likelihood contribution of each day's observation
+                (NaN for days without a new valid observation)
+        states: (N,) decoded state of each day
+        regime_map: (K,) regime of each state (0 = BULL, 1 = BEAR)
+        model_data: Model dict (state labels, transition matrix, config)
+    """
+    return {
+        'index': pd.DatetimeIndex(index),
+        'filtered': np.asarray(filtered, dtype=np.float32),
+        'smoothed': np.asarray(smoothed, dtype=np.float32),
+        'loglik': np.asarray(loglik, dtype=float),
+        'state': np.asarray(states, dtype=np.int8),
+        'regime_map': np.asarray(regime_map, dtype=np.int8),
+        'transmat': np.asarray(model_data['model'].transmat_, dtype=float),
+        'state_labels': {int(state): label for state, label in model_data['state_labels'].items()},
+        'config': model_data['config']
+    }
+
+
+def save_posteriors(archive: dict, path: str):
+    """Write an archive dict as a compact .npz file."""
+    arrays = {
+        'format_version': np.array(ARCHIVE_FORMAT_VERSION),
+        'dates': archive['index'].values.astype('datetime64[ns]'),
+        'state_labels': np.array(json.dumps(archive['state_labels'])),
+        'config': np.array(json.dumps(archive['config']))
+    }
+    for key in ('filtered', 'smoothed', 'loglik', 'state', 'regime_map', 'transmat'):
+        arrays[key] = archive[key]
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_posteriors(path: str) -> dict:
+    """
+    Read an archive written by save_posteriors.
+
+    Returns:
+        dict with 'index' (DatetimeIndex), 'filtered', 'smoothed', 'loglik',
+        'state', 'regime_map', 'transmat', 'state_labels' and 'config'
+    """
+    with np.load(path, allow_pickle=False) as npz:
+        version = int(npz['format_version'])
+        if version > ARCHIVE_FORMAT_VERSION:
+            raise ValueError(f"Archive format version {version} is newer than supported "
+                             f"({ARCHIVE_FORMAT_VERSION}): {path}")
+        archive = {key: npz[key] for key in ('filtered', 'smoothed', 'loglik', 'state',
+                                             'regime_map', 'transmat')}
+        archive['index'] = pd.DatetimeIndex(npz['dates'])
+        state_labels = json.loads(str(npz['state_labels']))
+        archive['config'] = json.loads(str(npz['config']))
+
+    archive['state_labels'] = {int(state): label for state, label in state_labels.items()}
+    return archive
+
+
+def matches_results(archive: dict, results: pd.DataFrame) -> bool:
+    """True if the archive was written with these backtest results (same days and states)."""
+    return (len(archive['index']) == len(results)
+            and archive['index'].equals(pd.DatetimeIndex(results.index))
+            and np.array_equal(archive['state'], results['state'].to_numpy()))
+
+
+def bull_state(archive: dict) -> int:
+    """State mapped to the BULL regime."""
+    return int(np.flatnonzero(archive['regime_map'] == 0)[0])
+
+
+def regime_probability(archive: dict, regime: int = 0, kind: str = 'filtered') -> np.ndarray:
+    """(N,) probability of a regime on each day ('filtered' or 'smoothed')."""
+    return archive[kind][:, archive['regime_map'] == regime].sum(axis=1, dtype=float)
+
+
+def state_confidence(archive: dict, kind: str = 'filtered') -> np.ndarray:
+    """(N,) probability of each day's decoded state."""
+    return archive[kind][np.arange(len(archive['state'])), archive['state']].astype(float)
+
+
+def posterior_summary(archive: dict, uncertain_below: float = 0.6) -> dict:
+    """
+    Regime-confidence figures for the backtest report.
+
+    Returns:
+        dict with mean_loglik (per day), mean_bull_probability,
+        mean_confidence (filtered probability of the decoded state) and
+        uncertain_pct (days with confidence below uncertain_below)
+    """
+    confidence = state_confidence(archive)
+    return {
+        'mean_loglik': float(np.nanmean(archive['loglik'])),
+        'mean_bull_probability': float(regime_probability(archive).mean()),
+        'mean_confidence': float(confidence.mean()),
+        'uncertain_pct': float((confidence < uncertain_below).mean() * 100),
+        'uncertain_below': uncertain_below
+    }
+
+
+if __name__ == "__main__":
+    # Quick test: write/read round trip and the derived series
+    import tempfile
+
+    from hmm_inference import GaussianHMMParams, filter_smooth
+
+    rng = np.random.default_rng(42)
+    model = GaussianHMMParams([0.5, 0.5], [[0.95, 0.05], [0.1, 0.9]],
+                              [[0.5, 0.0], [-0.5, 1.0]], [np.eye(2), 2 * np.eye(2)])
+    obs = rng.normal(size=(500, 2))
+    filtered, smoothed, loglik = filter_smooth(model.startprob_, model.transmat_,
+                                               model._compute_log_likelihood(obs))
+    states = filtered.argmax(axis=1)
+    model_data = {'model': model, 'state_labels': {0: "BULL (high return)", 1: "BEAR (low return)"},
+                  'config': {'n_states': 2, 'window': 5, 'scale': 5, 'scales': [5]}}
+    archive = build_archive(pd.bdate_range("2020-01-01", periods=len(obs)), filtered, smoothed,
+                            loglik, states, [0, 1], model_data)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = archive_path_for(os.path.join(tmp_dir, "backtest_results.csv"))
+        save_posteriors(archive, path)
+        size_kb = os.path.getsize(path) / 1024
+        restored = load_posteriors(path)
+
+    print("Test posterior archive:")
+    assert restored['index'].equals(archive['index'])
+    for key in ('filtered', 'smoothed', 'loglik', 'state', 'regime_map', 'transmat'):
+        assert np.array_equal(restored[key], archive[key]), key
+    assert restored['state_labels'] == archive['state_labels']
+    assert restored['config'] == archive['config']
+    print(f"  OK: round trip ({len(obs)} days, {size_kb:.1f} KB)")
+
+    results = pd.DataFrame({'state': states}, index=archive['index'])
+    assert matches_results(restored, results)
+    assert not matches_results(restored, results.iloc[1:])
+    assert bull_state(restored) == 0
+    assert np.allclose(regime_probability(restored) + regime_probability(restored, 1), 1, atol=1e-6)
+    assert np.all(state_confidence(restored) >= 0.5 - 1e-6)
+    print(f"  OK: summary {posterior_summary(restored)}")
@@ -0,0 +1,212 @@
+"""
+Columnar Memory-Mapped Price Store
+- One .npy file per column plus a datetime64 index, in a directory
+- Opened with mmap: stages read only the columns and date range they need
+- Drop-in replacement for pd.read_csv(DATA_FILE, index_col="Date", parse_dates=True)
+- Chunked reads (store slices or CSV chunks) for files larger than memory
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import timer
+from config import DATA_FILE
+
+STORE_VERSION = 1
+INDEX_FILE = "_index.npy"
+META_FILE = "meta.json"
+
+
+def store_path_for(csv_path: str) -> str:
+    """Store directory that mirrors a CSV file (data/SPY.csv -> data/SPY_store)."""
+    return os.path.splitext(csv_path)[0] + "_store"
+
+
+def write_price_store(df: pd.DataFrame, store_dir: str):
+    """
+    Write a DataFrame with a DatetimeIndex as a columnar store.
+
+    Args:
+        df: Price data indexed by date (numeric columns only)
+        store_dir: Output directory (created if needed)
+    """
+    os.makedirs(store_dir, exist_ok=True)
+
+    files = {}
+    for i, column in enumerate(df.columns):
+        values = df[column].to_numpy()
+        if values.dtype == object:
+            raise ValueError(f"Column '{column}' is not numeric")
+        files[column] = f"col{i}.npy"
+        np.save(os.path.join(store_dir, files[column]), values)
+
+    index = np.asarray(df.index.values)
+    if index.dtype.kind != 'M':
+        raise ValueError("Index must be a DatetimeIndex")
+    np.save(os.path.join(store_dir, INDEX_FILE), index)
+
+    # Metadata last: a store without meta.json is treated as incomplete
+    meta = {
+        'version': STORE_VERSION,
+        'index_name': df.index.name or "Date",
+        'n_rows': len(df),
+        'columns': list(df.columns),
+        'files': files
+    }
+    with open(os.path.join(store_dir, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def read_store_meta(store_dir: str) -> dict:
+    """Read store metadata (column names, row count)."""
+    with open(os.path.join(store_dir, META_FILE)) as f:
+        return json.load(f)
+
+
+def load_prices(store_dir: str, columns: list = None,
+                start: str = None, end: str = None) -> pd.DataFrame:
+    """
+    Load a date range of selected columns from a columnar store.
+
+    Only the requested rows of the requested columns are read from disk.
+
+    Args:
+        store_dir: Store directory written by write_price_store
+        columns: Columns to load (default: all)
+        start: First date (inclusive)
+        end: Last date (inclusive)
+
+    Returns:
+        DataFrame indexed by date, same layout as the CSV
+    """
+    meta = read_store_meta(store_dir)
+    columns = meta['columns'] if columns is None else columns
+
+    index = np.load(os.path.join(store_dir, INDEX_FILE), mmap_mode='r')
+    lo = 0 if start is None else np.searchsorted(index, np.datetime64(pd.Timestamp(start)), side='left')
+    hi = len(index) if end is None else np.searchsorted(index, np.datetime64(pd.Timestamp(end)), side='right')
+
+    data = {}
+    for column in columns:
+        values = np.load(os.path.join(store_dir, meta['files'][column]), mmap_mode='r')
+        data[column] = np.array(values[lo:hi])
+
+    dates = pd.DatetimeIndex(np.array(index[lo:hi]), name=meta['index_name'])
+
+    return pd.DataFrame(data, index=dates, columns=columns)
+
+
+def fresh_store_for(path: str) -> str:
+    """
+    Store directory to read `path` from, or None to read the CSV.
+
+    The store is used when `path` is a store directory, or when `path` is a
+    CSV whose mirror store exists and is not older than the CSV.
+    """
+    store_dir = path if os.path.isdir(path) else store_path_for(path)
+    meta_path = os.path.join(store_dir, META_FILE)
+
+    if os.path.exists(meta_path) and (
+            not os.path.exists(path) or os.path.isdir(path)
+            or os.path.getmtime(meta_path) >= os.path.getmtime(path)):
+        return store_dir
+    return None
+
+
+def load_price_data(path: str = DATA_FILE, columns: list = None,
+                    start: str = None, end: str = None) -> pd.DataFrame:
+    """
+    Load price data from the columnar store, falling back to the CSV.
+
+    The store is used when it is up to date (see fresh_store_for).
+
+    Args:
+        path: CSV file or store directory
+        columns: Columns to load (default: all)
+        start: First date (inclusive)
+        end: Last date (inclusive)
+
+    Returns:
+        DataFrame indexed by date
+    """
+    store_dir = fresh_store_for(path)
+
+    if store_dir is not None:
+        with timer("load_prices.store"):
+            return load_prices(store_dir, columns=columns, start=start, end=end)
+
+    with timer("load_prices.csv"):
+        df = pd.read_csv(path, index_col="Date", parse_dates=True)
+    if columns is not None:
+        df = df[columns]
+    if start is not None:
+        df = df[df.index >= start]
+    if end is not None:
+        df = df[df.index <= end]
+
+    return df
+
+
+def iter_price_chunks(path: str = DATA_FILE, chunk_rows: int = 100_000,
+                      columns: list = None):
+    """
+    Read price data in consecutive chunks of at most chunk_rows rows.
+
+    Concatenating the chunks gives load_price_data(path, columns); only one
+    chunk is held in memory at a time.
+
+    Args:
+        path: CSV file or store directory
+        chunk_rows: Rows per chunk
+        columns: Columns to load (default: all)
+
+    Yields:
+        DataFrames indexed by date
+    """
+    store_dir = fresh_store_for(path)
+
+    if store_dir is not None:
+        meta = read_store_meta(store_dir)
+        columns = meta['columns'] if columns is None else columns
+        index = np.load(os.path.join(store_dir, INDEX_FILE), mmap_mode='r')
+        values = {column: np.load(os.path.join(store_dir, meta['files'][column]), mmap_mode='r')
+                  for column in columns}
+
+        for lo in range(0, len(index), chunk_rows):
+            hi = lo + chunk_rows
+            yield pd.DataFrame({column: np.array(values[column][lo:hi]) for column in columns},
+                               index=pd.DatetimeIndex(np.array(index[lo:hi]),
+                                                      name=meta['index_name']),
+                               columns=columns)
+        return
+
+    usecols = None if columns is None else ["Date"] + list(columns)
+    with pd.read_csv(path, index_col="Date", parse_dates=True, usecols=usecols,
+                     chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            yield chunk if columns is None else chunk[columns]
+
+
+if __name__ == "__main__":
+    # Convert the existing CSV into a columnar store and verify the round trip
+    csv_df = pd.read_csv(DATA_FILE, index_col="Date", parse_dates=True)
+    store_dir = store_path_for(DATA_FILE)
+    write_price_store(csv_df, store_dir)
+
+    store_df = load_price_data(DATA_FILE)
+    pd.testing.assert_frame_equal(store_df, csv_df, check_freq=False)
+
+    subset = load_price_data(DATA_FILE, columns=['return'], start="2008-01-01", end="2008-06-30")
+    expected = csv_df.loc[(csv_df.index >= "2008-01-01") & (csv_df.index <= "2008-06-30"), ['return']]
+    pd.testing.assert_frame_equal(subset, expected, check_freq=False)
+
+    chunks = list(iter_price_chunks(DATA_FILE, chunk_rows=1000, columns=['return']))
+    pd.testing.assert_frame_equal(pd.concat(chunks), store_df[['return']], check_freq=False)
+
+    print(f"Price store written to: {store_dir}")
+    print(f"  Rows: {len(store_df)}, Columns: {list(store_df.columns)}")
+    print("  OK: store matches CSV (full load and column/date subset)")
+    print(f"  OK: {len(chunks)} chunks reassemble the store")
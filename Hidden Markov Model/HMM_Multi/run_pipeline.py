@@ -1,28 +1,199 @@
 """
 Main runner script - Execute the full pipeline
+- Stages run in-process as a dependency graph: download -> train -> backtest -> visualize
+- Artifacts (price data, model, results) are passed in memory
+- Each stage is fingerprinted (upstream output hashes, relevant config.py
+  values and the stage script's code) and skipped when unchanged, make-style
 """
 
-import subprocess
-import sys
+import argparse
+import importlib
 import os
-from config import print_config
-
-def run_step(script_name: str, description: str):
-    """Run a script and handle errors."""
-    print(f"\n{'='*60}")
-    print(f"STEP: {description}")
-    print(f"{'='*60}\n")
-    
-    result = subprocess.run([sys.executable, script_name], capture_output=False)
-    
-    if result.returncode != 0:
-        print(f"\nERROR: {script_name} failed!")
-        sys.exit(1)
-    
-    print(f"\n✓ {description} completed successfully")
+import sys
+import traceback
+
+import matplotlib
+matplotlib.use("Agg")  # Batch run: render plots to files only
+
+import pandas as pd
+import config
+import instrumentation
+from price_store import load_price_data
+from model_store import load_model as load_model_file
+from posterior_archive import archive_path_for, load_posteriors
+from build_state import hash_file, hash_inputs, load_state, save_state
+from config import print_config, PIPELINE_STATE_FILE
+
+# Stage scripts start with a digit, so import them by name
+download_stage = importlib.import_module("1_download_data")
+train_stage = importlib.import_module("3_train_hmm")
+backtest_stage = importlib.import_module("4_backtest")
+visualize_stage = importlib.import_module("5_visualize")
+
+
+class Stage:
+    """One pipeline step: what it reads, what it writes and how to run it."""
+
+    def __init__(self, name: str, description: str, run, module, outputs: list,
+                 config_keys: list, deps: list = ()):
+        self.name = name
+        self.description = description
+        self.run = run                  # run(artifacts) -> in-memory artifact
+        self.module = module            # Stage script; editing it re-runs the stage
+        self.outputs = outputs          # Files written by the stage
+        self.config_keys = config_keys  # config.py values the stage depends on
+        self.deps = list(deps)          # Upstream stage names
+
+    def fingerprint(self, output_hashes: dict) -> str:
+        """Hash of everything that determines this stage's outputs."""
+        inputs = {
+            'config': {key: getattr(config, key) for key in self.config_keys},
+            'upstream': {dep: output_hashes[dep] for dep in self.deps},
+            'code': hash_file(self.module.__file__)
+        }
+        return hash_inputs(inputs)
+
+    def outputs_exist(self) -> bool:
+        return all(os.path.exists(path) for path in self.outputs)
+
+    def output_hash(self) -> str:
+        return hash_inputs([hash_file(path) for path in self.outputs])
+
+
+# ============================================================================
+# STAGE FUNCTIONS
+# ============================================================================
+
+def load_prices(artifacts: dict) -> pd.DataFrame:
+    """Price data from an earlier stage, or from disk if download was skipped."""
+    if 'download' not in artifacts:
+        artifacts['download'] = load_price_data(config.DATA_FILE)
+    return artifacts['download']
+
+
+def load_model(artifacts: dict) -> dict:
+    """Model dict from the train stage, or from disk if training was skipped."""
+    if 'train' not in artifacts:
+        artifacts['train'] = load_model_file(config.MODEL_FILE)
+    return artifacts['train']
+
+
+def run_download(artifacts: dict) -> pd.DataFrame:
+    return download_stage.download_ticker_data(config.TICKER, config.DATA_START_DATE,
+                                               config.DATA_END_DATE, config.DATA_FILE)
+
+
+def run_train(artifacts: dict) -> dict:
+    model_data, _ = train_stage.train_and_save(df=load_prices(artifacts))
+    return model_data
+
+
+def run_backtest(artifacts: dict) -> pd.DataFrame:
+    archive_path = archive_path_for(config.BACKTEST_RESULTS_FILE)
+    results_df, metrics = backtest_stage.run_backtest(test_start=config.TEST_START_DATE,
+                                                      stop_loss_pct=config.STOP_LOSS_PCT,
+                                                      df=load_prices(artifacts),
+                                                      model_data=load_model(artifacts),
+                                                      archive_path=archive_path)
+    backtest_stage.print_report(results_df, metrics,
+                                backtest_stage.confidence_intervals(results_df, metrics),
+                                load_posteriors(archive_path))
+
+    os.makedirs(config.RESULTS_DIR, exist_ok=True)
+    results_df.to_csv(config.BACKTEST_RESULTS_FILE)
+    print(f"\nResults saved to: {config.BACKTEST_RESULTS_FILE}")
+
+    return results_df
+
+
+def run_visualize(artifacts: dict):
+    results = artifacts.get('backtest')
+    archive_path = archive_path_for(config.BACKTEST_RESULTS_FILE)
+    posteriors = load_posteriors(archive_path) if results is not None and os.path.exists(archive_path) else None
+    visualize_stage.plot_results(df=load_prices(artifacts), results=results,
+                                 model_data=load_model(artifacts), posteriors=posteriors)
+    visualize_stage.plot_state_statistics(results=results, model_data=load_model(artifacts),
+                                          posteriors=posteriors)
+    visualize_stage.plt.close('all')
+
+
+STAGES = [
+    Stage('download', "Download SPY Data", run_download, download_stage,
+          outputs=[config.DATA_FILE],
+          config_keys=['TICKER', 'DATA_START_DATE', 'DATA_END_DATE']),
+    Stage('train', "Train HMM Model", run_train, train_stage,
+          outputs=[config.MODEL_FILE],
+          config_keys=['TRAIN_END_DATE', 'N_STATES', 'WINDOW', 'SCALE', 'SCALES',
+                       'N_ITER', 'RANDOM_STATE', 'N_INIT'],
+          deps=['download']),
+    Stage('backtest', "Backtest Strategy", run_backtest, backtest_stage,
+          outputs=[config.BACKTEST_RESULTS_FILE, archive_path_for(config.BACKTEST_RESULTS_FILE)],
+          config_keys=['TEST_START_DATE', 'INITIAL_CAPITAL', 'MAX_POSITION_PCT',
+                       'STOP_LOSS_PCT'],
+          deps=['download', 'train']),
+    Stage('visualize', "Generate Plots", run_visualize, visualize_stage,
+          outputs=[config.BACKTEST_PLOT_FILE, config.STATE_STATS_PLOT_FILE],
+          config_keys=['PLOT_START_DATE', 'TEST_START_DATE', 'PLOT_MAX_POINTS'],
+          deps=['download', 'train', 'backtest']),
+]
+
+
+# ============================================================================
+# RUNNER
+# ============================================================================
+
+def run_pipeline(stages: list = STAGES, force: bool = False) -> dict:
+    """
+    Run stages in dependency order, skipping those whose inputs are unchanged.
+
+    Returns:
+        dict of stage name -> 'ran' or 'skipped'
+    """
+    state = {} if force else load_state(PIPELINE_STATE_FILE)
+    artifacts = {}
+    output_hashes = {}
+    status = {}
+
+    for stage in stages:
+        print(f"\n{'='*60}")
+        print(f"STEP: {stage.description}")
+        print(f"{'='*60}\n")
+
+        fingerprint = stage.fingerprint(output_hashes)
+
+        if state.get(stage.name) == fingerprint and stage.outputs_exist():
+            print(f"↷ {stage.description} skipped (inputs unchanged)")
+            status[stage.name] = 'skipped'
+        else:
+            try:
+                with instrumentation.stage(stage.name):
+                    artifacts[stage.name] = stage.run(artifacts)
+            except Exception:
+                traceback.print_exc()
+                print(f"\nERROR: {stage.name} stage failed!")
+                sys.exit(1)
+
+            state[stage.name] = fingerprint
+            save_state(state, PIPELINE_STATE_FILE)
+            status[stage.name] = 'ran'
+            print(f"\n✓ {stage.description} completed successfully")
+
+        output_hashes[stage.name] = stage.output_hash()
+
+    return status
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Run the HMM pipeline")
+    parser.add_argument("--force", action="store_true", help="Re-run every stage")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"Report timings, counters and peak memory per stage "
+                             f"(same as {config.PROFILE_ENV_VAR}=1)")
+    args = parser.parse_args()
+
+    if args.profile:
+        instrumentation.enable(report_at_exit=True)
+
     # Ensure we're in the right directory
     script_dir = os.path.dirname(os.path.abspath(__file__))
     os.chdir(script_dir)
@@ -39,25 +210,24 @@ def main():
     print("2. Train HMM on training period")
     print("3. Backtest on test period")
     print("4. Generate visualizations")
-    print("\nTIP: Edit config.py to adjust dates and parameters")
+    print("\nStages whose inputs are unchanged since the last run are skipped")
+    print("TIP: Edit config.py to adjust dates and parameters")
 
     # Create directories
     os.makedirs("data", exist_ok=True)
     os.makedirs("models", exist_ok=True)
     os.makedirs("results", exist_ok=True)
-    
+
     # Run pipeline
-    run_step("1_download_data.py", "Download SPY Data")
-    run_step("3_train_hmm.py", "Train HMM Model")
-    run_step("4_backtest.py", "Backtest Strategy")
-    run_step("5_visualize.py", "Generate Plots")
-    
+    status = run_pipeline(force=args.force)
+
     print("\n" + "="*60)
     print("PIPELINE COMPLETE!")
     print("="*60)
+    print("\nStages: " + ", ".join(f"{name} ({result})" for name, result in status.items()))
     print("\nOutputs:")
     print("  - data/SPY.csv                   : Raw price data")
-    print("  - models/hmm_model.pkl           : Trained HMM model")
+    print("  - models/hmm_model.npz           : Trained HMM model")
     print("  - results/backtest_results.csv   : Daily backtest results")
     print("  - results/backtest_plot.png      : Main performance chart")
     print("  - results/state_stats.png        : State analysis chart")
@@ -0,0 +1,205 @@
+"""
+Hyperparameter sweep - Evaluate a parameter grid in parallel
+- Wavelet features computed once per (window, scale), shared read-only
+  with workers as memory-mapped .npy files
+- One HMM fit per (n_states, window, scale); stop-loss variants reuse it
+- Ranked metrics table; the stop-loss variants of a model are scored in
+  one pass by the matrix metrics engine (metrics_engine.py)
+"""
+
+import argparse
+import contextlib
+import importlib
+import itertools
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import as_completed
+
+import numpy as np
+import pandas as pd
+from feature_cache import load_feature_bank
+from price_store import load_price_data
+from metrics_engine import calculate_metrics_batch
+from worker_pool import worker_pool
+from config import (
+    DATA_FILE,
+    TRAIN_END_DATE,
+    TEST_START_DATE,
+    N_ITER,
+    INITIAL_CAPITAL,
+    RANDOM_STATE,
+    MAX_WORKERS,
+    SWEEP_GRID,
+    SWEEP_RANK_BY,
+    SWEEP_RESULTS_FILE,
+    RESULTS_DIR
+)
+
+# Stage scripts start with a digit, so import them by name
+train_stage = importlib.import_module("3_train_hmm")
+backtest_stage = importlib.import_module("4_backtest")
+
+
+def expand_grid(grid: dict) -> list:
+    """All parameter combinations of a grid as a list of dicts."""
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*grid.values())]
+
+
+def evaluate_group(n_states: int, window: int, scale: float, stop_losses: list,
+                   features_path: str, data_path: str = DATA_FILE,
+                   train_end: str = TRAIN_END_DATE, test_start: str = TEST_START_DATE) -> list:
+    """
+    Train one HMM and backtest it for every stop loss (runs inside a worker).
+
+    Returns:
+        List of result rows (params + scalar metrics)
+    """
+    # Read-only view of the shared feature bank
+    features = np.load(features_path, mmap_mode='r')
+    df = load_price_data(data_path, columns=['return'])
+    start_time = time.time()
+
+    # Training observations: same rows prepare_observations would keep
+    train_rows = df.index <= train_end
+    train_obs = np.column_stack([df['return'].values[train_rows], features[train_rows]])
+    train_obs = train_obs[~np.isnan(train_obs).any(axis=1)]
+
+    obs_mean = train_obs.mean(axis=0)
+    obs_std = train_obs.std(axis=0)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        model = train_stage.train_hmm((train_obs - obs_mean) / obs_std, n_states=n_states,
+                                      n_iter=N_ITER, random_state=RANDOM_STATE, verbose=False,
+                                      max_workers=1)
+        state_labels = train_stage.analyze_states(model, n_states)
+
+    model_data = {
+        'model': model,
+        'obs_mean': obs_mean,
+        'obs_std': obs_std,
+        'state_labels': state_labels,
+        'config': {
+            'n_states': n_states,
+            'window': window,
+            'scale': scale,
+            'scales': [scale],
+            'train_end': train_end
+        }
+    }
+    train_time = time.time() - start_time
+
+    results = []
+    backtest_times = []
+    for stop_loss_pct in stop_losses:
+        start_time = time.time()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results_df, _ = backtest_stage.run_backtest(
+                data_path, test_start=test_start, model_data=model_data,
+                features=features, stop_loss_pct=stop_loss_pct, with_metrics=False
+            )
+        results.append(results_df)
+        backtest_times.append(time.time() - start_time)
+
+    # Metrics of every stop-loss variant in one vectorized pass
+    rows = []
+    for stop_loss_pct, metrics, backtest_sec in zip(
+            stop_losses, calculate_metrics_batch(results, INITIAL_CAPITAL), backtest_times):
+        row = {'n_states': n_states, 'window': window, 'scale': scale,
+               'stop_loss_pct': stop_loss_pct, 'converged': model.monitor_.converged,
+               'em_iterations': model.monitor_.iter}
+        row.update({k: v for k, v in metrics.items() if not isinstance(v, dict)})
+        row['train_sec'] = train_time
+        row['backtest_sec'] = backtest_sec
+        rows.append(row)
+
+    return rows
+
+
+def run_sweep(grid: dict = SWEEP_GRID, rank_by: str = SWEEP_RANK_BY,
+              max_workers: int = MAX_WORKERS, data_path: str = DATA_FILE) -> pd.DataFrame:
+    """
+    Evaluate every combination in the grid on a process pool.
+
+    Returns:
+        Metrics table sorted by `rank_by` (best first), with a 'rank' column;
+        empty if every model fit failed
+    """
+    combos = expand_grid(grid)
+    returns = load_price_data(data_path, columns=['return'])['return'].values
+
+    # Group combinations that share a trained model
+    groups = {}
+    for params in combos:
+        key = (params['n_states'], params['window'], params['scale'])
+        groups.setdefault(key, []).append(params['stop_loss_pct'])
+
+    print(f"Sweep: {len(combos)} combinations, {len(groups)} model fits")
+
+    rows = []
+    n_failed = 0
+    with tempfile.TemporaryDirectory() as feature_dir:
+        # Features once per (window, scale), written for workers to memory-map
+        feature_paths = {}
+        for window, scale in sorted({(w, s) for _, w, s in groups}):
+            path = os.path.join(feature_dir, f"features_w{window}_s{scale}.npy")
+            np.save(path, load_feature_bank(returns, window=window, scales=[scale]))
+            feature_paths[(window, scale)] = path
+
+        with worker_pool(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(evaluate_group, n_states, window, scale, stop_losses,
+                            feature_paths[(window, scale)], data_path): (n_states, window, scale)
+                for (n_states, window, scale), stop_losses in groups.items()
+            }
+
+            for future in as_completed(futures):
+                n_states, window, scale = futures[future]
+                try:
+                    rows.extend(future.result())
+                    status = "ok"
+                except Exception as e:
+                    status = f"FAILED ({type(e).__name__}: {e})"
+                    n_failed += 1
+                print(f"  n_states={n_states} window={window} scale={scale}: {status}")
+
+    if n_failed:
+        print(f"{n_failed} of {len(groups)} model fits failed")
+    if not rows:
+        return pd.DataFrame(columns=['rank'])
+
+    results = pd.DataFrame(rows).sort_values(rank_by, ascending=False).reset_index(drop=True)
+    results.insert(0, 'rank', np.arange(1, len(results) + 1))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter sweep")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Process pool size")
+    parser.add_argument("--rank-by", default=SWEEP_RANK_BY, help="Metric used for ranking")
+    args = parser.parse_args()
+
+    # Ensure we're in the right directory
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    results = run_sweep(rank_by=args.rank_by, max_workers=args.workers)
+    if results.empty:
+        print("\nNo combination could be evaluated; nothing saved")
+        sys.exit(1)
+
+    columns = ['rank', 'n_states', 'window', 'scale', 'stop_loss_pct', 'total_return_pct',
+               'sharpe_ratio', 'max_drawdown_pct', 'num_buys']
+    print(f"\nTop combinations by {args.rank_by}:")
+    print(results[columns].head(10).to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results.to_csv(SWEEP_RESULTS_FILE, index=False)
+    print(f"\nSweep results saved to: {SWEEP_RESULTS_FILE}")
+
+
+if __name__ == "__main__":
+    main()
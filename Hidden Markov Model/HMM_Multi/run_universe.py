@@ -0,0 +1,211 @@
+"""
+Universe runner - Train and backtest many tickers in parallel
+- One bounded process pool, one worker task per ticker
+- Per-ticker data, model, results and log under UNIVERSE_DIR/<TICKER>/
+- A failing ticker is recorded in the summary, the batch continues; if a
+  worker process dies, the unfinished tickers are retried once in isolation
+- Optionally fits one shared regime model to all tickers (--shared-model)
+- Optionally renders every ticker's plots afterwards (--reports)
+"""
+
+import argparse
+import contextlib
+import importlib
+import os
+import time
+import traceback
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+from posterior_archive import archive_path_for
+from universe_layout import ticker_paths
+from worker_pool import worker_pool
+from config import (
+    UNIVERSE,
+    UNIVERSE_DIR,
+    MAX_WORKERS,
+    SHARED_MODEL_FILE,
+    DATA_START_DATE,
+    DATA_END_DATE
+)
+
+# Stage scripts start with a digit, so import them by name
+download_stage = importlib.import_module("1_download_data")
+train_stage = importlib.import_module("3_train_hmm")
+backtest_stage = importlib.import_module("4_backtest")
+
+
+def run_ticker(ticker: str, download: bool = True, universe_dir: str = UNIVERSE_DIR) -> dict:
+    """
+    Download, train and backtest one ticker (runs inside a worker process).
+
+    Never raises: failures are returned as a summary row with the error.
+    """
+    paths = ticker_paths(ticker, universe_dir)
+    os.makedirs(os.path.dirname(paths['results']), exist_ok=True)
+    start_time = time.time()
+
+    try:
+        # Keep worker output out of the shared terminal
+        with open(paths['log'], 'w') as log, \
+                contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            if download or not os.path.exists(paths['data']):
+                download_stage.download_ticker_data(ticker, DATA_START_DATE,
+                                                    DATA_END_DATE, paths['data'])
+
+            train_stage.train_and_save(paths['data'], paths['model'], verbose=False,
+                                       max_workers=1)
+
+            results_df, metrics = backtest_stage.run_backtest(
+                paths['data'], paths['model'], archive_path=archive_path_for(paths['results']))
+            results_df.to_csv(paths['results'])
+
+        row = {'ticker': ticker, 'status': 'ok'}
+        row.update({k: v for k, v in metrics.items() if not isinstance(v, dict)})
+
+    except Exception as e:
+        with open(paths['log'], 'a') as log:
+            traceback.print_exc(file=log)
+        row = {'ticker': ticker, 'status': 'failed', 'error': f"{type(e).__name__}: {e}"}
+
+    row['elapsed_sec'] = time.time() - start_time
+    return row
+
+
+def run_isolated(tickers: list, max_workers: int = MAX_WORKERS, download: bool = True,
+                 universe_dir: str = UNIVERSE_DIR):
+    """
+    Run each ticker in its own one-worker pool, up to max_workers at a time.
+
+    A worker that dies only breaks its own pool, so the crash is charged to
+    its ticker alone.
+
+    Yields:
+        Summary rows in completion order
+    """
+    batch_size = max_workers or os.cpu_count() or 1
+    for start in range(0, len(tickers), batch_size):
+        pools = {}
+        try:
+            futures = {}
+            for ticker in tickers[start:start + batch_size]:
+                pools[ticker] = worker_pool(max_workers=1)
+                futures[pools[ticker].submit(run_ticker, ticker, download, universe_dir)] = ticker
+
+            for future in as_completed(futures):
+                ticker = futures[future]
+                try:
+                    yield future.result()
+                except BrokenProcessPool as e:
+                    # Worker process died (e.g. out of memory)
+                    yield {'ticker': ticker, 'status': 'failed',
+                           'error': f"{type(e).__name__}: worker process died"}
+        finally:
+            for pool in pools.values():
+                pool.shutdown()
+
+
+def run_universe(tickers: list = UNIVERSE, max_workers: int = MAX_WORKERS,
+                 download: bool = True, universe_dir: str = UNIVERSE_DIR) -> pd.DataFrame:
+    """
+    Run every ticker through the pipeline on a bounded process pool.
+
+    If a worker process dies, the pool is broken and every unfinished
+    ticker's future fails with it. Those tickers are retried once, each in
+    its own process (run_isolated), so only the ticker that crashed again
+    is recorded as failed.
+
+    Returns:
+        Summary DataFrame (one row per ticker), also saved to summary.csv
+    """
+    os.makedirs(universe_dir, exist_ok=True)
+    rows = []
+
+    def record(row: dict):
+        rows.append(row)
+        status = row['status'].upper()
+        detail = (f"return={row['total_return_pct']:+.2f}%" if row['status'] == 'ok'
+                  else row['error'])
+        print(f"  [{len(rows)}/{len(tickers)}] {row['ticker']:6s} {status:6s} {detail}")
+
+    with worker_pool(max_workers=max_workers) as pool:
+        futures = {pool.submit(run_ticker, ticker, download, universe_dir): ticker
+                   for ticker in tickers}
+
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                row = future.result()
+            except BrokenProcessPool:
+                continue  # A worker died; unfinished tickers are retried below
+            except Exception as e:
+                row = {'ticker': ticker, 'status': 'failed', 'error': f"{type(e).__name__}: {e}"}
+            record(row)
+
+    finished = {row['ticker'] for row in rows}
+    unfinished = [ticker for ticker in tickers if ticker not in finished]
+    if unfinished:
+        print(f"  Worker process died: retrying {len(unfinished)} unfinished ticker(s), "
+              f"one process each")
+        for row in run_isolated(unfinished, max_workers, download, universe_dir):
+            record(row)
+
+    summary = pd.DataFrame(rows).set_index('ticker').sort_index()
+    summary.to_csv(os.path.join(universe_dir, "summary.csv"))
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train and backtest a ticker universe")
+    parser.add_argument("--tickers", nargs="+", default=UNIVERSE, help="Ticker list")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Process pool size")
+    parser.add_argument("--skip-download", action="store_true",
+                        help="Reuse existing per-ticker data files")
+    parser.add_argument("--shared-model", action="store_true",
+                        help="Also fit one HMM to all tickers (batched Baum-Welch)")
+    parser.add_argument("--reports", action="store_true",
+                        help="Render each ticker's plots afterwards (batch_report.py)")
+    args = parser.parse_args()
+
+    # Ensure we're in the right directory
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    print("=" * 70)
+    print(f"UNIVERSE RUN: {len(args.tickers)} tickers, "
+          f"{args.workers or os.cpu_count()} workers")
+    print("=" * 70)
+
+    summary = run_universe(args.tickers, args.workers, download=not args.skip_download)
+
+    n_failed = (summary['status'] != 'ok').sum()
+    print(f"\nCompleted: {len(summary) - n_failed} ok, {n_failed} failed")
+
+    columns = [c for c in ['status', 'total_return_pct', 'buy_hold_return_pct',
+                           'sharpe_ratio', 'max_drawdown_pct', 'num_buys'] if c in summary]
+    print(summary[columns].to_string(float_format=lambda x: f"{x:.2f}"))
+    print(f"\nSummary saved to: {os.path.join(UNIVERSE_DIR, 'summary.csv')}")
+
+    if args.shared_model:
+        # Tickers whose data is available (download succeeded or reused)
+        data_paths = [ticker_paths(ticker)['data'] for ticker in summary.index
+                      if os.path.exists(ticker_paths(ticker)['data'])]
+        print("\n" + "=" * 70)
+        print(f"SHARED MODEL: {len(data_paths)} tickers")
+        print("=" * 70)
+        train_stage.train_shared_and_save(data_paths, SHARED_MODEL_FILE, verbose=False,
+                                          max_workers=args.workers)
+
+    if args.reports:
+        from batch_report import report_job, run_reports
+
+        print("\n" + "=" * 70)
+        print("REPORTS")
+        print("=" * 70)
+        run_reports([report_job(ticker) for ticker in summary.index], args.workers)
+
+
+if __name__ == "__main__":
+    main()
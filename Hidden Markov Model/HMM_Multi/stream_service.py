@@ -0,0 +1,435 @@
+"""
+Streaming Regime Signal Service
+- Runs the trained model live against a bar feed (asyncio)
+- Per bar, in constant time: incremental wavelet energy, forward-filtered
+  regime probabilities, online Viterbi state and the risk manager's action
+- Pluggable input: replayed CSV, local TCP/Unix socket or named pipe,
+  one "date,price[,return]" line per bar
+- Reports per-bar latency (running stats, constant memory on a live feed)
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import math
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+from wavelet_features import right_edge_kernel_bank
+from model_store import load_model
+from price_store import load_price_data
+from config import (
+    DATA_FILE,
+    MODEL_FILE,
+    TEST_START_DATE,
+    STOP_LOSS_PCT
+)
+
+# Stage scripts start with a digit, so import them by name
+backtest_stage = importlib.import_module("4_backtest")
+
+LATENCY_WINDOW = 10_000  # Most recent bars kept for the latency percentiles
+
+
+class IncrementalWaveletEnergy:
+    """
+    Right-edge wavelet energies of the last `window` returns, one bar at a time.
+
+    Returns are kept in a doubled ring buffer so the current window is always
+    a contiguous slice; each update is one (window,) x (window, M) product.
+    Matches extract_wavelet_feature_bank row by row.
+    """
+
+    def __init__(self, window: int, scales: list, wavelets: list = None):
+        kernel = right_edge_kernel_bank(window, scales, wavelets)
+        self.kernel_real = np.ascontiguousarray(kernel.real)
+        self.kernel_imag = np.ascontiguousarray(kernel.imag)
+        self.window = window
+        self.buffer = np.zeros(2 * window)
+        self.count = 0
+        self.last_nan = -window  # Bar index of the most recent NaN return
+
+    def update(self, ret: float) -> np.ndarray:
+        """
+        Add one return.
+
+        Returns:
+            (n_features,) energies, NaN until a full NaN-free window is available
+        """
+        slot = self.count % self.window
+        if math.isnan(ret):
+            self.last_nan = self.count
+            ret = 0.0
+        self.buffer[slot] = ret
+        self.buffer[slot + self.window] = ret
+        self.count += 1
+
+        if self.count < self.window or self.count - 1 - self.last_nan < self.window:
+            return np.full(self.kernel_real.shape[1], np.nan)
+
+        chunk = self.buffer[slot + 1:slot + 1 + self.window]
+        return (chunk @ self.kernel_real) ** 2 + (chunk @ self.kernel_imag) ** 2
+
+
+class OnlineRegimeDecoder:
+    """
+    Per-observation HMM state update: forward filter and online Viterbi.
+
+    - probs: P(state_t | obs_0..t), the filtered regime probabilities
+    - state: last state of the Viterbi path of obs_0..t, the state the
+             backtest decodes for the same day (prefix Viterbi)
+    """
+
+    def __init__(self, model_data: dict):
+        model = model_data['model']
+        self.obs_mean = model_data['obs_mean']
+        self.obs_std = model_data['obs_std']
+        self.means = model.means_
+        self.startprob = model.startprob_
+        self.transmat = model.transmat_
+        with np.errstate(divide='ignore'):
+            self.log_startprob = np.log(model.startprob_)
+            self.log_transmat = np.log(model.transmat_)
+
+        # Whitening factors of each state's covariance, computed once
+        n_features = self.means.shape[1]
+        chols = np.linalg.cholesky(model.covars_)
+        self.prec_chols = np.linalg.inv(chols)
+        self.log_norm = -.5 * (n_features * np.log(2 * np.pi)
+                               + 2 * np.log(np.diagonal(chols, axis1=1, axis2=2)).sum(axis=1))
+
+        self.delta = None  # Viterbi lattice column (log, shifted to max 0)
+        self.probs = None
+
+    def frame_log_likelihood(self, obs: np.ndarray) -> np.ndarray:
+        """Emission log-likelihood of one raw observation under each state."""
+        diff = (obs - self.obs_mean) / self.obs_std - self.means
+        z = np.einsum('kij,kj->ki', self.prec_chols, diff)
+        return self.log_norm - .5 * (z ** 2).sum(axis=1)
+
+    def update(self, obs: np.ndarray) -> tuple:
+        """
+        Advance by one observation.
+
+        Returns:
+            state: Online Viterbi state
+            probs: (K,) filtered state probabilities
+        """
+        framelogprob = self.frame_log_likelihood(obs)
+        frameprob = np.exp(framelogprob - framelogprob.max())
+
+        if self.delta is None:
+            delta = self.log_startprob + framelogprob
+            probs = self.startprob * frameprob
+        else:
+            delta = (self.delta[:, None] + self.log_transmat).max(axis=0) + framelogprob
+            probs = (self.probs @ self.transmat) * frameprob
+
+        # Shift keeps the lattice bounded on endless streams (argmax unchanged)
+        self.delta = delta - delta.max()
+        self.probs = probs / probs.sum()
+
+        return int(np.argmax(self.delta)), self.probs
+
+
+class RegimeSignalEngine:
+    """
+    Turns bars into regime signals and risk-managed actions.
+
+    Follows run_backtest day by day: a bar is traded once `window` valid
+    observations have been seen, and the stop loss / signal / order logic
+    is RegimeHMMRiskManager's.
+    """
+
+    def __init__(self, model_data: dict, stop_loss_pct: float = STOP_LOSS_PCT,
+                 decode: str = 'viterbi'):
+        if decode not in ('viterbi', 'filter'):
+            raise ValueError(f"Unknown decode mode: {decode}")
+
+        config = model_data['config']
+        self.window = config['window']
+        self.decode = decode
+        self.features = IncrementalWaveletEnergy(self.window,
+                                                 config.get('scales', [config['scale']]))
+        self.decoder = OnlineRegimeDecoder(model_data)
+        self.strategy = backtest_stage.HMMStrategy(model_data=model_data)
+        self.risk_mgr = backtest_stage.RegimeHMMRiskManager(stop_loss_pct=stop_loss_pct)
+
+        self.n_valid = 0
+        self.state = None  # State of the last valid observation
+        self.prev_price = None
+
+    def on_bar(self, bar: dict) -> dict:
+        """
+        Process one bar.
+
+        Args:
+            bar: dict with 'date', 'price' and optionally 'return'
+                 (computed from the previous price when missing)
+
+        Returns:
+            dict with the bar, energy, filtered probabilities, state, regime,
+            raw signal, action (None while warming up), portfolio value
+            and latency_us
+        """
+        start_time = time.perf_counter()
+
+        price = bar['price']
+        ret = bar.get('return')
+        if ret is None:
+            ret = np.nan if self.prev_price is None else price / self.prev_price - 1
+        self.prev_price = price
+
+        energies = self.features.update(ret)
+        event = {'date': bar['date'], 'price': price, 'return': ret,
+                 'energy': float(energies[0]), 'probs': None, 'state': None,
+                 'regime': None, 'raw_signal': None, 'action': None,
+                 'stop_triggered': False}
+
+        if not (math.isnan(ret) or np.isnan(energies).any()):
+            self.n_valid += 1
+            state, probs = self.decoder.update(np.concatenate([[ret], energies]))
+            self.state = int(np.argmax(probs)) if self.decode == 'filter' else state
+            event['probs'] = probs.tolist()
+
+        if self.n_valid > 0:
+            event['state'] = self.state
+
+        if self.n_valid >= self.window:
+            regime = self.strategy.get_regime(self.state)
+            stop_triggered = self.risk_mgr.check_stop_loss(price)
+            raw_signal = self.strategy.get_signal(regime, self.risk_mgr.invested)
+            if stop_triggered:
+                raw_signal = 'SELL'
+                regime = 1  # Treat as undesirable to allow exit
+            action = self.risk_mgr.refine_order(regime, raw_signal, price)
+            self.risk_mgr.execute_order(action, price)
+
+            event.update({'regime': regime, 'raw_signal': raw_signal, 'action': action,
+                          'stop_triggered': stop_triggered})
+
+        event['total_value'] = self.risk_mgr.get_total_value(price)
+        event['latency_us'] = (time.perf_counter() - start_time) * 1e6
+        return event
+
+
+# ============================================================================
+# BAR SOURCES
+# ============================================================================
+
+def parse_bar(line: str) -> dict:
+    """Parse a "date,price[,return]" line (None for blank or header lines)."""
+    fields = line.strip().split(',')
+    try:
+        bar = {'date': fields[0], 'price': float(fields[1])}
+        if len(fields) > 2 and fields[2] != '':
+            bar['return'] = float(fields[2])
+    except (IndexError, ValueError):
+        return None
+    return bar
+
+
+async def csv_replay_source(path: str = DATA_FILE, start: str = None, end: str = None,
+                            delay: float = 0.0):
+    """Replay stored bars as a stand-in for a live feed (`delay` seconds apart)."""
+    df = load_price_data(path, columns=['Adj Close', 'return'], start=start, end=end)
+    for date, price, ret in zip(df.index, df['Adj Close'].to_numpy(), df['return'].to_numpy()):
+        yield {'date': str(date.date()), 'price': float(price), 'return': float(ret)}
+        await asyncio.sleep(delay)
+
+
+async def _stream_lines(reader: asyncio.StreamReader):
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        bar = parse_bar(line.decode())
+        if bar is not None:
+            yield bar
+
+
+async def socket_source(host: str = "127.0.0.1", port: int = 9999, unix_path: str = None):
+    """Read bars from a feed server over TCP (or a Unix socket if unix_path is given)."""
+    if unix_path is not None:
+        reader, writer = await asyncio.open_unix_connection(unix_path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    try:
+        async for bar in _stream_lines(reader):
+            yield bar
+    finally:
+        writer.close()
+
+
+async def pipe_source(path: str):
+    """Read bars from a named pipe (created if missing) until the writer closes it."""
+    if not os.path.exists(path):
+        os.mkfifo(path)
+
+    loop = asyncio.get_running_loop()
+    pipe = await loop.run_in_executor(None, open, path, 'rb', 0)  # Blocks until a writer opens
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    try:
+        async for bar in _stream_lines(reader):
+            yield bar
+    finally:
+        transport.close()
+
+
+# ============================================================================
+# SERVICE
+# ============================================================================
+
+def print_event(event: dict):
+    if event['probs'] is None:
+        print(f"{event['date']}  price={event['price']:.2f}  warming up")
+        return
+    probs = " ".join(f"{p:.3f}" for p in event['probs'])
+    regime = {0: 'BULL', 1: 'BEAR', None: '-'}[event['regime']]
+    print(f"{event['date']}  price={event['price']:.2f}  P=[{probs}]  "
+          f"state={event['state']}  regime={regime:4s}  action={event['action'] or '-':4s}  "
+          f"value={event['total_value']:.2f}  {event['latency_us']:.0f}us")
+
+
+def event_to_json(event: dict) -> str:
+    """One event as a JSON line (NaN becomes null)."""
+    return json.dumps({key: None if isinstance(value, float) and math.isnan(value) else value
+                       for key, value in event.items()})
+
+
+def latency_summary(latencies: list) -> dict:
+    """Per-bar latency statistics in microseconds."""
+    values = np.array(latencies)
+    return {
+        'bars': len(values),
+        'mean_us': float(values.mean()),
+        'p50_us': float(np.percentile(values, 50)),
+        'p99_us': float(np.percentile(values, 99)),
+        'max_us': float(values.max())
+    }
+
+
+class LatencyStats:
+    """
+    Running per-bar latency in constant memory (the service may run indefinitely).
+
+    Count, mean and max cover every bar; percentiles cover the last `window` bars.
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.bars = 0
+        self.total_us = 0.0
+        self.max_us = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, latency_us: float):
+        self.bars += 1
+        self.total_us += latency_us
+        self.max_us = max(self.max_us, latency_us)
+        self.recent.append(latency_us)
+
+    def summary(self) -> dict:
+        """Same keys as latency_summary; None before the first bar."""
+        if self.bars == 0:
+            return None
+        stats = latency_summary(self.recent)
+        stats.update(bars=self.bars, mean_us=self.total_us / self.bars, max_us=self.max_us)
+        return stats
+
+
+async def run_service(source, engine: RegimeSignalEngine, sink=print_event,
+                      keep_events: bool = False) -> tuple:
+    """
+    Feed every bar from an async source through the engine.
+
+    Args:
+        keep_events: Also collect every emitted event (finite replays only,
+                     e.g. for verify_replay; a live feed would grow it forever)
+
+    Returns:
+        latency: LatencyStats over all bars
+        events: List of emitted events if keep_events, else None
+    """
+    latency = LatencyStats()
+    events = [] if keep_events else None
+    async for bar in source:
+        event = engine.on_bar(bar)
+        sink(event)
+        latency.add(event['latency_us'])
+        if keep_events:
+            events.append(event)
+    return latency, events
+
+
+def verify_replay(events: list, data_path: str = DATA_FILE, model_path: str = MODEL_FILE,
+                  test_start: str = TEST_START_DATE, stop_loss_pct: float = STOP_LOSS_PCT):
+    """Check that replayed events reproduce run_backtest's states and actions."""
+    results_df, _ = backtest_stage.run_backtest(data_path, model_path, test_start=test_start,
+                                                stop_loss_pct=stop_loss_pct)
+    traded = {e['date']: e for e in events if e['action'] is not None}
+    dates = [str(d.date()) for d in results_df.index]
+
+    assert [traded[d]['state'] for d in dates] == results_df['state'].tolist(), "State mismatch"
+    assert [traded[d]['action'] for d in dates] == results_df['action'].tolist(), "Action mismatch"
+    assert np.allclose([traded[d]['total_value'] for d in dates], results_df['total_value'])
+    print(f"OK: replay matches run_backtest on {len(dates)} trading days")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream regime signals from a bar feed")
+    parser.add_argument("--source", choices=['csv', 'socket', 'pipe'], default='csv')
+    parser.add_argument("--path", default=None,
+                        help="CSV/store to replay, Unix socket or named pipe path")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP feed host")
+    parser.add_argument("--port", type=int, default=9999, help="TCP feed port")
+    parser.add_argument("--start", default=None, help="Replay: first date")
+    parser.add_argument("--delay", type=float, default=0.0, help="Replay: seconds between bars")
+    parser.add_argument("--model", default=MODEL_FILE, help="Model artifact")
+    parser.add_argument("--decode", choices=['viterbi', 'filter'], default='viterbi',
+                        help="State from online Viterbi (as in the backtest) or filtered probabilities")
+    parser.add_argument("--json", action="store_true", help="Emit one JSON object per bar")
+    parser.add_argument("--verify", action="store_true",
+                        help="Replay the backtest period and check it against run_backtest")
+    args = parser.parse_args()
+
+    # Ensure we're in the right directory
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    model_data = load_model(args.model)
+    engine = RegimeSignalEngine(model_data, decode=args.decode)
+
+    if args.verify:
+        # Same history as run_backtest: `window` bars before the test period
+        df = load_price_data(args.path or DATA_FILE, columns=['return'])
+        first_test = df.index.searchsorted(np.datetime64(TEST_START_DATE))
+        args.start = str(df.index[first_test - engine.window].date())
+
+    if args.source == 'csv':
+        source = csv_replay_source(args.path or DATA_FILE, start=args.start, delay=args.delay)
+    elif args.source == 'socket':
+        source = socket_source(args.host, args.port, unix_path=args.path)
+    else:
+        source = pipe_source(args.path or "bars.fifo")
+
+    sink = (lambda event: print(event_to_json(event))) if args.json else print_event
+    latency, events = asyncio.run(run_service(source, engine, sink, keep_events=args.verify))
+
+    stats = latency.summary()
+    if stats is not None:
+        print(f"\nBars: {stats['bars']}, latency mean {stats['mean_us']:.0f}us, "
+              f"p50 {stats['p50_us']:.0f}us, p99 {stats['p99_us']:.0f}us, "
+              f"max {stats['max_us']:.0f}us")
+
+    if args.verify:
+        verify_replay(events, args.path or DATA_FILE, args.model)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+"""
+Universe Layout - where run_universe.py keeps each ticker's files
+- UNIVERSE_DIR/<TICKER>/ with data/, models/, results/ and run.log
+- Kept apart from the runner so readers (batch_report.py) can find the
+  files without importing the pipeline stages
+"""
+
+import os
+
+from config import UNIVERSE_DIR
+
+
+def ticker_paths(ticker: str, universe_dir: str = UNIVERSE_DIR) -> dict:
+    """Per-ticker file layout (mirrors data/, models/, results/)."""
+    root = os.path.join(universe_dir, ticker)
+    return {
+        'root': root,
+        'data': os.path.join(root, "data", f"{ticker}.csv"),
+        'model': os.path.join(root, "models", "hmm_model.npz"),
+        'results': os.path.join(root, "results", "backtest_results.csv"),
+        'log': os.path.join(root, "run.log")
+    }
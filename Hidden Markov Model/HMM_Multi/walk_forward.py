@@ -0,0 +1,267 @@
+"""
+Walk-Forward Backtest with Warm-Started EM Retraining
+- Retrain the HMM every N test days on an expanding or rolling window
+- Each refit starts EM from an earlier fit's parameters (converges in a few
+  iterations instead of up to N_ITER)
+- "anchor" refits are independent and run in parallel
+- Retraining cost reported next to the backtest metrics
+"""
+
+import argparse
+import importlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from hmmlearn.hmm import GaussianHMM
+from feature_cache import load_feature_bank
+from price_store import load_price_data
+from backtest_engine import run_array_engine
+from worker_pool import worker_pool
+from config import (
+    DATA_FILE,
+    TRAIN_END_DATE,
+    TEST_START_DATE,
+    N_STATES,
+    WINDOW,
+    SCALES,
+    N_ITER,
+    RANDOM_STATE,
+    MAX_WORKERS,
+    WF_RETRAIN_EVERY,
+    WF_TRAIN_WINDOW,
+    WF_WARM_START,
+    WF_RESULTS_FILE,
+    WF_RETRAIN_LOG_FILE,
+    RESULTS_DIR
+)
+
+# Stage scripts start with a digit, so import them by name
+train_stage = importlib.import_module("3_train_hmm")
+backtest_stage = importlib.import_module("4_backtest")
+
+
+def warm_start_model(prev_fit: dict, obs_mean: np.ndarray, obs_std: np.ndarray,
+                     n_iter: int = N_ITER, random_state: int = RANDOM_STATE) -> GaussianHMM:
+    """
+    Unfitted GaussianHMM initialized from a previous fit.
+
+    The previous means and covariances are mapped from the previous
+    normalization (prev_fit obs_mean/obs_std) to the new one, so EM starts
+    from exactly the same distribution in raw observation space.
+    """
+    prev = prev_fit['model']
+    ratio = prev_fit['obs_std'] / obs_std
+
+    model = GaussianHMM(
+        n_components=prev.n_components,
+        covariance_type="full",
+        n_iter=n_iter,
+        random_state=random_state,
+        init_params="",     # Keep the parameters set below
+        params="stmc"
+    )
+    model.startprob_ = prev.startprob_.copy()
+    model.transmat_ = prev.transmat_.copy()
+    model.means_ = (prev.means_ * prev_fit['obs_std'] + prev_fit['obs_mean'] - obs_mean) / obs_std
+    model.covars_ = prev.covars_ * np.outer(ratio, ratio)
+
+    return model
+
+
+def fit_segment(train_obs: np.ndarray, prev_fit: dict = None, n_states: int = N_STATES,
+                n_iter: int = N_ITER, random_state: int = RANDOM_STATE) -> dict:
+    """
+    Fit one walk-forward model (cold start if prev_fit is None).
+
+    Args:
+        train_obs: (N, n_features) raw (unnormalized) training observations
+        prev_fit: Earlier fit dict to warm-start from
+
+    Returns:
+        dict with model, obs_mean, obs_std and retraining cost
+    """
+    start_time = time.time()
+
+    obs_mean = train_obs.mean(axis=0)
+    obs_std = train_obs.std(axis=0)
+    train_obs_normalized = (train_obs - obs_mean) / obs_std
+
+    if prev_fit is None:
+        model = train_stage.train_hmm(train_obs_normalized, n_states=n_states, n_iter=n_iter,
+                                      random_state=random_state, verbose=False)
+    else:
+        model = warm_start_model(prev_fit, obs_mean, obs_std, n_iter, random_state)
+        model.fit(train_obs_normalized)
+
+    return {
+        'model': model,
+        'obs_mean': obs_mean,
+        'obs_std': obs_std,
+        'warm_start': prev_fit is not None,
+        'train_rows': len(train_obs),
+        'em_iterations': model.monitor_.iter,
+        'converged': model.monitor_.converged,
+        'log_likelihood': model.monitor_.history[-1],
+        'fit_sec': time.time() - start_time
+    }
+
+
+def run_walk_forward(data_path: str = DATA_FILE, train_end: str = TRAIN_END_DATE,
+                     test_start: str = TEST_START_DATE, retrain_every: int = WF_RETRAIN_EVERY,
+                     train_window: int = WF_TRAIN_WINDOW, warm_start: str = WF_WARM_START,
+                     n_states: int = N_STATES, window: int = WINDOW, scales: list = SCALES,
+                     max_workers: int = MAX_WORKERS) -> tuple:
+    """
+    Walk-forward backtest: retrain every `retrain_every` test days.
+
+    Args:
+        train_window: Number of most recent valid rows per refit (None = expanding)
+        warm_start: 'chain' (previous refit, sequential) or 'anchor'
+                    (initial fit, refits run in parallel)
+
+    Returns:
+        results_df: Daily results (same columns as run_backtest)
+        metrics: calculate_metrics output plus retraining cost
+        retrains_df: One row per fit (cost, EM iterations, likelihood)
+    """
+    if warm_start not in ('chain', 'anchor'):
+        raise ValueError(f"Unknown warm start mode: {warm_start}")
+
+    df = load_price_data(data_path, columns=['Adj Close', 'return'])
+    returns = df['return'].values
+    energies = np.asarray(load_feature_bank(returns, window=window, scales=scales))
+    obs = np.column_stack([returns, energies])
+    valid = ~np.isnan(obs).any(axis=1)
+    positions = np.arange(len(df))
+
+    test_positions = positions[df.index >= test_start]
+    segment_starts = test_positions[::retrain_every]
+
+    def training_rows(end_mask: np.ndarray) -> np.ndarray:
+        rows = obs[valid & end_mask]
+        return rows if train_window is None else rows[-train_window:]
+
+    # Initial cold fit on the training period
+    print(f"Initial fit (cold start) on data up to {train_end}...")
+    fits = [fit_segment(training_rows(df.index <= train_end), n_states=n_states)]
+
+    # Refits at the start of every later segment
+    refit_obs = [training_rows(positions < start) for start in segment_starts[1:]]
+    print(f"Refits: {len(refit_obs)} every {retrain_every} days, warm start = {warm_start}")
+
+    if warm_start == 'chain':
+        for train_obs in refit_obs:
+            fits.append(fit_segment(train_obs, fits[-1], n_states=n_states))
+    else:
+        with worker_pool(max_workers=max_workers) as pool:
+            futures = [pool.submit(fit_segment, train_obs, fits[0], n_states)
+                       for train_obs in refit_obs]
+            fits.extend(future.result() for future in futures)
+
+    # Decoding history matches run_backtest: starts `window` rows before the test
+    lookback_start = test_positions[0] - window
+    hist_obs = obs[lookback_start:].copy()
+    hist_obs[:window - 1, 1:] = np.nan
+    hist_valid = ~np.isnan(hist_obs).any(axis=1)
+    valid_hist_obs = hist_obs[hist_valid]
+    n_valid_through = np.cumsum(hist_valid)
+
+    test_df = df.iloc[test_positions]
+    day_n_valid = n_valid_through[test_positions - lookback_start]
+    segment_of_day = np.searchsorted(segment_starts, test_positions, side='right') - 1
+
+    states = np.zeros(len(test_positions), dtype=int)
+    regimes = np.zeros(len(test_positions), dtype=int)
+    strategies = []
+
+    for k, fit in enumerate(fits):
+        strategy = backtest_stage.HMMStrategy(model_data={
+            'model': fit['model'], 'obs_mean': fit['obs_mean'], 'obs_std': fit['obs_std'],
+            'state_labels': {}, 'config': {}
+        })
+        strategies.append(strategy)
+
+        # Prefix Viterbi over history up to the segment end, with this segment's model
+        in_segment = segment_of_day == k
+        n_end = day_n_valid[in_segment].max()
+        if n_end == 0:
+            continue
+        prefix_states = strategy.predict_states(valid_hist_obs[:n_end])
+        segment_states = prefix_states[np.maximum(day_n_valid[in_segment], 1) - 1]
+        states[in_segment] = segment_states
+        regimes[in_segment] = [strategy.get_regime(state) for state in segment_states]
+
+    tradable = day_n_valid >= window
+    day_energies = valid_hist_obs[np.maximum(day_n_valid, 1) - 1, 1]
+
+    risk_mgr = backtest_stage.RegimeHMMRiskManager()
+    results_df, order_stats = run_array_engine(
+        test_df[tradable], states[tradable], regimes[tradable],
+        day_energies[tradable], risk_mgr
+    )
+    results_df['segment'] = segment_of_day[tradable]
+
+    retrains_df = pd.DataFrame([
+        {'segment': k, 'start_date': df.index[start].date(),
+         **{key: fit[key] for key in ('warm_start', 'train_rows', 'em_iterations',
+                                      'converged', 'log_likelihood', 'fit_sec')}}
+        for k, (fit, start) in enumerate(zip(fits, segment_starts))
+    ])
+
+    metrics = backtest_stage.calculate_metrics(results_df, risk_mgr.initial_capital)
+    refits = retrains_df[retrains_df['warm_start']]
+    metrics.update({
+        'n_refits': len(refits),
+        'initial_fit_sec': fits[0]['fit_sec'],
+        'initial_em_iterations': fits[0]['em_iterations'],
+        'refit_total_sec': refits['fit_sec'].sum(),
+        'refit_mean_em_iterations': refits['em_iterations'].mean() if len(refits) else 0.0,
+        'orders_executed': order_stats['orders_executed'],
+        'orders_blocked': order_stats['orders_blocked']
+    })
+
+    return results_df, metrics, retrains_df
+
+
+def print_retraining_cost(metrics: dict):
+    """Print the retraining cost section of the report."""
+    print("\n--- RETRAINING COST ---")
+    print(f"Initial Fit:         {metrics['initial_fit_sec']:.2f}s "
+          f"({metrics['initial_em_iterations']} EM iterations, cold start)")
+    print(f"Refits:              {metrics['n_refits']}")
+    print(f"Refit Total Time:    {metrics['refit_total_sec']:.2f}s")
+    print(f"Refit Mean EM Iters: {metrics['refit_mean_em_iterations']:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Walk-forward backtest with warm-started EM")
+    parser.add_argument("--every", type=int, default=WF_RETRAIN_EVERY, help="Retrain every N days")
+    parser.add_argument("--train-window", type=int, default=WF_TRAIN_WINDOW,
+                        help="Rolling training window in rows (default: expanding)")
+    parser.add_argument("--warm-start", choices=['chain', 'anchor'], default=WF_WARM_START)
+    args = parser.parse_args()
+
+    # Ensure we're in the right directory
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    print("Running Walk-Forward Backtest (Warm-Started EM Retraining)...")
+    results_df, metrics, retrains_df = run_walk_forward(
+        retrain_every=args.every, train_window=args.train_window, warm_start=args.warm_start
+    )
+
+    backtest_stage.print_report(results_df, metrics,
+                                backtest_stage.confidence_intervals(results_df, metrics))
+    print_retraining_cost(metrics)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_df.to_csv(WF_RESULTS_FILE)
+    retrains_df.to_csv(WF_RETRAIN_LOG_FILE, index=False)
+    print(f"\nResults saved to: {WF_RESULTS_FILE}")
+    print(f"Retrain log saved to: {WF_RETRAIN_LOG_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Worker Process Pools
+- Process pools for the EM restarts, batched E-step and batch scripts
+- Each worker is limited to one BLAS/OpenMP thread at startup: the pool
+  provides the parallelism, so workers do not oversubscribe the cores
+- The parent process keeps its own thread settings (importing this module
+  changes nothing)
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+from threadpoolctl import threadpool_limits
+
+WORKER_THREADS = 1
+
+
+def limit_threads(n_threads: int = WORKER_THREADS):
+    """Limit the BLAS/OpenMP thread pools of this process (for the rest of its life)."""
+    threadpool_limits(limits=n_threads)
+
+
+def _init_worker(initializer=None, initargs: tuple = ()):
+    limit_threads()
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def worker_pool(max_workers: int = None, initializer=None, initargs: tuple = ()) -> ProcessPoolExecutor:
+    """
+    ProcessPoolExecutor whose workers run with one BLAS thread each.
+
+    Args:
+        max_workers: Pool size (None = CPU count)
+        initializer: Optional per-worker setup, run after the thread limit
+        initargs: Arguments for initializer
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                               initargs=(initializer, initargs))
+
+
+if __name__ == "__main__":
+    # Quick test: workers see one BLAS thread, the parent keeps its own
+    from threadpoolctl import threadpool_info
+
+    def max_threads(info: list) -> int:
+        return max((pool['num_threads'] for pool in info), default=1)
+
+    parent_before = max_threads(threadpool_info())
+    with worker_pool(max_workers=2) as pool:
+        worker_threads = max_threads(pool.submit(threadpool_info).result())
+
+    print("Test worker pool:")
+    assert worker_threads == WORKER_THREADS, worker_threads
+    assert max_threads(threadpool_info()) == parent_before
+    print(f"  OK: workers {worker_threads} thread(s), parent {parent_before}")